@@ -0,0 +1,817 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks do MAG
+Mede o custo local (sem chamadas de rede à API Gemini) de partes críticas do sistema.
+
+Uso:
+    GEMINI_API_KEY=qualquer python benchmark_mag.py [nome_do_benchmark]
+"""
+
+import os
+import sys
+import time
+import datetime
+import tempfile
+import threading
+import statistics
+import glob
+import hashlib
+import json
+import asyncio
+import tracemalloc
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A configuração da API apenas registra a chave; nenhum benchmark faz chamadas reais
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-offline")
+
+import mag
+
+
+def _per_call_us(total_seconds, calls):
+    return (total_seconds / calls) * 1_000_000
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class _LocalPageHandler(BaseHTTPRequestHandler):
+    """Servidor HTTP/1.1 local com keep-alive; páginas registradas em server.pages (caminho -> (status, headers, corpo))."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # evita o atraso de 40 ms (Nagle + delayed ACK) em conexões keep-alive
+
+    def do_GET(self):
+        status, headers, body = self.server.pages.get(self.path, (200, {"Content-Type": "text/html; charset=utf-8"},
+                                                                  b"<html><head><title>Local</title></head><body>ok</body></html>"))
+        delay = self.server.delays.get(self.path, 0)
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # clientes que encerram a leitura cedo (downloads parciais) resetam a conexão
+
+
+def _start_local_server(pages=None, delays=None):
+    """Sobe o servidor local numa thread e retorna (server, base_url)."""
+    server = _QuietHTTPServer(("127.0.0.1", 0), _LocalPageHandler)
+    server.daemon_threads = True
+    server.pages = pages or {}
+    server.delays = delays or {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_model_registry(num_tasks=50, rounds=5):
+    """Compara a construção de GenerativeModel a cada chamada com o reuso via ModelRegistry."""
+    print(f"=== ModelRegistry: plano de {num_tasks} tarefas ===")
+
+    # Um plano típico: 1 decomposição + (router + worker) por tarefa
+    router_config = {"temperature": 0.3, "response_mime_type": "application/json"}
+    worker_config = {"tools": mag.AVAILABLE_TOOL_DECLARATIONS, "temperature": 0.4}
+    planner_config = {"temperature": 0.5, "response_mime_type": "application/json"}
+    configs = [planner_config] + [router_config, worker_config] * num_tasks
+
+    def build_every_call():
+        for config in configs:
+            model_name, safety, tools, params = mag.split_gen_config(config)
+            model = mag.genai.GenerativeModel(
+                model_name=model_name,
+                safety_settings=safety,
+                generation_config=mag.genai.GenerationConfig(**params),
+                tools=tools
+            )
+
+    def use_registry():
+        for config in configs:
+            model_name, safety, tools, params = mag.split_gen_config(config)
+            mag.MODEL_REGISTRY.get(model_name, safety, tools, params)
+
+    mag.MODEL_REGISTRY.clear()
+    results = {}
+    for label, fn in (("sem registro", build_every_call), ("com registro", use_registry)):
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        results[label] = best
+        print(f"  {label:>13}: {best * 1000:8.2f} ms por plano | {_per_call_us(best, len(configs)):8.1f} µs por chamada")
+
+    saved = results["sem registro"] - results["com registro"]
+    print(f"  Economia: {saved * 1000:.2f} ms por plano ({len(configs)} chamadas)")
+    print(f"  Registro: {mag.MODEL_REGISTRY.stats()}")
+
+
+def bench_local_router(rounds=2000):
+    """Latência do fast-path local do RouterAgent (memo, regras como prior do modelo e modelo bag-of-words)."""
+    print(f"=== RouterAgent: roteamento local ({rounds} decisões por caso) ===")
+    router = mag.RouterAgent()
+    router.local_model = mag.LocalRoutingModel().fit([
+        ("escreva um poema sobre o mar", "text_worker"),
+        ("escreva um resumo do relatorio", "text_worker"),
+        ("resolva este problema de logica passo a passo", "thinking_worker"),
+        ("avalie os riscos do plano de negocio", "thinking_worker"),
+        ("gere uma imagem de um por do sol", "image_worker"),
+        ("crie uma ilustracao de um robo", "image_worker"),
+    ] * (mag.ROUTER_MIN_TRAINING_SAMPLES // 6 + 1))
+    router.decision_memo["traduza o texto para ingles"] = ("text_worker", "memo")
+
+    cases = {
+        "memo": "Traduza o texto para inglês",
+        "regras": "Gere uma imagem de um gato astronauta",
+        "modelo": "Escreva um poema curto",
+    }
+    for label, task in cases.items():
+        start = time.perf_counter()
+        for _ in range(rounds):
+            decision = router._route_locally(task)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:>7}: {_per_call_us(elapsed, rounds):7.1f} µs por decisão -> {decision}")
+
+
+def bench_logger(messages=20000):
+    """Custo por mensagem na thread chamadora: log antigo (abre o arquivo a cada mensagem) vs. BackgroundLogWriter."""
+    print(f"=== Log: {messages} mensagens (payloads de até 8 KB) ===")
+    payloads = [f"Resultado da função fetch_webpage_content: {{'content': '{'x' * (i % 8000)}'}}" for i in range(messages)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.txt")
+
+        def legacy_log_message(message, source="Sistema"):
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with open(legacy_path, "a", encoding="utf-8") as f:
+                f.write(f"[{timestamp}] [{source}]: {message}\n")
+
+        start = time.perf_counter()
+        for payload in payloads:
+            legacy_log_message(payload, "Worker")
+        legacy = time.perf_counter() - start
+
+        writer = mag.BackgroundLogWriter(os.path.join(tmp, "novo.txt"), os.path.join(tmp, "novo.jsonl"),
+                                         queue_size=messages + 10)
+        original_writer, mag.LOG_WRITER = mag.LOG_WRITER, writer
+        try:
+            start = time.perf_counter()
+            for payload in payloads:
+                mag.log_message(payload, "Worker", event="tool_result", duration=0.1)
+            buffered = time.perf_counter() - start
+            writer.flush(timeout=60)
+            drained = time.perf_counter() - start
+        finally:
+            mag.LOG_WRITER = original_writer
+            writer.close()
+
+    print(f"  {'antigo':>14}: {_per_call_us(legacy, messages):8.1f} µs por mensagem")
+    print(f"  {'em segundo plano':>14}: {_per_call_us(buffered, messages):8.1f} µs por mensagem "
+          f"(fila drenada em {drained:.2f}s, descartadas: {writer.dropped})")
+
+
+def bench_http_pool(requests_per_round=400, workers=8):
+    """Vazão e p95 contra um servidor local: requests.get avulso vs. sessão compartilhada (http_get)."""
+    print(f"=== HTTP: {requests_per_round} GETs com {workers} threads (servidor local) ===")
+    server, base_url = _start_local_server()
+    urls = [f"{base_url}/pagina/{i % 20}" for i in range(requests_per_round)]
+
+    def bare_get(url):
+        start = time.perf_counter()
+        requests.get(url, headers={"User-Agent": mag.HTTP_USER_AGENT}, timeout=15).content
+        return time.perf_counter() - start
+
+    def pooled_get(url):
+        start = time.perf_counter()
+        mag.http_get(url).content
+        return time.perf_counter() - start
+
+    try:
+        for label, fn in (("requests.get", bare_get), ("http_get", pooled_get)):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                start = time.perf_counter()
+                latencies = list(pool.map(fn, urls))
+                elapsed = time.perf_counter() - start
+            print(f"  {label:>12}: {requests_per_round / elapsed:8.0f} req/s | "
+                  f"p50 {statistics.median(latencies) * 1000:6.2f} ms | p95 {_percentile(latencies, 95) * 1000:6.2f} ms")
+    finally:
+        server.shutdown()
+
+
+def bench_search_titles(num_pages=5, slow_delay=1.0, body_kb=512):
+    """Enriquecimento de títulos do google_search: busca sequencial do corpo inteiro vs. fetch_page_titles."""
+    print(f"=== Títulos de busca: {num_pages} páginas de {body_kb} KB, uma lenta ({slow_delay}s) e uma travada ===")
+    body = (b"<html><head><title>Pagina &amp; Teste</title></head><body>" + b"x" * (body_kb * 1024) + b"</body></html>")
+    pages = {f"/p{i}": (200, {"Content-Type": "text/html; charset=utf-8"}, body) for i in range(num_pages)}
+    delays = {"/p0": slow_delay, "/p1": 30}
+    server, base_url = _start_local_server(pages, delays)
+    urls = [f"{base_url}/p{i}" for i in range(num_pages)]
+
+    try:
+        start = time.perf_counter()
+        for url in urls:  # laço antigo: corpo inteiro, uma página por vez, 10s de timeout
+            try:
+                response = requests.get(url, timeout=10)
+                mag.BeautifulSoup(response.content, "html.parser").find("title")
+            except requests.RequestException:
+                pass
+        sequential = time.perf_counter() - start
+        print(f"  {'sequencial':>12}: {sequential:6.2f} s")
+
+        start = time.perf_counter()
+        titles = mag.fetch_page_titles(urls, deadline=2 * slow_delay)
+        concurrent = time.perf_counter() - start
+        found = sum(1 for outcome in titles.values() if not isinstance(outcome, Exception) and outcome[1] == "Pagina & Teste")
+        print(f"  {'concorrente':>12}: {concurrent:6.2f} s | títulos obtidos {found}/{num_pages} "
+              f"(lidos no máximo {mag.SEARCH_TITLE_MAX_BYTES // 1024} KB por página)")
+    finally:
+        server.shutdown()
+
+
+def _documentation_page(paragraphs=400):
+    rows = "".join(f"<p>Seção {i}: parâmetro <code>opcao_{i}</code> controla o comportamento {i % 7}.</p>"
+                   for i in range(paragraphs))
+    return (f"<html><head><title>Documentação</title><script>var x = 1;</script></head>"
+            f"<body><nav>menu</nav>{rows}</body></html>").encode("utf-8")
+
+
+def bench_http_cache(fetches=30):
+    """fetch_webpage_content repetido na mesma página: sem cache, com hit (max-age) e com revalidação (ETag + 304)."""
+    print(f"=== Cache HTTP: {fetches} buscas da mesma página de documentação ===")
+    body = _documentation_page()
+    etag = '"doc-v1"'
+
+    class ConditionalHandler(_LocalPageHandler):
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            super().do_GET()
+
+    server = _QuietHTTPServer(("127.0.0.1", 0), ConditionalHandler)
+    server.pages = {
+        "/fresh": (200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "max-age=3600"}, body),
+        "/etag": (200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "no-cache", "ETag": etag}, body),
+    }
+    server.delays = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    original_cache = mag.HTTP_CACHE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            scenarios = (
+                ("sem cache", mag.HttpCache(tmp, enabled=False), "/fresh"),
+                ("hit", mag.HttpCache(os.path.join(tmp, "hit")), "/fresh"),
+                ("revalidação", mag.HttpCache(os.path.join(tmp, "etag")), "/etag"),
+            )
+            for label, cache, path in scenarios:
+                mag.HTTP_CACHE = cache
+                start = time.perf_counter()
+                for _ in range(fetches):
+                    mag.fetch_webpage_content(base_url + path)
+                elapsed = time.perf_counter() - start
+                print(f"  {label:>12}: {elapsed / fetches * 1000:7.2f} ms por busca | {cache.stats()}")
+    finally:
+        mag.HTTP_CACHE = original_cache
+        server.shutdown()
+
+
+def _html_fixtures():
+    """Corpus de HTML: arquivos *.html de MAG_BENCH_HTML_DIR (páginas reais salvas) ou páginas sintéticas grandes."""
+    fixture_dir = os.environ.get("MAG_BENCH_HTML_DIR")
+    if fixture_dir:
+        fixtures = {}
+        for path in sorted(glob.glob(os.path.join(fixture_dir, "*.html"))):
+            with open(path, "rb") as f:
+                fixtures[os.path.basename(path)] = f.read()
+        if fixtures:
+            return fixtures
+    nav = "".join(f"<li><a href='/docs/secao-{i}'>Seção {i}</a></li>" for i in range(300))
+    table = "".join(f"<tr><td>opcao_{i}</td><td>{i * 3}</td><td><a href='https://exemplo.com/ref/{i}'>ref {i}</a></td></tr>"
+                    for i in range(1500))
+    article = "".join(f"<h2>Tópico {i}</h2><p>Descrição detalhada do tópico {i} com <b>ênfase</b> e "
+                      f"<a href='#t{i}'>âncora</a>.</p>" for i in range(1500))
+    scripts = "<script>" + "var dado = {'chave': 'valor'};" * 3000 + "</script>"
+    head = "<head><meta charset='utf-8'><title>Documentação de Referência</title><style>p { margin: 0 }</style></head>"
+    return {
+        "documentacao.html": f"<html>{head}<body><nav><ul>{nav}</ul></nav><article>{article}</article></body></html>".encode(),
+        "tabela.html": f"<html>{head}<body><table>{table}</table>{scripts}</body></html>".encode(),
+    }
+
+
+def bench_html_parsing(rounds=3):
+    """Texto e links: BeautifulSoup('html.parser') sobre bytes (antigo) vs. extract_page_text/extract_page_links por backend."""
+    fixtures = _html_fixtures()
+    backends = [b for b in ("selectolax", "lxml", "html.parser") if mag.resolve_html_backend(b) == b]
+    print(f"=== Parsing HTML: {len(fixtures)} documentos, backends disponíveis: {', '.join(backends)} ===")
+
+    def best_of(fn):
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
+
+    def legacy_text(content):
+        soup = mag.BeautifulSoup(content, "html.parser")
+        for tag in soup(mag.HTML_NOISE_TAGS):
+            tag.decompose()
+        return soup.get_text()
+
+    def legacy_links(content):
+        return [a["href"] for a in mag.BeautifulSoup(content, "html.parser").find_all("a", href=True)]
+
+    for name, content in fixtures.items():
+        print(f"  {name} ({len(content) // 1024} KB)")
+        print(f"    {'antigo':>12}: texto {best_of(lambda: legacy_text(content)):8.1f} ms | "
+              f"links {best_of(lambda: legacy_links(content)):8.1f} ms")
+        for backend in backends:
+            text_ms = best_of(lambda: mag.extract_page_text(content, backend=backend))
+            links_ms = best_of(lambda: mag.extract_page_links(content, "https://exemplo.com/", backend=backend))
+            print(f"    {backend:>12}: texto {text_ms:8.1f} ms | links {links_ms:8.1f} ms")
+
+
+def bench_web_fetch(paragraphs=20000):
+    """fetch_webpage_content numa página grande: download completo + parsing (antigo) vs. streaming com orçamento."""
+    body = _documentation_page(paragraphs)
+    print(f"=== Download: página de {len(body) // 1024} KB ===")
+    server, base_url = _start_local_server({"/grande": (200, {"Content-Type": "text/html; charset=utf-8"}, body)})
+
+    def legacy_fetch():
+        response = requests.get(base_url + "/grande", timeout=15)
+        text = mag.extract_page_text(response.content)[1][:mag.WEB_TEXT_MAX_CHARS]
+        return len(response.content), text
+
+    def streaming_fetch():
+        result = mag.fetch_webpage_content(base_url + "/grande")
+        return mag.HTTP_CACHE.stats().get("bytes_transferred", 0), result["content"]
+
+    original_cache = mag.HTTP_CACHE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            mag.HTTP_CACHE = mag.HttpCache(tmp, enabled=False)
+            for label, fn in (("antigo", legacy_fetch), ("streaming", streaming_fetch)):
+                tracemalloc.start()
+                start = time.perf_counter()
+                transferred, text = fn()
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"  {label:>10}: {elapsed * 1000:7.1f} ms | {transferred // 1024:6d} KB transferidos | "
+                      f"pico de memória Python {peak // 1024:6d} KB | {len(text)} caracteres")
+        print(f"  Pico de RSS do processo: {mag.peak_rss_kb()} KB")
+    finally:
+        mag.HTTP_CACHE = original_cache
+        server.shutdown()
+
+
+def bench_page_cache(searches=5):
+    """navigate + search_content repetidos + extract_links na mesma URL: sem cache de páginas vs. PAGE_CACHE."""
+    print(f"=== Páginas da sessão: navigate + {searches} search_content + extract_links ===")
+    requests_seen = []
+
+    class CountingHandler(_LocalPageHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            super().do_GET()
+
+    server = _QuietHTTPServer(("127.0.0.1", 0), CountingHandler)
+    server.pages = {"/doc": (200, {"Content-Type": "text/html; charset=utf-8"}, _documentation_page(2000))}
+    server.delays = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/doc"
+
+    original_caches = mag.HTTP_CACHE, mag.PAGE_CACHE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, page_cache in (("sem cache", mag.PageCache(ttl_seconds=0)), ("PAGE_CACHE", mag.PageCache())):
+                mag.HTTP_CACHE, mag.PAGE_CACHE = mag.HttpCache(tmp, enabled=False), page_cache
+                requests_seen.clear()
+                start = time.perf_counter()
+                mag.browser_automation("navigate", url)
+                for i in range(searches):
+                    mag.browser_automation("search_content", url, f"opcao_{i * 17}")
+                mag.browser_automation("extract_links", url)
+                elapsed = time.perf_counter() - start
+                print(f"  {label:>10}: {elapsed * 1000:7.1f} ms | {len(requests_seen)} GETs | {page_cache.stats()}")
+    finally:
+        mag.HTTP_CACHE, mag.PAGE_CACHE = original_caches
+        server.shutdown()
+
+
+def bench_page_index(pages=200, queries=200):
+    """Índice da sessão: indexação incremental e consultas BM25 vs. varredura com str.find em todas as páginas."""
+    print(f"=== Índice de texto: {pages} páginas, {queries} consultas ===")
+    texts = {f"https://exemplo.com/doc/{i}": " ".join(f"Seção {j}: o parâmetro opcao_{(i * 31 + j) % 5000} controla o "
+                                                   f"comportamento {j % 7} do módulo {i}." for j in range(300))
+             for i in range(pages)}
+    index = mag.PageIndex()
+    start = time.perf_counter()
+    for url, text in texts.items():
+        index.add(url, url, text)
+    build = time.perf_counter() - start
+    print(f"  indexação: {build * 1000:7.1f} ms ({_per_call_us(build, pages) / 1000:.2f} ms por página)")
+
+    words = [f"opcao_{(i * 97) % 5000}" for i in range(queries)]
+    start = time.perf_counter()
+    for word in words:
+        [(url, text.lower().find(word)) for url, text in texts.items() if word in text.lower()]
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    for word in words:
+        index.search(word)
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    for word in words:
+        index.search(f'"parâmetro {word} controla"')
+    phrase = time.perf_counter() - start
+    print(f"  {'str.find':>10}: {_per_call_us(scan, queries) / 1000:7.2f} ms por consulta (só a primeira ocorrência, sem ranking)")
+    print(f"  {'BM25':>10}: {_per_call_us(indexed, queries) / 1000:7.2f} ms por consulta (todas as ocorrências, ranqueadas)")
+    print(f"  {'frase':>10}: {_per_call_us(phrase, queries) / 1000:7.2f} ms por consulta")
+
+
+def bench_crawl(site_pages=40, latency=0.1):
+    """Exploração de um site local: navigate + extract_links uma URL por vez vs. crawl_site paralelo."""
+    print(f"=== Crawl: site local com {site_pages} páginas, {latency * 1000:.0f} ms de latência por página ===")
+    pages = {}
+    for i in range(site_pages):
+        links = "".join(f"<li><a href='/p{j}'>Página {j}</a></li>" for j in (2 * i + 1, 2 * i + 2) if j < site_pages)
+        pages[f"/p{i}"] = (200, {"Content-Type": "text/html; charset=utf-8"},
+                           f"<html><head><title>Página {i}</title></head><body><p>Conteúdo da página {i}.</p>"
+                           f"<ul>{links}</ul></body></html>".encode())
+    pages["/robots.txt"] = (200, {"Content-Type": "text/plain"}, b"User-agent: *\nAllow: /\n")
+    server, base_url = _start_local_server(pages, {path: latency for path in pages})
+
+    original_caches = mag.HTTP_CACHE, mag.PAGE_CACHE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            mag.HTTP_CACHE, mag.PAGE_CACHE = mag.HttpCache(tmp, enabled=False), mag.PageCache()
+            start = time.perf_counter()
+            queue, seen = [base_url + "/p0"], {base_url + "/p0"}
+            while queue and len(seen) <= site_pages:
+                url = queue.pop(0)
+                mag.browser_automation("navigate", url)
+                for link in mag.browser_automation("extract_links", url).get("links", []):
+                    if link["url"] not in seen:
+                        seen.add(link["url"])
+                        queue.append(link["url"])
+            sequential = time.perf_counter() - start
+            print(f"  {'sequencial':>10}: {sequential:6.2f} s para {len(seen)} páginas (+1 ida e volta ao LLM por página)")
+
+            mag.PAGE_CACHE = mag.PageCache()
+            start = time.perf_counter()
+            visited, stats = mag.crawl_site(base_url + "/p0", max_depth=10, max_pages=site_pages, host_delay=0)
+            crawled = time.perf_counter() - start
+            print(f"  {'crawl':>10}: {crawled:6.2f} s para {len(visited)} páginas | {stats}")
+    finally:
+        mag.HTTP_CACHE, mag.PAGE_CACHE = original_caches
+        server.shutdown()
+
+
+def bench_search_cache(workers=6, backend_seconds=0.5):
+    """Consultas repetidas/equivalentes de vários Workers: busca direta vs. google_search com SEARCH_CACHE."""
+    queries = ["Python asyncio tutorial", "python  asyncio tutorial?", "PYTHON ASYNCIO TUTORIAL",
+               "gemini api limites", "Gemini API limites", "rust ownership"] * 2
+    print(f"=== Cache de buscas: {len(queries)} consultas ({len({mag.normalize_search_query(q) for q in queries})} distintas), "
+          f"{workers} Workers, backend de {backend_seconds}s ===")
+    backend_calls = []
+
+    def fake_search(query, num_results, sleep_interval):
+        backend_calls.append(query)
+        time.sleep(backend_seconds)  # raspagem + sleep_interval
+        return iter(f"https://exemplo.com/{abs(hash(query)) % 1000}/{i}" for i in range(num_results))
+
+    original = mag.search, mag.fetch_page_titles, mag.SEARCH_CACHE
+    mag.search = fake_search
+    mag.fetch_page_titles = lambda urls: {url: (200, "Título") for url in urls}
+    try:
+        for label, fn in (("direto", lambda q: mag._search_with_titles(q, 5)), ("SEARCH_CACHE", lambda q: mag.google_search(q, 5))):
+            mag.SEARCH_CACHE = mag.SearchCache()
+            backend_calls.clear()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fn, queries))
+            elapsed = time.perf_counter() - start
+            print(f"  {label:>12}: {elapsed:5.2f} s | {len(backend_calls)} buscas no backend | {mag.SEARCH_CACHE.stats()}")
+    finally:
+        mag.search, mag.fetch_page_titles, mag.SEARCH_CACHE = original
+
+
+def bench_chunk_selection(pages=40):
+    """Truncagem em WEB_TEXT_MAX_CHARS vs. select_relevant_chunks: tamanho do texto devolvido e taxa de acerto do trecho certo."""
+    print(f"=== Trechos relevantes: {pages} páginas longas com o fato procurado em posições variadas ===")
+    facts = [(f"limite de requisições do serviço {i}", f"O serviço {i} aceita {i * 7 + 3} requisições por minuto por chave.")
+             for i in range(pages)]
+    results = {"truncagem": [0, 0], "trechos": [0, 0]}
+    elapsed = 0.0
+    for i, (query, fact) in enumerate(facts):
+        filler = [f"<p>Texto genérico {j} sobre navegação, cookies e termos de uso do portal {i}.</p>" for j in range(2500)]
+        filler.insert((i * 61) % len(filler), f"<h2>Cotas</h2><p>{fact}</p>")
+        text = mag.extract_page_text(f"<html><body>{''.join(filler)}</body></html>")[1]
+        truncated = text[:mag.WEB_TEXT_MAX_CHARS]
+        start = time.perf_counter()
+        selected, _ = mag.select_relevant_chunks(text, query)
+        elapsed += time.perf_counter() - start
+        for label, content in (("truncagem", truncated), ("trechos", selected)):
+            results[label][0] += fact in content
+            results[label][1] += len(content)
+    for label, (hits, chars) in results.items():
+        print(f"  {label:>10}: acerto {hits}/{pages} | {chars / pages / mag.CONTEXT_CHARS_PER_TOKEN:7.0f} tokens por página")
+    print(f"  Seleção: {elapsed / pages * 1000:.1f} ms por página")
+
+
+class _FakeFile:
+    """Arquivo da File API simulada: fica PROCESSING até ready_at."""
+
+    def __init__(self, name, ready_at):
+        self.name = name
+        self.ready_at = ready_at
+
+    @property
+    def state(self):
+        return type("State", (), {"name": "ACTIVE" if time.monotonic() >= self.ready_at else "PROCESSING"})
+
+
+def bench_uploads(files=40, file_kb=256, upload_seconds=0.15, processing_seconds=0.4):
+    """Upload de um glob: laço sequencial antigo (upload + sleep 0.5s) vs. upload_files paralelo com espera por ACTIVE."""
+    print(f"=== Uploads: {files} arquivos de {file_kb} KB (File API simulada: {upload_seconds}s por envio, "
+          f"{processing_seconds}s de processamento) ===")
+    registry = {}
+    calls = {"upload": 0}
+
+    def fake_upload_file(path, mime_type=None, display_name=None):
+        calls["upload"] += 1
+        time.sleep(upload_seconds)
+        name = f"files/{len(registry)}-{os.path.basename(path)}"
+        registry[name] = _FakeFile(name, time.monotonic() + processing_seconds)
+        return registry[name]
+
+    original = mag.genai.upload_file, mag.genai.get_file
+    mag.genai.upload_file = fake_upload_file
+    mag.genai.get_file = lambda name: registry[name]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(files):
+                path = os.path.join(tmp, f"doc_{i}.txt")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(file_kb * 1024))
+                paths.append(path)
+
+            start = time.perf_counter()
+            for path in paths:
+                mag.genai.upload_file(path=path, mime_type="text/plain")
+                time.sleep(0.5)
+            sequential = time.perf_counter() - start
+            print(f"  {'sequencial':>10}: {sequential:6.2f} s (sem esperar ACTIVE)")
+
+            _, _, report = mag.upload_files(paths, poll_seconds=0.05, manifest=None)
+            print(f"  {'paralelo':>10}: {report['elapsed_s']:6.2f} s (todos ACTIVE) | {report['mb_per_s']} MB/s | "
+                  f"{report['files_per_s']} arquivos/s | falhas: {len(report['failed'])}")
+    finally:
+        mag.genai.upload_file, mag.genai.get_file = original
+
+
+def bench_upload_dedup(files=40, file_kb=256, changed=4, upload_seconds=0.15, large_mb=64):
+    """Segunda sessão com os mesmos arquivos: manifesto de SHA-256 reutiliza os remotos e só reenvia os alterados."""
+    print(f"=== Deduplicação de uploads: {files} arquivos de {file_kb} KB, {changed} alterados entre sessões ===")
+    registry = {}
+    calls = {"upload": 0}
+
+    def fake_upload_file(path, mime_type=None, display_name=None):
+        calls["upload"] += 1
+        time.sleep(upload_seconds)
+        name = f"files/{len(registry)}-{os.path.basename(path)}"
+        registry[name] = _FakeFile(name, time.monotonic())
+        return registry[name]
+
+    def fake_get_file(name):
+        if name not in registry:
+            raise mag.google_exceptions.NotFound(name)
+        return registry[name]
+
+    original = mag.genai.upload_file, mag.genai.get_file
+    mag.genai.upload_file, mag.genai.get_file = fake_upload_file, fake_get_file
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(files):
+                path = os.path.join(tmp, f"doc_{i}.txt")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(file_kb * 1024))
+                paths.append(path)
+            manifest_path = os.path.join(tmp, "cache", "manifest.json")
+
+            for session in ("1ª sessão", "2ª sessão"):
+                if session == "2ª sessão":
+                    for path in paths[:changed]:
+                        with open(path, "ab") as f:
+                            f.write(b"alterado")
+                calls["upload"] = 0
+                manifest = mag.UploadManifest(path=manifest_path)
+                _, _, report = mag.upload_files(paths, poll_seconds=0.05, manifest=manifest)
+                print(f"  {session}: {report['elapsed_s']:5.2f} s | enviados: {report['uploaded']} | "
+                      f"reutilizados: {report['reused']} | chamadas upload_file: {calls['upload']} | "
+                      f"hashes calculados: {manifest.counters['hashed']}")
+
+            large = os.path.join(tmp, "grande.bin")
+            with open(large, "wb") as f:
+                for _ in range(large_mb):
+                    f.write(os.urandom(1024 * 1024))
+            start = time.perf_counter()
+            mag.file_sha256(large)
+            streamed = time.perf_counter() - start
+            streamed_rss = mag.peak_rss_kb()
+            start = time.perf_counter()
+            with open(large, "rb") as f:
+                hashlib.sha256(f.read()).hexdigest()
+            whole = time.perf_counter() - start
+            print(f"  SHA-256 de {large_mb} MB: em blocos {streamed * 1000:.0f} ms (pico RSS {streamed_rss} KB) | "
+                  f"arquivo inteiro {whole * 1000:.0f} ms (pico RSS {mag.peak_rss_kb()} KB)")
+    finally:
+        mag.genai.upload_file, mag.genai.get_file = original
+
+
+def bench_file_cleanup(files=80, delete_seconds=0.05, throttle_every=25):
+    """Limpeza de arquivos remotos: laço sequencial antigo (delete + sleep 0.2s) vs. cleanup_remote_files concorrente."""
+    print(f"=== Limpeza de {files} arquivos remotos (delete simulado: {delete_seconds}s; 429 a cada {throttle_every}) ===")
+    calls = {"delete": 0}
+    lock = threading.Lock()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    remote = [type("File", (), {"name": f"files/{i}", "display_name": f"{'rascunho' if i % 2 else 'relatorio'}_{i}.md",
+                                "create_time": now - datetime.timedelta(hours=i % 72)})() for i in range(files)]
+
+    def fake_delete_file(name):
+        with lock:
+            calls["delete"] += 1
+            throttled = calls["delete"] % throttle_every == 0
+        time.sleep(delete_seconds)
+        if throttled:
+            raise mag.google_exceptions.ResourceExhausted("Quota exceeded, retry in 0.5s")
+
+    original = mag.genai.delete_file
+    mag.genai.delete_file = fake_delete_file
+    try:
+        start = time.perf_counter()
+        for file_obj in remote:
+            try: mag.genai.delete_file(name=file_obj.name); time.sleep(0.2)
+            except Exception: pass
+        sequential = time.perf_counter() - start
+        print(f"  {'sequencial':>12}: {sequential:6.2f} s (falhas por 429 não são repetidas)")
+
+        calls["delete"] = 0
+        report = mag.cleanup_remote_files(files=remote, manifest=None)
+        print(f"  {'concorrente':>12}: {report['elapsed_s']:6.2f} s | {mag.format_cleanup_report(report)} | "
+              f"chamadas: {calls['delete']}")
+
+        report = mag.cleanup_remote_files(files=remote, older_than_hours=24, name_pattern="rascunho_*",
+                                          manifest=None, dry_run=True)
+        print(f"  {'filtros':>12}: rascunho_* com mais de 24h -> {mag.format_cleanup_report(report)}")
+    finally:
+        mag.genai.delete_file = original
+
+
+def bench_batch(goals=12, plan_seconds=0.3, task_seconds=0.4, concurrency=(1, 4)):
+    """Modo --batch: metas/hora com 1 meta por vez vs. várias simultâneas (API simulada, TaskManager real)."""
+    print(f"=== Lote de {goals} metas (planejamento simulado: {plan_seconds}s; 3 tarefas de {task_seconds}s cada) ===")
+
+    class SimulatedTaskManager(mag.TaskManager):
+        async def decompose_goal_async(self):
+            await asyncio.sleep(plan_seconds)
+            return mag.TaskGraph.from_plan([f"{self.goal}: pesquisar", f"{self.goal}: analisar", f"{self.goal}: resumir"])
+
+        async def _run_task_async(self, task, context):
+            await asyncio.sleep(task_seconds)
+            return {"text_content": f"ok: {task}"}, task_seconds
+
+    items = [{"id": f"meta_{i}", "goal": f"Meta {i}"} for i in range(goals)]
+    items[-1]["approval"] = "max-tasks:2"  # recusada pela política: o plano simulado tem 3 tarefas
+    devnull = open(os.devnull, "w")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for max_concurrent in concurrency:
+                output = os.path.join(tmp, f"resultados_{max_concurrent}.jsonl")
+                stdout, sys.stdout = sys.stdout, devnull  # silencia as mensagens dos fluxos
+                try:
+                    summary = asyncio.run(mag.run_batch_async(items, output, max_concurrent, "auto",
+                                                              manager_factory=SimulatedTaskManager))
+                finally:
+                    sys.stdout = stdout
+                with open(output, encoding="utf-8") as f:
+                    records = [json.loads(line) for line in f]
+                print(f"  {max_concurrent} simultânea(s): {summary['elapsed_s']:5.2f} s | "
+                      f"{summary['goals_per_hour']:8.1f} metas/hora | {summary['statuses']} | registros: {len(records)}")
+    finally:
+        devnull.close()
+
+
+def bench_context_cache(files=4, file_kb=256, tasks=6):
+    """Tokens de entrada enviados por fluxo: arquivos inline em toda chamada vs. cache de contexto (backend local)."""
+    print(f"=== Cache de contexto: {files} arquivos de {file_kb} KB, plano com {tasks} tarefas (API simulada) ===")
+    uploaded = [type("File", (), {"name": f"files/doc{i}", "uri": f"https://api/files/doc{i}",
+                                  "size_bytes": file_kb * 1024, "display_name": f"doc{i}.md"})() for i in range(files)]
+    plan = json.dumps({"tasks": [{"id": i, "description": f"Analisar seção {i}", "depends_on": []} for i in range(1, tasks + 1)]})
+
+    class _Part:
+        def __init__(self, text):
+            self.text = text
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+            self.candidates = [type("Candidate", (), {"content": type("Content", (), {"parts": [_Part(text)]})()})()]
+            self.usage_metadata = None
+
+        def __iter__(self):  # respostas em streaming: um único chunk
+            yield self
+
+    def fake_generate_content(model, contents=None, **kwargs):
+        time.sleep(0.01)
+        return _Response(plan if "Meta a ser decomposta" in str(contents) else "ok")
+
+    def token_estimate(contents):
+        if isinstance(contents, dict):
+            return token_estimate(contents.get("parts", []))
+        if isinstance(contents, (list, tuple)):
+            return sum(token_estimate(c) for c in contents)
+        return (contents.size_bytes // 4) if hasattr(contents, "size_bytes") else len(str(contents)) // 4
+
+    original = mag.genai.GenerativeModel.generate_content, mag.CONTEXT_CACHE, mag.RESPONSE_CACHE.is_enabled_for
+    mag.genai.GenerativeModel.generate_content = fake_generate_content
+    mag.RESPONSE_CACHE.is_enabled_for = lambda agent_name: False
+    devnull = open(os.devnull, "w")
+    try:
+        for label, backend in (("inline", None), ("cache local", mag.LocalContextCacheBackend())):
+            context_cache = mag.ContextCache(backend)
+            sent = {"calls": 0, "tokens": 0}
+            resolve = context_cache.resolve
+
+            def counting_resolve(model, prompt_parts, gen_config_dict, resolve=resolve, sent=sent):
+                model, contents, entry = resolve(model, prompt_parts, gen_config_dict)
+                sent["calls"] += 1
+                sent["tokens"] += token_estimate(contents)
+                return model, contents, entry
+
+            context_cache.resolve = counting_resolve
+            mag.CONTEXT_CACHE = context_cache
+            manager = mag.TaskManager("Resumir os documentos enviados", uploaded,
+                                      [{"file_id": f.name, "display_name": f.display_name} for f in uploaded])
+            stdout, sys.stdout = sys.stdout, devnull
+            start = time.perf_counter()
+            try:
+                manager.run_workflow(auto_approve=True)
+            finally:
+                sys.stdout = stdout
+            elapsed = time.perf_counter() - start
+            stats = context_cache.stats()
+            print(f"  {label:>12}: {sent['calls']:3} chamadas | {sent['tokens']:9,} tokens de entrada enviados | "
+                  f"economizados: {stats.get('tokens_saved', 0):9,} | criações: {stats.get('created', 0)} | {elapsed:.2f} s")
+    finally:
+        devnull.close()
+        mag.genai.GenerativeModel.generate_content, mag.CONTEXT_CACHE, mag.RESPONSE_CACHE.is_enabled_for = original
+
+
+BENCHMARKS = {
+    "model_registry": bench_model_registry,
+    "local_router": bench_local_router,
+    "logger": bench_logger,
+    "http_pool": bench_http_pool,
+    "search_titles": bench_search_titles,
+    "http_cache": bench_http_cache,
+    "html_parsing": bench_html_parsing,
+    "web_fetch": bench_web_fetch,
+    "page_cache": bench_page_cache,
+    "page_index": bench_page_index,
+    "crawl": bench_crawl,
+    "search_cache": bench_search_cache,
+    "chunk_selection": bench_chunk_selection,
+    "uploads": bench_uploads,
+    "upload_dedup": bench_upload_dedup,
+    "file_cleanup": bench_file_cleanup,
+    "batch": bench_batch,
+    "context_cache": bench_context_cache,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f"Benchmark desconhecido: {name}. Disponíveis: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+        print()
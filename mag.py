@@ -2,24 +2,67 @@
 import google.generativeai as genai
 from google.generativeai import types
 import os
+import sys
 import json
 import time
 import datetime
 import re
 import traceback
 import glob
+import fnmatch
+import threading
+import hashlib
+import base64
+import asyncio
+import weakref
+import math
+import unicodedata
+import random
+import queue
+import gzip
+import shutil
+import atexit
+import argparse
+import html
+import urllib.robotparser
+import bisect
+import email.utils
+import socket
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
 from typing import List, Optional, Dict, Any
 from PIL import Image
 from io import BytesIO
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer, NavigableString, CData
 from googlesearch import search
 import urllib.parse
+from google.api_core import exceptions as google_exceptions
+try:
+    import resource  # pico de RSS (indisponível no Windows)
+except ImportError:
+    resource = None
+
+# Backends de parsing HTML opcionais (mais rápidos que o html.parser puro do BeautifulSoup)
+try:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+try:
+    import lxml  # noqa: F401 - habilita o parser "lxml" do BeautifulSoup
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
 
 # --- Configuração dos Diretórios e Arquivos ---
 BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 LOG_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_agent_logs")
 OUTPUT_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_final_outputs")
+RESPONSE_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_response_cache")
+HTTP_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_http_cache")
+SEARCH_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_search_cache")
+UPLOADED_FILES_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, "gemini_uploaded_files_cache")
 
 for directory in [LOG_DIRECTORY, OUTPUT_DIRECTORY]:
     if not os.path.exists(directory):
@@ -27,11 +70,129 @@ for directory in [LOG_DIRECTORY, OUTPUT_DIRECTORY]:
 
 CURRENT_TIMESTAMP_STR = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_FILE_NAME = os.path.join(LOG_DIRECTORY, f"agent_log_{CURRENT_TIMESTAMP_STR}.txt")
+LOG_JSONL_FILE_NAME = os.path.join(LOG_DIRECTORY, f"agent_log_{CURRENT_TIMESTAMP_STR}.jsonl")
+
+# --- Log em Segundo Plano ---
+LOG_MAX_PAYLOAD_CHARS = 4000          # mensagens maiores são truncadas antes de entrar na fila
+LOG_MAX_FILE_BYTES = 20 * 1024 * 1024 # rotação por tamanho (arquivos rotacionados são compactados com gzip)
+LOG_QUEUE_MAX_SIZE = 20000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL_SECONDS = 0.5
+LOG_FSYNC_INTERVAL_SECONDS = 5.0
 
 # --- Constantes ---
 MAX_API_RETRIES = 3
 INITIAL_RETRY_DELAY_SECONDS = 5
-RETRY_BACKOFF_FACTOR = 2
+# Backoff com jitter descorrelacionado: espera ~ U(INITIAL, anterior * FACTOR), limitada a MAX_RETRY_DELAY_SECONDS
+RETRY_BACKOFF_FACTOR = 3
+MAX_RETRY_DELAY_SECONDS = 60
+# Limite de requisições simultâneas à API no caminho assíncrono (por event loop)
+MAX_CONCURRENT_API_REQUESTS = 8
+
+# --- Limites de Taxa e Circuit Breaker da API Gemini (compartilhados pelo processo) ---
+GEMINI_REQUESTS_PER_MINUTE = 60
+GEMINI_TOKENS_PER_MINUTE = 1_000_000
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 60
+
+# --- Chamadas de Ferramentas ---
+# Rodadas máximas de function calling por tarefa e chamadas de ferramentas simultâneas
+MAX_TOOL_ITERATIONS = 5
+MAX_PARALLEL_TOOL_CALLS = 6
+
+# --- Contexto entre Tarefas ---
+# Orçamento (aproximado) de tokens do contexto de resultados anteriores enviado nos prompts
+CONTEXT_TOKEN_BUDGET = 6000
+CONTEXT_CHARS_PER_TOKEN = 4
+CONTEXT_SUMMARY_CHARS = 300
+
+# --- Roteamento Local (fast-path do RouterAgent) ---
+ROUTING_LOG_FILE = os.path.join(LOG_DIRECTORY, "routing_decisions.jsonl")
+ROUTER_FAST_PATH_CONFIDENCE = 0.8
+ROUTER_MIN_TRAINING_SAMPLES = 20
+ROUTER_MEMO_MAX_ENTRIES = 2048
+ROUTER_RULE_PRIOR_WEIGHT = 4.0  # uma regra casada multiplica a chance do agente no modelo local; sozinha não decide
+
+# --- Execução do Plano ---
+# Máximo de tarefas independentes do plano executadas ao mesmo tempo
+MAX_PARALLEL_TASKS = 4
+
+# --- Execução em Lote (--batch) ---
+BATCH_MAX_CONCURRENT_GOALS = 3      # metas (fluxos do TaskManager) executadas ao mesmo tempo
+BATCH_APPROVAL_POLICY = "auto"      # "auto", "max-tasks:N" (recusa planos maiores) ou "plan-only" (só planeja)
+
+# --- Cache de Respostas Gemini ---
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Agentes determinísticos que usam o cache por padrão (os demais são opt-in)
+RESPONSE_CACHE_DEFAULT_AGENTS = {"RouterAgent"}
+
+# --- Cache de Contexto (arquivos enviados) ---
+# Opt-in: "gemini" cria CachedContent na API (armazenamento cobrado por hora); "local" é o substituto offline
+# (testes/benchmarks); "off" (padrão) envia os arquivos inline em cada chamada
+CONTEXT_CACHE_BACKEND = os.getenv("MAG_CONTEXT_CACHE", "off")
+CONTEXT_CACHE_TTL_SECONDS = 1800
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 300  # renova o TTL quando falta menos que isso para expirar
+CONTEXT_CACHE_MIN_TOKENS = 4096     # prefixos menores seguem inline (a API exige um mínimo e o ganho seria pequeno)
+
+# --- Cliente HTTP das Ferramentas Web ---
+HTTP_POOL_CONNECTIONS = 32          # hosts distintos mantidos no pool
+HTTP_POOL_MAXSIZE = 10              # conexões keep-alive por host
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+HTTP_READ_TIMEOUT_SECONDS = 15
+HTTP_MAX_REDIRECTS = 5
+SEARCH_TITLE_MAX_WORKERS = 5       # páginas buscadas em paralelo para obter títulos
+SEARCH_TITLE_DEADLINE_SECONDS = 6   # prazo total do enriquecimento de títulos de uma busca
+SEARCH_TITLE_MAX_BYTES = 16 * 1024  # bytes lidos de cada página à procura de <title>
+SEARCH_CACHE_TTL_SECONDS = 3600     # validade em memória dos resultados de uma consulta
+SEARCH_CACHE_PERSISTENT = False     # também grava os resultados em SEARCH_CACHE_DIRECTORY (reuso entre execuções)
+SEARCH_CACHE_PERSISTENT_TTL_SECONDS = 7 * 24 * 3600
+SEARCH_CACHE_NEGATIVE_TTL_SECONDS = 60  # buscas vazias ou com falhas de título: validade curta e nunca gravadas em disco
+HTTP_CACHE_MAX_BYTES = 100 * 1024 * 1024
+HTTP_CACHE_HEURISTIC_MAX_SECONDS = 24 * 3600  # teto da validade heurística (10% da idade do Last-Modified)
+WEB_FETCH_MAX_BYTES = 5 * 1024 * 1024  # orçamento de download por página (Content-Length maior é rejeitado)
+WEB_FETCH_CHUNK_BYTES = 64 * 1024
+WEB_FETCH_TEXT_CONTENT_TYPES = ("text/", "application/xhtml+xml", "application/xml", "application/json")
+WEB_TEXT_MAX_CHARS = 8000           # texto extraído devolvido por fetch_webpage_content
+WEB_HTML_MAX_CHARS = 10000          # HTML bruto devolvido por fetch_webpage_content
+WEB_QUERY_TOKEN_BUDGET = 2000       # tokens dos trechos relevantes devolvidos quando há uma consulta
+WEB_CHUNK_CHARS = 800               # tamanho aproximado de cada trecho ranqueado
+WEB_CHUNK_MIN_RELATIVE_SCORE = 0.3  # trechos abaixo desta fração da melhor pontuação são descartados
+PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # memória estimada das páginas mantidas na sessão
+PAGE_CACHE_TTL_SECONDS = 15 * 60
+PAGE_INDEX_MAX_DOCS = 500           # páginas mantidas no índice de texto da sessão
+SEARCH_CONTEXT_CHARS = 200          # contexto exibido antes/depois de cada ocorrência
+SEARCH_MAX_RESULTS = 5
+SEARCH_MAX_HITS_PER_PAGE = 10
+BM25_K1 = 1.5
+BM25_B = 0.75
+CRAWL_MAX_DEPTH = 2
+CRAWL_MAX_PAGES = 20
+CRAWL_MAX_SECONDS = 60              # tempo total de uma ação crawl
+CRAWL_MAX_WORKERS = 6               # páginas buscadas em paralelo
+CRAWL_HOST_DELAY_SECONDS = 0.5      # intervalo mínimo entre requisições ao mesmo host (ou Crawl-delay do robots.txt)
+CRAWL_DIGEST_CHARS = 200            # trecho de texto de cada página no resumo do crawl
+CRAWL_SKIP_EXTENSIONS = (".pdf", ".zip", ".gz", ".tar", ".exe", ".dmg", ".jpg", ".jpeg", ".png", ".gif", ".svg",
+                         ".webp", ".mp3", ".mp4", ".avi", ".mov", ".css", ".js", ".ico", ".woff", ".woff2")
+ROBOTS_CACHE_TTL_SECONDS = 3600
+# "auto" escolhe o mais rápido instalado: selectolax > lxml > html.parser
+HTML_PARSER_BACKEND = os.getenv("MAG_HTML_PARSER", "auto")
+HTTP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# --- Upload de Arquivos (File API) ---
+UPLOAD_MAX_WORKERS = 8              # uploads simultâneos
+UPLOAD_MAX_RETRIES = 3              # tentativas por arquivo em falhas transitórias
+UPLOAD_RETRY_DELAY_SECONDS = 2
+FILE_ACTIVE_POLL_SECONDS = 2        # intervalo de consulta do estado PROCESSING -> ACTIVE
+FILE_ACTIVE_TIMEOUT_SECONDS = 300
+UPLOAD_MANIFEST_FILE = os.path.join(UPLOADED_FILES_CACHE_DIRECTORY, "manifest.json")
+UPLOAD_DEDUP_ENABLED = True         # reutiliza arquivos remotos com o mesmo SHA-256 + MIME type
+UPLOAD_REUSE_MIN_TTL_SECONDS = 3600 # só reutiliza arquivos que ainda vão durar pelo menos isso na API
+UPLOAD_DEFAULT_TTL_SECONDS = 48 * 3600  # validade da File API quando o arquivo não informa expiration_time
+UPLOAD_HASH_CHUNK_BYTES = 1024 * 1024   # bloco de leitura ao calcular o SHA-256 (memória constante)
+DELETE_MAX_WORKERS = 16             # remoções simultâneas na limpeza de arquivos remotos
+DELETE_MAX_RETRIES = 4              # tentativas por arquivo em falhas transitórias (429, 5xx, rede)
+FILE_API_REQUESTS_PER_MINUTE = 1200 # teto das chamadas de remoção; um 429 pausa todas as threads
 
 # --- Modelos Gemini ---
 # Updated to latest Gemini 2.5 preview models
@@ -56,12 +217,130 @@ def sanitize_filename(name, allow_extension=True):
     ext = "." + re.sub(r'[^\w-]', '', ext.lstrip('.')).strip()[:10]
     return base_name + ext
 
-def log_message(message, source="Sistema"):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_log_message = f"[{timestamp}] [{source}]: {message}\\n"
-    try:
-        with open(LOG_FILE_NAME, "a", encoding="utf-8") as f: f.write(full_log_message)
-    except Exception as e: print(f"Erro ao escrever no log: {e}")
+class BackgroundLogWriter:
+    """Grava o log em uma thread de fundo: lotes, fsync periódico, JSONL estruturado e rotação com gzip.
+
+    submit() nunca bloqueia; se a fila estiver cheia, a mensagem é descartada e contabilizada.
+    """
+
+    def __init__(self, text_path, jsonl_path, max_file_bytes=LOG_MAX_FILE_BYTES, queue_size=LOG_QUEUE_MAX_SIZE):
+        self.text_path = text_path
+        self.jsonl_path = jsonl_path
+        self.max_file_bytes = max_file_bytes
+        self.dropped = 0
+        self.written = 0
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = {}
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="mag-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        """Aguarda a gravação de tudo o que já foi enfileirado."""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Grava o que resta e encerra a thread; False se a fila não drenar dentro do prazo."""
+        if not self._thread.is_alive():
+            return True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return False
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _file(self, path):
+        handle = self._files.get(path)
+        if handle is None:
+            handle = self._files[path] = open(path, "a", encoding="utf-8")
+        return handle
+
+    def _run(self):
+        running = True
+        while running:
+            try:
+                batch = [self._queue.get(timeout=LOG_FLUSH_INTERVAL_SECONDS)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if isinstance(r, dict)]
+            try:
+                if records:
+                    self._write(records)
+                self._sync(force=None in batch or any(isinstance(r, threading.Event) for r in batch))
+            except Exception as e:
+                print(f"Erro ao escrever no log: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    running = False
+        for handle in self._files.values():
+            handle.close()
+
+    def _write(self, records):
+        text_lines, json_lines = [], []
+        for record in records:
+            timestamp = datetime.datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            text_lines.append(f"[{timestamp}] [{record['agent']}]: {record['message']}\n")
+            json_lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        for path, lines in ((self.text_path, text_lines), (self.jsonl_path, json_lines)):
+            handle = self._file(path)
+            handle.write("".join(lines))
+            if handle.tell() >= self.max_file_bytes:
+                self._rotate(path)
+        self.written += len(records)
+
+    def _sync(self, force=False):
+        now = time.monotonic()
+        fsync = force or now - self._last_fsync >= LOG_FSYNC_INTERVAL_SECONDS
+        for handle in self._files.values():
+            handle.flush()
+            if fsync:
+                os.fsync(handle.fileno())
+        if fsync:
+            self._last_fsync = now
+
+    def _rotate(self, path):
+        handle = self._files.pop(path)
+        handle.close()
+        index = 1
+        while os.path.exists(f"{path}.{index}.gz"):
+            index += 1
+        with open(path, "rb") as source, gzip.open(f"{path}.{index}.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+
+LOG_WRITER = BackgroundLogWriter(LOG_FILE_NAME, LOG_JSONL_FILE_NAME)
+atexit.register(LOG_WRITER.close)
+
+def log_message(message, source="Sistema", event="message", duration=None):
+    """Enfileira a mensagem para o log texto e o JSONL estruturado (não bloqueia quem chama)."""
+    message = str(message)
+    if len(message) > LOG_MAX_PAYLOAD_CHARS:
+        message = f"{message[:LOG_MAX_PAYLOAD_CHARS]}... [truncado, {len(message)} caracteres]"
+    record = {"ts": time.time(), "agent": source, "event": event, "message": message}
+    if duration is not None:
+        record["duration"] = round(duration, 4)
+    LOG_WRITER.submit(record)
 
 # --- Configuração da API Gemini ---
 try:
@@ -77,6 +356,1193 @@ except Exception as e:
 
 log_message(f"Modelo Gemini (texto/lógica): {GEMINI_TEXT_MODEL_NAME}", "Sistema")
 
+# --- Cliente HTTP Compartilhado ---
+def create_http_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_redirects=HTTP_MAX_REDIRECTS):
+    """Sessão com pool de conexões por host, keep-alive e compressão (Accept-Encoding padrão do urllib3)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "User-Agent": HTTP_USER_AGENT,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+    })
+    session.max_redirects = max_redirects
+    return session
+
+# Pools do urllib3 são thread-safe; a sessão é compartilhada por todas as ferramentas e threads
+HTTP_SESSION = create_http_session()
+
+def http_get(url, timeout=None, **kwargs):
+    """GET pelo pool compartilhado; timeout padrão (conexão, leitura) = HTTP_*_TIMEOUT_SECONDS."""
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+    return HTTP_SESSION.get(url, timeout=timeout, **kwargs)
+
+_TITLE_PATTERN = re.compile(rb"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+TITLE_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEARCH_TITLE_MAX_WORKERS, thread_name_prefix="mag-title")
+
+def _abort_response(response):
+    """Interrompe uma leitura bloqueada em outra thread: fecha o socket (shutdown acorda o recv) e a resposta."""
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        # Com "Connection: close" o http.client solta a conexão e o socket só fica no arquivo da resposta
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try: sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+    response.close()
+
+def fetch_page_title(url, max_bytes=SEARCH_TITLE_MAX_BYTES, timeout=None, stop_at=None):
+    """Lê apenas o início do corpo (até max_bytes) e extrai o <title>; retorna (status_code, título ou None).
+
+    stop_at (time.monotonic) é o fim do prazo: limita os timeouts de conexão/leitura e interrompe a leitura do corpo.
+    """
+    if stop_at is not None:
+        remaining = stop_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("prazo esgotado antes do início da busca")
+        connect, read = timeout or (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+        timeout = (min(connect, remaining), min(read, remaining))
+    with http_get(url, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        # O timeout de leitura vale por recv: um servidor que entrega aos poucos só é contido fechando a resposta no prazo
+        watchdog = threading.Timer(stop_at - time.monotonic(), _abort_response, (response,)) if stop_at is not None else None
+        if watchdog:
+            watchdog.daemon = True
+            watchdog.start()
+        head = b""
+        try:
+            for chunk in response.iter_content(chunk_size=4096):
+                head += chunk
+                match = _TITLE_PATTERN.search(head)
+                if match or len(head) >= max_bytes:
+                    break
+            else:
+                match = _TITLE_PATTERN.search(head)
+        except Exception as e:
+            if stop_at is not None and time.monotonic() >= stop_at:
+                raise TimeoutError("prazo esgotado durante a leitura") from e
+            raise
+        finally:
+            if watchdog:
+                watchdog.cancel()
+        if not match and stop_at is not None and time.monotonic() >= stop_at:
+            raise TimeoutError("prazo esgotado durante a leitura")  # o corpo acabou porque o watchdog fechou o socket
+        if not match:
+            return response.status_code, None
+        encoding = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else "utf-8"
+        title = match.group(1).decode(encoding or "utf-8", errors="replace")
+        return response.status_code, " ".join(html.unescape(title).split()) or None
+
+def fetch_page_titles(urls, deadline=SEARCH_TITLE_DEADLINE_SECONDS):
+    """Busca os títulos em paralelo com prazo total; URLs não concluídas no prazo retornam erro de tempo esgotado.
+
+    Cada busca carrega o mesmo prazo absoluto: ao estourá-lo ela libera o worker do TITLE_FETCH_EXECUTOR compartilhado,
+    e as que nem começaram são canceladas, para não atrasar as buscas seguintes.
+    """
+    stop_at = time.monotonic() + deadline
+    futures = {TITLE_FETCH_EXECUTOR.submit(fetch_page_title, url, stop_at=stop_at): url for url in urls}
+    done, pending = wait(futures, timeout=deadline)
+    for future in pending:
+        future.cancel()
+    titles = {}
+    for future, url in futures.items():
+        if future in done:
+            try:
+                titles[url] = future.result()
+            except Exception as e:
+                titles[url] = e
+        else:
+            titles[url] = TimeoutError(f"prazo de {deadline}s esgotado")
+    if pending:
+        log_message(f"Enriquecimento de títulos: {len(pending)}/{len(urls)} URLs sem resposta no prazo de {deadline}s.", "Tool:google_search")
+    return titles
+
+# --- Cache HTTP em Disco ---
+_HTTP_CACHE_HEADERS = ("etag", "last-modified", "cache-control", "expires", "date", "content-type", "vary")
+
+def _parse_cache_control(value):
+    directives = {}
+    for item in (value or "").lower().split(","):
+        name, _, arg = item.strip().partition("=")
+        if name:
+            directives[name] = arg.strip('" ')
+    return directives
+
+def _http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def http_freshness_lifetime(headers, now=None):
+    """Segundos de validade segundo Cache-Control/Expires (ou heurística do Last-Modified); None se não armazenável."""
+    now = time.time() if now is None else now
+    directives = _parse_cache_control(headers.get("cache-control"))
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            return max(0, int(directives["max-age"]))
+        except ValueError:
+            return 0
+    expires = _http_date(headers.get("expires"))
+    if headers.get("expires") is not None:
+        return max(0, expires - (_http_date(headers.get("date")) or now)) if expires else 0
+    last_modified = _http_date(headers.get("last-modified"))
+    if last_modified:
+        return min(HTTP_CACHE_HEURISTIC_MAX_SECONDS, max(0, (now - last_modified) * 0.1))
+    return 0
+
+class HttpCacheEntry:
+    """Resposta HTTP armazenada: corpo bruto, cabeçalhos de validação e dados derivados (texto extraído, links)."""
+
+    def __init__(self, url, status_code, headers, content, encoding, fresh_until, derived=None, truncated=""):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.fresh_until = fresh_until
+        self.derived = derived or {}
+        self.truncated = truncated  # "" completo, "budget" (orçamento de bytes) ou "enough" (conteúdo já suficiente)
+        self.cache_status = "miss"
+        self.bytes_transferred = 0
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def to_meta(self):
+        return {"url": self.url, "status_code": self.status_code, "headers": self.headers, "encoding": self.encoding,
+                "fresh_until": self.fresh_until, "derived": self.derived, "truncated": self.truncated}
+
+class WebContentRejected(Exception):
+    """Recurso recusado antes do download (tipo binário ou Content-Length acima do orçamento)."""
+    pass
+
+def peak_rss_kb():
+    """Pico de memória residente do processo em KB (None se indisponível)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+_SCRIPT_STYLE_PATTERN = re.compile(rb"<(script|style)\b.*?(</\1\s*>|\Z)", re.IGNORECASE | re.DOTALL)
+_TAG_PATTERN = re.compile(rb"<[^>]*(>|\Z)", re.DOTALL)
+
+def estimated_visible_chars(content):
+    """Estimativa barata dos caracteres de texto visível (sem tags, scripts e estilos) de um HTML parcial."""
+    text = _TAG_PATTERN.sub(b"", _SCRIPT_STYLE_PATTERN.sub(b"", content))
+    return len(text) - sum(text.count(c) for c in (b" ", b"\n", b"\t", b"\r"))
+
+class HttpCache:
+    """Cache HTTP privado em disco para as ferramentas web: respeita Cache-Control, revalida com ETag/Last-Modified e faz LRU por tamanho."""
+
+    def __init__(self, directory=HTTP_CACHE_DIRECTORY, max_bytes=HTTP_CACHE_MAX_BYTES, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        # Índice LRU em memória (chave -> {"body", "meta"} em bytes, do menos para o mais recente) e tamanho total;
+        # o diretório só é varrido na primeira gravação
+        self._index = None
+        self._total_bytes = 0
+        self._writing = Counter()  # chaves sendo gravadas agora: a remoção LRU não apaga seus arquivos
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        """Monta o índice a partir do disco (ordem LRU pelo mtime); chamar com self._lock."""
+        if self._index is not None:
+            return
+        entries = {}
+        for path in glob.glob(os.path.join(self.directory, "*", "*.*")):
+            stem, suffix = os.path.splitext(os.path.basename(path))
+            if suffix not in (".json", ".body"):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = entries.setdefault(stem, {"body": 0, "meta": 0, "mtime": st.st_mtime})
+            entry["body" if suffix == ".body" else "meta"] = st.st_size
+            entry["mtime"] = min(entry["mtime"], st.st_mtime)
+        self._index = OrderedDict()
+        for stem, entry in sorted(entries.items(), key=lambda item: item[1]["mtime"]):
+            self._index[stem] = {"body": entry["body"], "meta": entry["meta"]}
+        self._total_bytes = sum(e["body"] + e["meta"] for e in self._index.values())
+
+    def _account(self, key, **sizes):
+        """Atualiza o tamanho da entrada no índice e a marca como a mais recente; chamar com self._lock."""
+        self._load_index()
+        entry = self._index.setdefault(key, {"body": 0, "meta": 0})
+        for name, size in sizes.items():
+            self._total_bytes += size - entry[name]
+            entry[name] = size
+        self._index.move_to_end(key)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key[:2], key)
+        return f"{base}.json", f"{base}.body"
+
+    def _count(self, event):
+        with self._lock:
+            self.counters[event] += 1
+
+    def _load(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                content = f.read()
+            return HttpCacheEntry(meta["url"], meta["status_code"], meta["headers"], content,
+                                  meta["encoding"], meta["fresh_until"], meta.get("derived"), meta.get("truncated", ""))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_meta(self, key, entry):
+        """Grava os metadados (atômico) e retorna o tamanho em bytes."""
+        meta_path, _ = self._paths(key)
+        tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        data = json.dumps(entry.to_meta(), ensure_ascii=False).encode("utf-8")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, meta_path)
+        return len(data)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._writing[key] += 1
+        try:
+            meta_path, body_path = self._paths(key)
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            tmp_path = f"{body_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(entry.content)
+            os.replace(tmp_path, body_path)
+            meta_size = self._write_meta(key, entry)
+            with self._lock:
+                self._account(key, body=len(entry.content), meta=meta_size)
+                self.counters["stores"] += 1
+        except OSError as e:
+            log_message(f"Falha ao gravar cache HTTP: {e}", "HttpCache")
+        finally:
+            with self._lock:
+                self._writing[key] -= 1
+                if not self._writing[key]:
+                    del self._writing[key]
+                self._evict_if_needed()
+
+    def _touch(self, key):
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+        for path in self._paths(key):
+            try: os.utime(path)  # Preserva a ordem LRU para a próxima execução
+            except OSError: pass
+
+    def fetch(self, url, timeout=None, max_bytes=WEB_FETCH_MAX_BYTES, enough=None):
+        """GET via cache: entrada válida não toca a rede; entrada vencida é revalidada (304 reaproveita corpo e derivados).
+
+        O corpo é baixado em streaming até max_bytes, ou até enough(corpo_parcial) retornar True.
+        """
+        if not self.enabled:
+            self._count("bypass")
+            return self._download(url, timeout, max_bytes, enough)
+        key = self.make_key(url)
+        cached = self._load(key)
+        if cached and cached.truncated == "enough" and not (enough and enough(cached.content)):
+            cached = None  # o corpo parcial armazenado não basta para este chamador
+        now = time.time()
+        if cached and now < cached.fresh_until:
+            self._touch(key)
+            self._count("hits")
+            cached.cache_status = "hit"
+            return cached
+
+        conditional = {}
+        if cached:
+            if cached.headers.get("etag"):
+                conditional["If-None-Match"] = cached.headers["etag"]
+            if cached.headers.get("last-modified"):
+                conditional["If-Modified-Since"] = cached.headers["last-modified"]
+        entry = self._download(url, timeout, max_bytes, enough, headers=conditional or None)
+
+        if cached and entry.status_code == 304:
+            cached.headers.update({k: v for k, v in entry.headers.items() if k != "content-type"})
+            lifetime = http_freshness_lifetime(cached.headers, now)
+            cached.fresh_until = now + (lifetime or 0)
+            self._update_meta(key, cached)
+            self._touch(key)
+            self._count("revalidated")
+            cached.cache_status = "revalidated"
+            cached.bytes_transferred = entry.bytes_transferred
+            return cached
+
+        self._count("misses")
+        lifetime = http_freshness_lifetime(entry.headers, now)
+        has_validator = "etag" in entry.headers or "last-modified" in entry.headers
+        if lifetime is None or (lifetime <= 0 and not has_validator) or entry.headers.get("vary", "").strip() == "*":
+            self._count("uncacheable")
+        else:
+            entry.fresh_until = now + lifetime
+            self._store(key, entry)
+        return entry
+
+    def _download(self, url, timeout, max_bytes, enough, headers=None):
+        """GET em streaming com pré-checagem de Content-Type/Content-Length e parada antecipada."""
+        with http_get(url, timeout=timeout, headers=headers, stream=True) as response:
+            cache_headers = self._cache_headers(response)
+            encoding = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+            entry = HttpCacheEntry(url, response.status_code, cache_headers, b"", encoding, 0)
+            if response.status_code == 304:
+                return entry
+            response.raise_for_status()
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type and not content_type.startswith(WEB_FETCH_TEXT_CONTENT_TYPES):
+                self._count("rejected")
+                raise WebContentRejected(f"tipo de conteúdo não textual: {content_type}")
+            declared_length = response.headers.get("Content-Length", "")
+            if declared_length.isdigit() and int(declared_length) > max_bytes:
+                self._count("rejected")
+                raise WebContentRejected(f"Content-Length {int(declared_length)} excede o limite de {max_bytes} bytes")
+
+            chunks, size, next_check = [], 0, WEB_FETCH_CHUNK_BYTES
+            for chunk in response.iter_content(chunk_size=WEB_FETCH_CHUNK_BYTES):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    entry.truncated = "budget"
+                    break
+                if enough and size >= next_check:
+                    next_check = size + WEB_FETCH_CHUNK_BYTES
+                    if enough(b"".join(chunks)):
+                        entry.truncated = "enough"
+                        break
+            entry.content = b"".join(chunks)[:max_bytes]
+            # Bytes lidos do socket (compactados, se houver Content-Encoding)
+            entry.bytes_transferred = response.raw.tell() if hasattr(response.raw, "tell") else size
+        with self._lock:
+            self.counters["bytes_transferred"] += entry.bytes_transferred
+        return entry
+
+    @staticmethod
+    def _cache_headers(response):
+        return {name: response.headers[name] for name in _HTTP_CACHE_HEADERS if name in response.headers}
+
+    def store_derived(self, entry, name, value):
+        """Anexa à entrada um resultado derivado do corpo (ex.: texto extraído), para que hits pulem o parsing."""
+        entry.derived[name] = value
+        if not self.enabled or entry.fresh_until <= 0:
+            return
+        key = self.make_key(entry.url)
+        if os.path.exists(self._paths(key)[0]):
+            self._update_meta(key, entry)
+
+    def _update_meta(self, key, entry):
+        """Regrava os metadados de uma entrada existente (derivados crescem o arquivo) e atualiza o índice."""
+        with self._lock:
+            self._writing[key] += 1
+        try:
+            meta_size = self._write_meta(key, entry)
+            with self._lock:
+                self._account(key, meta=meta_size)
+        except OSError as e:
+            log_message(f"Falha ao atualizar cache HTTP: {e}", "HttpCache")
+        finally:
+            with self._lock:
+                self._writing[key] -= 1
+                if not self._writing[key]:
+                    del self._writing[key]
+                self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        """Remove as entradas acessadas há mais tempo até o cache caber em max_bytes; chamar com self._lock."""
+        if self._index is None or self._total_bytes <= self.max_bytes:
+            return
+        for key in list(self._index):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key in self._writing:
+                continue
+            for path in self._paths(key):
+                try: os.remove(path)
+                except OSError: pass
+            sizes = self._index.pop(key)
+            self._total_bytes -= sizes["body"] + sizes["meta"]
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            for path in glob.glob(os.path.join(self.directory, "*", "*.*")):
+                try: os.remove(path)
+                except OSError: pass
+            self._index, self._total_bytes = OrderedDict(), 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+HTTP_CACHE = HttpCache()
+
+# --- Parsing HTML ---
+HTML_NOISE_TAGS = ["script", "style", "nav", "footer", "aside"]
+# Elementos de bloco terminam em quebra de linha, para que o texto de blocos vizinhos não se cole
+HTML_BLOCK_TAGS = ["title", "p", "div", "br", "li", "dt", "dd", "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6",
+                   "pre", "blockquote", "section", "article", "header", "main", "table", "ul", "ol", "dl", "form"]
+
+def resolve_html_backend(preferred=HTML_PARSER_BACKEND):
+    """Retorna o backend de parsing disponível: 'selectolax', 'lxml' ou 'html.parser'."""
+    available = ["selectolax"] * (SelectolaxParser is not None) + ["lxml"] * LXML_AVAILABLE + ["html.parser"]
+    if preferred in available:
+        return preferred
+    if preferred != "auto":
+        log_message(f"Backend HTML '{preferred}' indisponível; usando '{available[0]}'.", "Sistema")
+    return available[0]
+
+HTML_BACKEND = resolve_html_backend()
+
+def _decode_html(content, encoding=None):
+    """Decodifica com o charset conhecido (ou UTF-8 estrito), evitando a detecção de charset do BeautifulSoup; bytes se falhar."""
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode(encoding or "utf-8", errors="replace" if encoding else "strict")
+    except (UnicodeDecodeError, LookupError):
+        return content
+
+def parse_html(content, encoding=None, parse_only=None, backend=None):
+    """BeautifulSoup com o parser mais rápido disponível; parse_only (SoupStrainer) monta só a parte necessária da árvore."""
+    features = "lxml" if (backend or HTML_BACKEND) != "html.parser" and LXML_AVAILABLE else "html.parser"
+    return BeautifulSoup(_decode_html(content, encoding), features, parse_only=parse_only)
+
+def _clean_page_text(text_content):
+    lines = (line.strip() for line in text_content.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Quebras reais: o índice e a seleção de trechos tokenizam este texto
+    return "\n".join(chunk for chunk in chunks if chunk)
+
+_HTML_NOISE_SET = frozenset(HTML_NOISE_TAGS)
+_HTML_BLOCK_SET = frozenset(HTML_BLOCK_TAGS)
+
+def _soup_block_text(soup):
+    """Texto visível da árvore numa única passada: pula os ruídos e fecha cada bloco com quebra, sem alterar a árvore."""
+    parts = []
+    # Pilha explícita (a árvore do html.parser pode ser mais funda que o limite de recursão); "\n" marca o fim de um bloco
+    stack = [iter(soup.contents)]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+        elif child.__class__ is str:
+            parts.append(child)
+        elif isinstance(child, NavigableString):
+            if child.__class__ is NavigableString or child.__class__ is CData:
+                parts.append(child)
+        elif child.name not in _HTML_NOISE_SET:
+            if child.name in _HTML_BLOCK_SET:
+                stack.append(iter(("\n",)))
+            stack.append(iter(child.contents))
+    return "".join(parts)
+
+def extract_page_text(content, encoding=None, backend=None):
+    """Extrai (título, texto limpo) de um documento HTML, sem scripts, estilos e navegação."""
+    backend = backend or HTML_BACKEND
+    if backend == "selectolax":
+        tree = SelectolaxParser(_decode_html(content, encoding))
+        title_node = tree.css_first("title")
+        page_title = title_node.text(strip=True) if title_node else None
+        tree.strip_tags(HTML_NOISE_TAGS)
+        for node in tree.css(",".join(HTML_BLOCK_TAGS)):
+            node.insert_after("\n")
+        text_content = tree.root.text(separator="") if tree.root else ""
+    else:
+        soup = parse_html(content, encoding, backend=backend)
+        title = soup.find('title')
+        page_title = title.text.strip() if title else None
+        text_content = _soup_block_text(soup)
+    return page_title, _clean_page_text(text_content)
+
+def extract_page_links(content, base_url, encoding=None, backend=None):
+    """Extrai (texto, href absoluto) dos links <a href>, analisando apenas as tags <a>."""
+    backend = backend or HTML_BACKEND
+    if backend == "selectolax":
+        anchors = ((node.attributes.get("href") or "", node.text()) for node in
+                   SelectolaxParser(_decode_html(content, encoding)).css("a[href]"))
+    else:
+        soup = parse_html(content, encoding, parse_only=SoupStrainer("a", href=True), backend=backend)
+        anchors = ((link['href'], link.get_text()) for link in soup.find_all('a', href=True))
+    links = []
+    for href, text in anchors:
+        text = text.strip()
+        # Convert relative URLs to absolute
+        if href.startswith('/'):
+            href = urllib.parse.urljoin(base_url, href)
+        elif not href.startswith('http'):
+            continue
+        if text:
+            links.append({"text": text, "url": href})
+    return links
+
+# --- Páginas da Sessão ---
+def normalize_url(url):
+    """Forma canônica da URL: esquema/host minúsculos, sem porta padrão nem fragmento, caminho vazio como '/'."""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        host = f"{parts.username}{':' + parts.password if parts.password else ''}@{host}"
+    return urllib.parse.urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+def _page_body_enough(body):
+    """HTML parcial suficiente para todos os modos: WEB_HTML_MAX_CHARS de HTML bruto e WEB_TEXT_MAX_CHARS de texto."""
+    return len(body) >= 4 * WEB_HTML_MAX_CHARS and estimated_visible_chars(body) >= 2 * WEB_TEXT_MAX_CHARS
+
+class WebPage:
+    """Página carregada na sessão: resposta HTTP e, sob demanda, o texto limpo e os links extraídos."""
+
+    def __init__(self, url, entry):
+        self.url = url
+        self.entry = entry
+        self.loaded_at = time.monotonic()
+        # "page_text": derivados "text" gravados antes tinham quebras literais ("\\n") e são ignorados
+        self._text = entry.derived.get("page_text")
+        self._links = entry.derived.get("links")
+        self._full_text = None
+        self._indexed = False
+
+    def text(self):
+        """Retorna (título, texto limpo limitado a WEB_TEXT_MAX_CHARS) e indexa a página no PAGE_INDEX."""
+        if self._text is None:
+            page_title, text_content = extract_page_text(self.entry.content, self.entry.encoding)
+            self._full_text = text_content
+            # O índice recebe o texto completo; o texto devolvido ao modelo é truncado
+            PAGE_INDEX.add(self.url, page_title or "", text_content)
+            self._indexed = True
+            
+            # Limit content size
+            if len(text_content) > WEB_TEXT_MAX_CHARS:
+                text_content = text_content[:WEB_TEXT_MAX_CHARS] + "\\n\\n[CONTEÚDO TRUNCADO...]"
+            self._text = {"title": page_title or "Título não encontrado", "content": text_content}
+            HTTP_CACHE.store_derived(self.entry, "page_text", self._text)
+        if not self._indexed:
+            # Texto derivado do cache em disco é a versão truncada para o modelo: o índice usa o texto completo
+            PAGE_INDEX.add(self.url, self._text["title"], self.full_text())
+            self._indexed = True
+        return self._text["title"], self._text["content"]
+
+    def full_text(self):
+        """Texto limpo sem o limite de WEB_TEXT_MAX_CHARS (reextraído se a página veio do cache em disco)."""
+        if self._full_text is None:
+            _, self._full_text = extract_page_text(self.entry.content, self.entry.encoding)
+        return self._full_text
+
+    def links(self):
+        if self._links is None:
+            self._links = extract_page_links(self.entry.content, self.url, self.entry.encoding)
+            HTTP_CACHE.store_derived(self.entry, "links", self._links)
+        return self._links
+
+    def html(self):
+        return self.entry.text
+
+    def size(self):
+        """Memória aproximada: corpo bruto + texto e links extraídos (caracteres contados como 2 bytes)."""
+        size = len(self.entry.content)
+        if self._text is not None:
+            size += 2 * (len(self._text["content"]) + len(self._text["title"]))
+        if self._links is not None:
+            size += sum(2 * (len(link["text"]) + len(link["url"])) + 100 for link in self._links)
+        if self._full_text is not None:
+            size += 2 * len(self._full_text)
+        return size
+
+class PageCache:
+    """Cache em memória das páginas da sessão (URL normalizada -> WebPage), com LRU limitado por memória."""
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES, ttl_seconds=PAGE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._pages = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def get(self, url, timeout=15, complete=False):
+        """Página da sessão; busca (via HTTP_CACHE) apenas se ausente, expirada ou, com complete=True, baixada só em parte."""
+        key = normalize_url(url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page and time.monotonic() - page.loaded_at < self.ttl_seconds \
+                    and not (complete and page.entry.truncated == "enough"):
+                self._pages.move_to_end(key)
+                self.counters["hits"] += 1
+                return page
+        entry = HTTP_CACHE.fetch(url, timeout=timeout, enough=None if complete else _page_body_enough)
+        log_message(f"Download de {url}: {entry.bytes_transferred} bytes transferidos ({entry.cache_status}"
+                    f"{', interrompido' if entry.truncated else ''}), pico de RSS {peak_rss_kb()} KB",
+                    "PageCache", event="web_fetch")
+        page = WebPage(url, entry)
+        with self._lock:
+            self.counters["misses"] += 1
+            self._pages[key] = page
+            self._sizes[key] = page.size()
+            self._evict_if_needed()
+        return page
+
+    def update_size(self, url):
+        """Recalcula a memória da página após extrair texto ou links."""
+        key = normalize_url(url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page:
+                self._sizes[key] = page.size()
+                self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        while len(self._pages) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            key, _ = self._pages.popitem(last=False)
+            self._sizes.pop(key, None)
+            self.counters["evictions"] += 1
+
+    def pages(self):
+        with self._lock:
+            return list(self._pages.values())
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._sizes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pages": len(self._pages), "bytes": sum(self._sizes.values())}
+
+PAGE_CACHE = PageCache()
+
+# --- Índice de Texto da Sessão ---
+_WORD_PATTERN = re.compile(r"\w+")
+
+def fold_term(token):
+    """Termo de busca: minúsculo e sem acentos."""
+    if token.isascii():
+        return token.lower()
+    token = unicodedata.normalize("NFKD", token.lower())
+    return "".join(c for c in token if not unicodedata.combining(c))
+
+def tokenize_with_offsets(text):
+    """Lista de (termo, início, fim) com as posições no texto original."""
+    return [(fold_term(m.group()), m.start(), m.end()) for m in _WORD_PATTERN.finditer(text)]
+
+def parse_search_query(query):
+    """Separa a consulta em frases entre aspas (listas de termos) e termos soltos."""
+    phrases = [[term for term, _, _ in tokenize_with_offsets(p)] for p in re.findall(r'"([^"]+)"', query)]
+    phrases = [p for p in phrases if p]
+    terms = [term for term, _, _ in tokenize_with_offsets(re.sub(r'"[^"]*"', " ", query))]
+    return terms, phrases
+
+def _sorted_contains(values, value):
+    i = bisect.bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+def bm25_term_score(tf, df, doc_len, avg_doc_len, num_docs, k1=BM25_K1, b=BM25_B):
+    """Contribuição BM25 de um termo com frequência tf num documento de doc_len termos."""
+    idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / max(avg_doc_len, 1)))
+
+class PageIndex:
+    """Índice invertido incremental das páginas lidas na sessão, com ranking BM25, frases e todas as ocorrências."""
+
+    def __init__(self, max_docs=PAGE_INDEX_MAX_DOCS):
+        self.max_docs = max_docs
+        self._docs = OrderedDict()  # URL normalizada -> {"url", "title", "text", "spans"}
+        self._postings = {}         # termo -> {URL normalizada: [posições do termo]}
+        self._total_terms = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return normalize_url(url) in self._docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, url, title, text):
+        """Indexa (ou reindexa, se o texto mudou) uma página."""
+        key = normalize_url(url)
+        tokens = tokenize_with_offsets(text)
+        with self._lock:
+            current = self._docs.get(key)
+            if current and current["text"] == text:
+                self._docs.move_to_end(key)
+                return
+            if current:
+                self._remove(key)
+            positions = {}
+            for position, (term, _, _) in enumerate(tokens):
+                positions.setdefault(term, []).append(position)
+            for term, term_positions in positions.items():
+                self._postings.setdefault(term, {})[key] = term_positions
+            self._docs[key] = {"url": url, "title": title, "text": text, "spans": [(start, end) for _, start, end in tokens]}
+            self._total_terms += len(tokens)
+            while len(self._docs) > self.max_docs:
+                self._remove(next(iter(self._docs)))
+
+    def _remove(self, key):
+        doc = self._docs.pop(key)
+        self._total_terms -= len(doc["spans"])
+        for term, _, _ in tokenize_with_offsets(doc["text"]):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _phrase_starts(self, key, phrase):
+        """Posições onde a frase inteira ocorre no documento (parte do termo mais raro e confere os demais por bisect)."""
+        lists = [self._postings.get(term, {}).get(key) for term in phrase]
+        if not all(lists):
+            return []
+        anchor = min(range(len(lists)), key=lambda i: len(lists[i]))
+        starts = [p - anchor for p in lists[anchor] if p >= anchor]
+        for offset, positions in enumerate(lists):
+            if offset != anchor:
+                starts = [p for p in starts if _sorted_contains(positions, p + offset)]
+        return starts
+
+    def search(self, query, urls=None, limit=SEARCH_MAX_RESULTS, max_hits=SEARCH_MAX_HITS_PER_PAGE,
+               context_chars=SEARCH_CONTEXT_CHARS):
+        """Páginas ordenadas por BM25 com as ocorrências e seus contextos; frases entre aspas são obrigatórias."""
+        terms, phrases = parse_search_query(query)
+        scoring_terms = list(dict.fromkeys(terms + [term for phrase in phrases for term in phrase]))
+        if not scoring_terms:
+            return []
+        with self._lock:
+            allowed = None if urls is None else {normalize_url(u) for u in urls}
+            candidates = set()
+            for term in scoring_terms:
+                candidates.update(self._postings.get(term, {}))
+            if allowed is not None:
+                candidates &= allowed
+            num_docs = len(self._docs)
+            avg_doc_len = self._total_terms / max(num_docs, 1)
+            results = []
+            for key in candidates:
+                doc = self._docs[key]
+                # (posição inicial, quantidade de termos) de cada ocorrência
+                matches = []
+                phrase_matches = [[(p, len(phrase)) for p in self._phrase_starts(key, phrase)] for phrase in phrases]
+                if not all(phrase_matches):
+                    continue
+                for found in phrase_matches:
+                    matches.extend(found)
+                for term in terms:
+                    matches.extend((p, 1) for p in self._postings.get(term, {}).get(key, []))
+                score = sum(bm25_term_score(len(self._postings[term][key]), len(self._postings[term]), len(doc["spans"]),
+                                            avg_doc_len, num_docs)
+                            for term in scoring_terms if key in self._postings.get(term, {}))
+                results.append((score, key, sorted(set(matches))))
+            results.sort(key=lambda item: -item[0])
+
+            output = []
+            for score, key, matches in results[:limit]:
+                doc = self._docs[key]
+                hits, last_end = [], -1
+                for position, length in matches:
+                    start, end = doc["spans"][position][0], doc["spans"][position + length - 1][1]
+                    if start < last_end:
+                        continue  # já coberta pelo contexto da ocorrência anterior
+                    context_start, context_end = max(0, start - context_chars), min(len(doc["text"]), end + context_chars)
+                    hits.append({"offset": start, "match": doc["text"][start:end],
+                                 "context": doc["text"][context_start:context_end]})
+                    last_end = context_end
+                output.append({"url": doc["url"], "title": doc["title"], "score": round(score, 3),
+                               "total_hits": len(matches), "hits": hits[:max_hits]})
+            return output
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._total_terms = 0
+
+PAGE_INDEX = PageIndex()
+
+def format_search_hits(result):
+    lines = [f"{result['title'] or result['url']} ({result['url']}) - {result['total_hits']} ocorrência(s), BM25 {result['score']}"]
+    for hit in result["hits"]:
+        lines.append(f"  ...{hit['context']}...")
+    return "\\n".join(lines)
+
+# --- Seleção de Trechos Relevantes ---
+def split_text_chunks(text, chunk_chars=WEB_CHUNK_CHARS):
+    """Agrupa as linhas do texto limpo em trechos de ~chunk_chars (linhas longas são cortadas em palavras)."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines():
+        pieces = [line]
+        if len(line) > chunk_chars:
+            words, pieces, piece = line.split(" "), [], ""
+            for word in words:
+                if piece and len(piece) + len(word) + 1 > chunk_chars:
+                    pieces.append(piece)
+                    piece = ""
+                piece = f"{piece} {word}" if piece else word
+            pieces.append(piece)
+        for piece in pieces:
+            if current and size + len(piece) > chunk_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def select_relevant_chunks(text, query, token_budget=WEB_QUERY_TOKEN_BUDGET, chunk_chars=WEB_CHUNK_CHARS):
+    """Ranqueia os trechos do texto contra a consulta (BM25 local) e devolve os melhores que cabem no orçamento.
+
+    Retorna (texto selecionado em ordem do documento, info). Sem termos em comum, devolve o início do texto.
+    """
+    chunks = split_text_chunks(text, chunk_chars)
+    max_chars = token_budget * CONTEXT_CHARS_PER_TOKEN
+    terms, phrases = parse_search_query(query)
+    query_terms = set(terms) | {term for phrase in phrases for term in phrase}
+    chunk_terms = [Counter(term for term, _, _ in tokenize_with_offsets(chunk)) for chunk in chunks]
+    avg_len = sum(sum(c.values()) for c in chunk_terms) / max(len(chunks), 1)
+    doc_freq = Counter(term for counts in chunk_terms for term in query_terms if term in counts)
+    scores = [sum(bm25_term_score(counts[term], doc_freq[term], sum(counts.values()), avg_len, len(chunks))
+                  for term in query_terms if term in counts)
+              for counts in chunk_terms]
+
+    threshold = max(scores, default=0) * WEB_CHUNK_MIN_RELATIVE_SCORE
+    ranked = sorted((i for i in range(len(chunks)) if scores[i] > 0 and scores[i] >= threshold), key=lambda i: -scores[i])
+    if not ranked:
+        ranked = list(range(len(chunks)))
+    selected, used = [], 0
+    for i in ranked:
+        if used + len(chunks[i]) > max_chars:
+            if selected:
+                continue
+            chunks[i] = chunks[i][:max_chars]
+        selected.append(i)
+        used += len(chunks[i])
+    selected.sort()
+    parts = []
+    for position, i in enumerate(selected):
+        if position and i != selected[position - 1] + 1:
+            parts.append("[...]")
+        parts.append(chunks[i])
+    info = {"chunks_total": len(chunks), "chunks_selected": len(selected), "chars": used,
+            "matched": bool(scores) and max(scores) > 0}
+    return "\n".join(parts), info
+
+# --- Crawler ---
+class RobotsCache:
+    """robots.txt por origem (esquema + host), baixado uma vez e reaproveitado por ROBOTS_CACHE_TTL_SECONDS."""
+
+    def __init__(self, ttl_seconds=ROBOTS_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._parsers = {}
+        self._inflight = {}  # origem -> Future do download em andamento
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def _parser(self, origin):
+        while True:
+            with self._lock:
+                cached = self._parsers.get(origin)
+                if cached and time.monotonic() - cached[0] < self.ttl_seconds:
+                    return cached[1]
+                future = self._inflight.get(origin)
+                if future is None:
+                    future = Future()
+                    self._inflight[origin] = future
+                    self.counters["fetches"] += 1
+                    break
+                self.counters["coalesced"] += 1
+            # Outra busca do crawl já está baixando o robots.txt desta origem
+            try:
+                return future.result()
+            except Exception:
+                continue
+        try:
+            parser = self._download(origin)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            with self._lock:
+                self._parsers[origin] = (time.monotonic(), parser)
+            future.set_result(parser)
+        finally:
+            with self._lock:
+                self._inflight.pop(origin, None)
+        return parser
+
+    @staticmethod
+    def _download(origin):
+        parser = urllib.robotparser.RobotFileParser(f"{origin}/robots.txt")
+        try:
+            response = http_get(f"{origin}/robots.txt", timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 10))
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(response.text.splitlines())
+        except requests.exceptions.RequestException:
+            parser.allow_all = True  # robots.txt inacessível: segue a convenção de permitir
+        return parser
+
+    @staticmethod
+    def _origin(url):
+        parts = urllib.parse.urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def allowed(self, url):
+        return self._parser(self._origin(url)).can_fetch(HTTP_USER_AGENT, url)
+
+    def crawl_delay(self, url):
+        delay = self._parser(self._origin(url)).crawl_delay(HTTP_USER_AGENT)
+        return float(delay) if delay else 0.0
+
+ROBOTS_CACHE = RobotsCache()
+
+class HostThrottle:
+    """Espaça as requisições a um mesmo host (politeness), reservando horários sem bloquear os demais hosts."""
+
+    def __init__(self, delay_seconds=CRAWL_HOST_DELAY_SECONDS):
+        self.delay_seconds = delay_seconds
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host, deadline, delay_seconds=None):
+        """Aguarda a vez do host; retorna False se ela só viria depois do prazo (deadline em time.monotonic)."""
+        delay = max(self.delay_seconds, delay_seconds or 0.0)
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if slot > deadline:
+                return False
+            self._next_slot[host] = slot + delay
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+def crawl_site(seed_url, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES, max_seconds=CRAWL_MAX_SECONDS,
+               same_host=True, host_delay=CRAWL_HOST_DELAY_SECONDS):
+    """Crawl em largura a partir de seed_url, com buscas paralelas; as páginas entram no PAGE_CACHE e no PAGE_INDEX."""
+    start = time.monotonic()
+    deadline = start + max_seconds
+    seed_host = urllib.parse.urlsplit(seed_url).hostname
+    throttle = HostThrottle(host_delay)
+    seen = {normalize_url(seed_url)}
+    frontier = [seed_url]
+    visited, stats, failures = [], Counter(), {}
+
+    def visit(url, depth):
+        host = urllib.parse.urlsplit(url).netloc
+        if not ROBOTS_CACHE.allowed(url):
+            return "robots", None
+        if not throttle.wait(host, deadline, ROBOTS_CACHE.crawl_delay(url)):
+            return "deadline", None
+        page = PAGE_CACHE.get(url, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, min(HTTP_READ_TIMEOUT_SECONDS, max_seconds)))
+        title, text = page.text()
+        links = page.links()
+        PAGE_CACHE.update_size(url)
+        return "ok", {"url": url, "depth": depth, "title": title, "summary": " ".join(text.split())[:CRAWL_DIGEST_CHARS],
+                      "links": [link["url"] for link in links]}
+
+    executor = ThreadPoolExecutor(max_workers=CRAWL_MAX_WORKERS, thread_name_prefix="mag-crawl")
+    try:
+        for depth in range(max_depth + 1):
+            batch = frontier[:max_pages - len(visited)]
+            if not batch or time.monotonic() >= deadline:
+                break
+            futures = {executor.submit(visit, url, depth): url for url in batch}
+            done, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+            for future in pending:
+                future.cancel()
+                stats["deadline"] += 1
+            next_frontier = []
+            for future in futures:
+                if future not in done:
+                    continue
+                try:
+                    status, page_info = future.result()
+                except Exception as e:
+                    # Qualquer falha (rede, conteúdo recusado, parsing) custa só a página, não o crawl
+                    log_message(f"Crawl: falha em {futures[future]}: {e}", "Tool:browser_automation")
+                    stats["errors"] += 1
+                    failures[futures[future]] = f"{type(e).__name__}: {e}"
+                    continue
+                stats[status] += 1
+                if page_info is None:
+                    continue
+                visited.append(page_info)
+                for link in page_info.pop("links"):
+                    parts = urllib.parse.urlsplit(link)
+                    key = normalize_url(link)
+                    if parts.scheme not in ("http", "https") or key in seen:
+                        continue
+                    if (same_host and parts.hostname != seed_host) or parts.path.lower().endswith(CRAWL_SKIP_EXTENSIONS):
+                        continue
+                    seen.add(key)
+                    next_frontier.append(link)
+            frontier = next_frontier
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    stats["elapsed_s"] = round(time.monotonic() - start, 2)
+    stats["frontier_remaining"] = len(frontier)  # links descobertos e não visitados (limite de profundidade, páginas ou tempo)
+    log_message(f"Crawl de {seed_url}: {len(visited)} páginas, {dict(stats)}", "Tool:browser_automation", event="crawl",
+                duration=stats["elapsed_s"])
+    stats = dict(stats)
+    if failures:
+        stats["failures"] = failures  # URL -> erro
+    return visited, stats
+
+# --- Cache de Buscas ---
+def normalize_search_query(query):
+    """Chave da consulta: NFKC, minúsculas, espaços colapsados e sem pontuação nas pontas."""
+    text = unicodedata.normalize("NFKC", str(query)).lower()
+    return " ".join(text.split()).strip(" ?!.,;:")
+
+class SearchCache:
+    """Memoização do google_search: TTL em memória, coalescência de consultas idênticas em andamento e disco opcional."""
+
+    def __init__(self, ttl_seconds=SEARCH_CACHE_TTL_SECONDS, persistent=SEARCH_CACHE_PERSISTENT,
+                 directory=SEARCH_CACHE_DIRECTORY, persistent_ttl_seconds=SEARCH_CACHE_PERSISTENT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self.directory = directory
+        self.persistent_ttl_seconds = persistent_ttl_seconds
+        self._entries = {}   # consulta normalizada -> {"created", "num_results", "results"}
+        self._inflight = {}  # consulta normalizada -> Future da busca em andamento
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+
+    @staticmethod
+    def _covers(entry, num_results):
+        # Menos resultados que o pedido significa que a busca já se esgotou
+        return entry["num_results"] >= num_results or len(entry["results"]) < entry["num_results"]
+
+    def _lookup(self, key, num_results):
+        """Entrada válida em memória; chamar com self._lock."""
+        entry = self._entries.get(key)
+        ttl = SEARCH_CACHE_NEGATIVE_TTL_SECONDS if entry and entry.get("negative") else self.ttl_seconds
+        if entry and time.time() - entry["created"] < ttl and self._covers(entry, num_results):
+            return entry
+        return None
+
+    def _load(self, key, num_results):
+        """Entrada válida gravada em disco (fora do lock); None se ausente, expirada ou insuficiente."""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("query") != key or time.time() - entry["created"] >= self.persistent_ttl_seconds \
+                or not self._covers(entry, num_results):
+            return None
+        return entry
+
+    @staticmethod
+    def _complete(results):
+        # Lista vazia ou título que falhou (tempo esgotado, conexão) são transitórios: não valem o TTL cheio
+        return bool(results) and not any("error" in result for result in results)
+
+    def _store(self, key, num_results, results):
+        entry = {"query": key, "created": time.time(), "num_results": num_results, "results": results}
+        if not self._complete(results):
+            entry["negative"] = True
+        with self._lock:
+            self._entries[key] = entry
+            if entry.get("negative"):
+                self.counters["negative_stored"] += 1
+        if self.persistent and not entry.get("negative"):
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = self._path(key)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                log_message(f"Falha ao gravar cache de buscas: {e}", "SearchCache")
+
+    def get_or_search(self, query, num_results, search_fn):
+        """Retorna (resultados, origem); search_fn(num_results) só roda se nenhuma busca válida ou em andamento servir."""
+        key = normalize_search_query(query)
+        while True:
+            with self._lock:
+                entry = self._lookup(key, num_results)
+                if entry:
+                    self.counters["hits"] += 1
+                    return entry["results"][:num_results], "cache"
+                future = self._inflight.get(key)
+                if future is None:
+                    future = Future()
+                    self._inflight[key] = future
+                    break
+            # Consulta idêntica em andamento: aguarda e reaproveita se ela trouxer resultados suficientes
+            try:
+                results, searched = future.result()
+            except Exception:
+                continue
+            if searched >= num_results or len(results) < searched:
+                with self._lock:
+                    self.counters["coalesced"] += 1
+                return results[:num_results], "coalesced"
+
+        try:
+            # O disco é lido por quem detém a consulta em andamento, fora do lock
+            entry = self._load(key, num_results) if self.persistent else None
+            if entry:
+                with self._lock:
+                    self._entries[key] = entry
+                    self.counters["disk_hits"] += 1
+                future.set_result((entry["results"], entry["num_results"]))
+                return entry["results"][:num_results], "cache"
+            with self._lock:
+                self.counters["misses"] += 1
+            results = search_fn(num_results)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._store(key, num_results, results)
+            future.set_result((results, num_results))
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return results, "search"
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+SEARCH_CACHE = SearchCache()
+
 # --- Ferramentas para o Agente ---
 def save_file(filename: str, content: str) -> dict:
     """Salva o conteúdo textual fornecido em um arquivo com o nome especificado."""
@@ -168,53 +1634,59 @@ Este arquivo documenta a solicitação para implementação futura.
         log_message(f"Erro em generate_video: {e}\\n{traceback.format_exc()}", "Tool:generate_video")
         return {"status": "error", "message": f"Erro ao planejar vídeo: {e}"}
 
+def _search_with_titles(query, num_results):
+    """Busca as URLs no Google e obtém os títulos das páginas; lança exceção em caso de falha."""
+    search_results = []
+    for result in search(query, num_results=num_results, sleep_interval=2):
+        search_results.append(result)
+        if len(search_results) >= num_results:
+            break
+    
+    # Títulos buscados em paralelo, lendo apenas o início de cada página; resultados parciais após o prazo
+    titles = fetch_page_titles(search_results)
+    detailed_results = []
+    for i, url in enumerate(search_results):
+        outcome = titles[url]
+        if isinstance(outcome, Exception):
+            detailed_results.append({
+                "title": f"Resultado {i+1}",
+                "url": url,
+                "snippet": f"Erro ao acessar: {str(outcome)}",
+                "error": type(outcome).__name__
+            })
+            continue
+        status_code, title_text = outcome
+        if status_code == 200:
+            detailed_results.append({
+                "title": title_text or f"Resultado {i+1}",
+                "url": url,
+                "snippet": f"Link {i+1} - {url}"
+            })
+        else:
+            detailed_results.append({
+                "title": f"Resultado {i+1}",
+                "url": url,
+                "snippet": f"Status: {status_code}"
+            })
+    return detailed_results
+
 def google_search(query: str, num_results: int = 5) -> dict:
     """Realiza uma busca no Google e retorna os resultados com títulos e links."""
     try:
+        num_results = int(num_results)
         log_message(f"Buscando no Google: '{query}' (máximo {num_results} resultados)", "Tool:google_search")
         
-        search_results = []
-        for result in search(query, num_results=num_results, sleep_interval=2):
-            search_results.append(result)
-            if len(search_results) >= num_results:
-                break
-            
-        if not search_results:
-            return {"status": "success", "message": "Nenhum resultado encontrado.", "results": []}
+        # Consultas equivalentes da sessão (ou em andamento em outro Worker) reaproveitam a mesma busca
+        detailed_results, origin = SEARCH_CACHE.get_or_search(query, num_results, lambda n: _search_with_titles(query, n))
         
-        # Try to get titles by fetching the pages
-        detailed_results = []
-        for i, url in enumerate(search_results):
-            try:
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-                response = requests.get(url, headers=headers, timeout=10)
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                    title = soup.find('title')
-                    title_text = title.text.strip() if title else f"Resultado {i+1}"
-                    detailed_results.append({
-                        "title": title_text,
-                        "url": url,
-                        "snippet": f"Link {i+1} - {url}"
-                    })
-                else:
-                    detailed_results.append({
-                        "title": f"Resultado {i+1}",
-                        "url": url,
-                        "snippet": f"Status: {response.status_code}"
-                    })
-            except Exception as e:
-                detailed_results.append({
-                    "title": f"Resultado {i+1}",
-                    "url": url,
-                    "snippet": f"Erro ao acessar: {str(e)}"
-                })
+        if not detailed_results:
+            return {"status": "success", "message": "Nenhum resultado encontrado.", "results": []}
         
         result_text = f"Encontrados {len(detailed_results)} resultados para '{query}':\\n"
         for result in detailed_results:
             result_text += f"\\n• {result['title']}\\n  URL: {result['url']}\\n  {result['snippet']}\\n"
         
-        log_message(f"Busca concluída: {len(detailed_results)} resultados", "Tool:google_search")
+        log_message(f"Busca concluída: {len(detailed_results)} resultados (origem: {origin})", "Tool:google_search")
         
         return {
             "status": "success", 
@@ -227,40 +1699,33 @@ def google_search(query: str, num_results: int = 5) -> dict:
         log_message(f"Erro em google_search: {e}\\n{traceback.format_exc()}", "Tool:google_search")
         return {"status": "error", "message": f"Erro ao buscar no Google: {e}"}
 
-def fetch_webpage_content(url: str, extract_text_only: bool = True) -> dict:
-    """Busca o conteúdo de uma página web e extrai texto ou HTML."""
+def fetch_webpage_content(url: str, extract_text_only: bool = True, query: str = "") -> dict:
+    """Busca o conteúdo de uma página web e extrai texto ou HTML (com query, apenas os trechos mais relevantes)."""
     try:
         log_message(f"Buscando conteúdo da página: {url}", "Tool:fetch_webpage_content")
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
+        page = PAGE_CACHE.get(url, timeout=15, complete=bool(query and extract_text_only))
         
-        if extract_text_only:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "nav", "footer", "aside"]):
-                script.decompose()
-            
-            # Get text content
-            text_content = soup.get_text()
+        if extract_text_only and query:
+            page_title, _ = page.text()
+            text_content, info = select_relevant_chunks(page.full_text(), query)
+            PAGE_CACHE.update_size(url)
             
-            # Clean up text
-            lines = (line.strip() for line in text_content.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text_content = '\\n'.join(chunk for chunk in chunks if chunk)
-            
-            # Limit content size
-            if len(text_content) > 8000:
-                text_content = text_content[:8000] + "\\n\\n[CONTEÚDO TRUNCADO...]"
-            
-            # Get page title
-            title = soup.find('title')
-            page_title = title.text.strip() if title else "Título não encontrado"
+            log_message(f"Trechos relevantes de {url} para '{query}': {info}", "Tool:fetch_webpage_content")
+            header = (f"Trechos mais relevantes para '{query}' ({info['chunks_selected']} de {info['chunks_total']})"
+                      if info["matched"] else f"Nenhum trecho contém os termos de '{query}'; início da página")
+            return {
+                "status": "success",
+                "message": f"Conteúdo extraído de: {url}\\n\\nTítulo: {page_title}\\n\\n{header}:\\n{text_content}",
+                "title": page_title,
+                "content": text_content,
+                "url": url,
+                "chunks_selected": info["chunks_selected"],
+                "chunks_total": info["chunks_total"]
+            }
+        elif extract_text_only:
+            page_title, text_content = page.text()
+            PAGE_CACHE.update_size(url)
             
             result_message = f"Conteúdo extraído de: {url}\\n\\nTítulo: {page_title}\\n\\nConteúdo:\\n{text_content}"
             
@@ -275,9 +1740,9 @@ def fetch_webpage_content(url: str, extract_text_only: bool = True) -> dict:
             }
         else:
             # Return raw HTML (limited)
-            html_content = response.text
-            if len(html_content) > 10000:
-                html_content = html_content[:10000] + "\\n\\n[HTML TRUNCADO...]"
+            html_content = page.html()
+            if len(html_content) > WEB_HTML_MAX_CHARS:
+                html_content = html_content[:WEB_HTML_MAX_CHARS] + "\\n\\n[HTML TRUNCADO...]"
             
             return {
                 "status": "success",
@@ -286,6 +1751,9 @@ def fetch_webpage_content(url: str, extract_text_only: bool = True) -> dict:
                 "url": url
             }
             
+    except WebContentRejected as e:
+        log_message(f"Página rejeitada em fetch_webpage_content: {url} - {e}", "Tool:fetch_webpage_content")
+        return {"status": "error", "message": f"Conteúdo não suportado: {e}"}
     except requests.exceptions.RequestException as e:
         log_message(f"Erro de requisição em fetch_webpage_content: {e}", "Tool:fetch_webpage_content")
         return {"status": "error", "message": f"Erro ao acessar a página: {e}"}
@@ -293,7 +1761,8 @@ def fetch_webpage_content(url: str, extract_text_only: bool = True) -> dict:
         log_message(f"Erro em fetch_webpage_content: {e}\\n{traceback.format_exc()}", "Tool:fetch_webpage_content")
         return {"status": "error", "message": f"Erro ao processar página: {e}"}
 
-def browser_automation(action: str, url: str = "", element_selector: str = "", text_input: str = "", wait_seconds: int = 3) -> dict:
+def browser_automation(action: str, url: str = "", element_selector: str = "", text_input: str = "", wait_seconds: int = 3,
+                       max_depth: int = CRAWL_MAX_DEPTH, max_pages: int = CRAWL_MAX_PAGES) -> dict:
     """Automação básica de browser usando requests e BeautifulSoup (versão simplificada sem Playwright)."""
     try:
         log_message(f"Automação browser: ação '{action}' em {url}", "Tool:browser_automation")
@@ -317,60 +1786,93 @@ def browser_automation(action: str, url: str = "", element_selector: str = "", t
             if not url or not element_selector:
                 return {"status": "error", "message": "URL e texto de busca são obrigatórios"}
             
-            # Use element_selector as search text
-            search_text = element_selector.lower()
             result = fetch_webpage_content(url, extract_text_only=True)
-            
-            if result["status"] == "success":
-                content = result.get("content", "").lower()
-                if search_text in content:
-                    # Find context around the search term
-                    index = content.find(search_text)
-                    start = max(0, index - 200)
-                    end = min(len(content), index + 200)
-                    context = result.get("content", "")[start:end]
-                    
-                    return {
-                        "status": "success",
-                        "message": f"Texto '{element_selector}' encontrado em {url}:\\n\\n...{context}...",
-                        "found": True,
-                        "context": context
-                    }
-                else:
-                    return {
-                        "status": "success",
-                        "message": f"Texto '{element_selector}' não encontrado em {url}",
-                        "found": False
-                    }
-            else:
+            if result["status"] != "success":
                 return result
-                
-        elif action == "extract_links":
-            if not url:
-                return {"status": "error", "message": "URL é obrigatória para extrair links"}
-            
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
-            links = []
+            # Sem aspas, o texto buscado é tratado como uma frase exata
+            query = element_selector if '"' in element_selector else f'"{element_selector}"'
+            matches = PAGE_INDEX.search(query, urls=[url], limit=1)
+            if matches:
+                hits = matches[0]["hits"]
+                return {
+                    "status": "success",
+                    "message": f"Texto '{element_selector}' encontrado em {url} ({matches[0]['total_hits']} ocorrência(s)):\\n\\n"
+                               + "\\n\\n".join(f"...{hit['context']}..." for hit in hits),
+                    "found": True,
+                    "context": hits[0]["context"],
+                    "hits": hits,
+                    "total_hits": matches[0]["total_hits"]
+                }
             
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                text = link.get_text().strip()
+            # Trechos de palavra (ex.: prefixos) não casam com os termos do índice; busca simples no texto
+            search_text = element_selector.lower()
+            content = result.get("content", "").lower()
+            if search_text in content:
+                # Find context around the search term
+                index = content.find(search_text)
+                start = max(0, index - SEARCH_CONTEXT_CHARS)
+                end = min(len(content), index + len(search_text) + SEARCH_CONTEXT_CHARS)
+                context = result.get("content", "")[start:end]
                 
-                # Convert relative URLs to absolute
-                if href.startswith('/'):
-                    href = urllib.parse.urljoin(url, href)
-                elif not href.startswith('http'):
-                    continue
-                    
-                if text and len(text) > 0:
-                    links.append({"text": text, "url": href})
+                return {
+                    "status": "success",
+                    "message": f"Texto '{element_selector}' encontrado em {url}:\\n\\n...{context}...",
+                    "found": True,
+                    "context": context
+                }
+            return {
+                "status": "success",
+                "message": f"Texto '{element_selector}' não encontrado em {url}",
+                "found": False
+            }
+                
+        elif action == "crawl":
+            if not url:
+                return {"status": "error", "message": "URL inicial é obrigatória para o crawl"}
             
-            # Limit number of links
-            links = links[:20]
+            max_depth = max(0, min(int(max_depth), CRAWL_MAX_DEPTH))
+            max_pages = max(1, min(int(max_pages), CRAWL_MAX_PAGES))
+            pages, stats = crawl_site(url, max_depth=max_depth, max_pages=max_pages)
+            digest = "\\n".join(f"[{p['depth']}] {p['title']} - {p['url']}\\n    {p['summary']}" for p in pages)
+            return {
+                "status": "success",
+                "message": f"Crawl de {url}: {len(pages)} páginas em {stats['elapsed_s']}s "
+                           f"(profundidade máx. {max_depth}). Use search_all para buscar no conteúdo.\\n\\n{digest}",
+                "pages": pages,
+                "stats": stats
+            }
+                
+        elif action == "search_all":
+            if not element_selector:
+                return {"status": "error", "message": "Consulta de busca é obrigatória (element_selector)"}
+            
+            # Indexa as páginas da sessão ainda não lidas como texto (sem acessar a rede)
+            for page in PAGE_CACHE.pages():
+                page.text()
+            results = PAGE_INDEX.search(element_selector)
+            if not results:
+                return {
+                    "status": "success",
+                    "message": f"Nenhuma das {len(PAGE_INDEX)} páginas visitadas contém '{element_selector}'",
+                    "results": []
+                }
+            return {
+                "status": "success",
+                "message": f"Resultados para '{element_selector}' em {len(PAGE_INDEX)} páginas visitadas:\\n\\n"
+                           + "\\n\\n".join(format_search_hits(r) for r in results),
+                "results": results
+            }
+            
+        elif action == "extract_links":
+            if not url:
+                return {"status": "error", "message": "URL é obrigatória para extrair links"}
+            
+            links = PAGE_CACHE.get(url, timeout=15).links()
+            PAGE_CACHE.update_size(url)
+            
+            # Limit number of links
+            links = links[:20]
             
             links_text = f"Links extraídos de {url}:\\n\\n"
             for i, link in enumerate(links, 1):
@@ -386,9 +1888,12 @@ def browser_automation(action: str, url: str = "", element_selector: str = "", t
         else:
             return {
                 "status": "error", 
-                "message": f"Ação '{action}' não suportada. Use: navigate, search_content, extract_links"
+                "message": f"Ação '{action}' não suportada. Use: navigate, search_content, search_all, extract_links, crawl"
             }
             
+    except WebContentRejected as e:
+        log_message(f"Página rejeitada em browser_automation: {url} - {e}", "Tool:browser_automation")
+        return {"status": "error", "message": f"Conteúdo não suportado: {e}"}
     except requests.exceptions.RequestException as e:
         log_message(f"Erro de requisição em browser_automation: {e}", "Tool:browser_automation")
         return {"status": "error", "message": f"Erro de rede: {e}"}
@@ -487,6 +1992,10 @@ fetch_webpage_content_tool = genai.types.FunctionDeclaration(
             "extract_text_only": {
                 "type": "boolean",
                 "description": "Se true, extrai apenas texto limpo. Se false, retorna HTML bruto (padrão: true)"
+            },
+            "query": {
+                "type": "string",
+                "description": "Opcional: pergunta ou termos da tarefa atual. Em páginas longas, retorna apenas os trechos mais relevantes para ela em vez do início da página"
             }
         },
         "required": ["url"]
@@ -501,16 +2010,16 @@ browser_automation_tool = genai.types.FunctionDeclaration(
         "properties": {
             "action": {
                 "type": "string",
-                "description": "Ação a realizar: 'navigate' (navegar para URL), 'search_content' (buscar texto na página), 'extract_links' (extrair todos os links)",
-                "enum": ["navigate", "search_content", "extract_links"]
+                "description": "Ação a realizar: 'navigate' (navegar para URL), 'search_content' (buscar texto na página, todas as ocorrências), 'search_all' (buscar em todas as páginas já visitadas, ranqueadas por relevância), 'extract_links' (extrair todos os links), 'crawl' (visitar o site em largura a partir da URL e resumir as páginas)",
+                "enum": ["navigate", "search_content", "search_all", "extract_links", "crawl"]
             },
             "url": {
                 "type": "string",
-                "description": "URL da página web (obrigatório para todas as ações)"
+                "description": "URL da página web (obrigatório para todas as ações, exceto 'search_all')"
             },
             "element_selector": {
                 "type": "string",
-                "description": "Texto a buscar na página (usado com action='search_content')"
+                "description": "Texto a buscar (usado com 'search_content' e 'search_all'; use aspas para frases exatas)"
             },
             "text_input": {
                 "type": "string",
@@ -519,9 +2028,17 @@ browser_automation_tool = genai.types.FunctionDeclaration(
             "wait_seconds": {
                 "type": "integer",
                 "description": "Segundos para aguardar (padrão: 3)"
+            },
+            "max_depth": {
+                "type": "integer",
+                "description": f"Profundidade máxima de links a seguir no 'crawl' (padrão e máximo: {CRAWL_MAX_DEPTH})"
+            },
+            "max_pages": {
+                "type": "integer",
+                "description": f"Número máximo de páginas visitadas no 'crawl' (padrão e máximo: {CRAWL_MAX_PAGES})"
             }
         },
-        "required": ["action", "url"]
+        "required": ["action"]
     }
 )
 
@@ -543,6 +2060,98 @@ AVAILABLE_TOOL_DECLARATIONS = [
     browser_automation_tool
 ]
 
+# --- Versões Assíncronas das Ferramentas ---
+# As ferramentas usam requests (bloqueante); no caminho assíncrono elas rodam no executor
+# padrão do event loop para não bloquear os demais fluxos de trabalho.
+async def google_search_async(query: str, num_results: int = 5) -> dict:
+    return await asyncio.to_thread(google_search, query, num_results)
+
+async def fetch_webpage_content_async(url: str, extract_text_only: bool = True, query: str = "") -> dict:
+    return await asyncio.to_thread(fetch_webpage_content, url, extract_text_only, query)
+
+async def browser_automation_async(action: str, url: str = "", element_selector: str = "", text_input: str = "", wait_seconds: int = 3,
+                                   max_depth: int = CRAWL_MAX_DEPTH, max_pages: int = CRAWL_MAX_PAGES) -> dict:
+    return await asyncio.to_thread(browser_automation, action, url, element_selector, text_input, wait_seconds,
+                                   max_depth, max_pages)
+
+async def run_tool_async(function_name, function_args):
+    """Executa uma ferramenta pelo nome sem bloquear o event loop."""
+    if function_name in AVAILABLE_TOOLS_ASYNC:
+        return await AVAILABLE_TOOLS_ASYNC[function_name](**function_args)
+    return await asyncio.to_thread(AVAILABLE_TOOLS[function_name], **function_args)
+
+AVAILABLE_TOOLS_ASYNC = {
+    "google_search": google_search_async,
+    "fetch_webpage_content": fetch_webpage_content_async,
+    "browser_automation": browser_automation_async
+}
+
+# --- Execução de Ferramentas (function calling) ---
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOL_CALLS, thread_name_prefix="mag-tool")
+_TOOL_STATS_LOCK = threading.Lock()
+TOOL_LATENCY_STATS = {}
+
+def record_tool_latency(function_name, seconds, ok=True):
+    with _TOOL_STATS_LOCK:
+        stats = TOOL_LATENCY_STATS.setdefault(function_name, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["calls"] += 1
+        stats["errors"] += 0 if ok else 1
+        stats["total_s"] += seconds
+        stats["max_s"] = max(stats["max_s"], seconds)
+
+def tool_latency_stats():
+    with _TOOL_STATS_LOCK:
+        return {name: dict(stats, mean_s=stats["total_s"] / stats["calls"]) for name, stats in TOOL_LATENCY_STATS.items()}
+
+def _tool_result_ok(result):
+    return not (isinstance(result, dict) and result.get("status") == "error")
+
+def execute_tool_call(function_name, function_args, agent_name="Sistema"):
+    """Executa uma ferramenta, registrando latência; erros viram um resultado de erro para o modelo."""
+    if function_name not in AVAILABLE_TOOLS:
+        return {"status": "error", "message": f"Ferramenta '{function_name}' não disponível."}
+    log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
+    start = time.perf_counter()
+    try:
+        result = AVAILABLE_TOOLS[function_name](**function_args)
+    except Exception as e:
+        result = {"status": "error", "message": f"Erro ao executar {function_name}: {e}"}
+    elapsed = time.perf_counter() - start
+    record_tool_latency(function_name, elapsed, _tool_result_ok(result))
+    log_message(f"Resultado da função {function_name} ({elapsed:.2f}s): {result}", agent_name, event="tool_result", duration=elapsed)
+    return result
+
+def execute_tool_calls(calls, agent_name="Sistema"):
+    """Executa todas as chamadas de uma resposta em paralelo; retorna os resultados na mesma ordem."""
+    if len(calls) == 1:
+        return [execute_tool_call(calls[0][0], calls[0][1], agent_name)]
+    futures = [TOOL_EXECUTOR.submit(execute_tool_call, name, args, agent_name) for name, args in calls]
+    return [future.result() for future in futures]
+
+async def execute_tool_call_async(function_name, function_args, agent_name="Sistema"):
+    if function_name not in AVAILABLE_TOOLS:
+        return {"status": "error", "message": f"Ferramenta '{function_name}' não disponível."}
+    log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
+    start = time.perf_counter()
+    try:
+        result = await run_tool_async(function_name, function_args)
+    except Exception as e:
+        result = {"status": "error", "message": f"Erro ao executar {function_name}: {e}"}
+    elapsed = time.perf_counter() - start
+    record_tool_latency(function_name, elapsed, _tool_result_ok(result))
+    log_message(f"Resultado da função {function_name} ({elapsed:.2f}s): {result}", agent_name, event="tool_result", duration=elapsed)
+    return result
+
+async def execute_tool_calls_async(calls, agent_name="Sistema"):
+    return await asyncio.gather(*(execute_tool_call_async(name, args, agent_name) for name, args in calls))
+
+def function_response_part(function_name, result):
+    """Monta a parte function_response que devolve o resultado da ferramenta ao modelo."""
+    payload = json.loads(json.dumps(result, default=str))
+    if not isinstance(payload, dict):
+        payload = {"result": payload}
+    return genai.protos.Part(function_response=genai.protos.FunctionResponse(name=function_name, response=payload))
+
 # --- Funções de Comunicação e Arquivos ---
 def print_agent_message(agent_name, message): print(f"\n🤖 [{agent_name}]: {message}"); log_message(message, agent_name)
 def print_user_message(message): print(f"\n👤 [Usuário]: {message}"); log_message(message, "Usuário")
@@ -675,8 +2284,399 @@ def get_mime_type_from_extension(file_path: str) -> str:
     log_message(f"Arquivo '{file_path}' -> MIME type: {mime_type}", "Sistema")
     return mime_type
 
+def file_sha256(path, chunk_bytes=UPLOAD_HASH_CHUNK_BYTES):
+    """SHA-256 do conteúdo lido em blocos num buffer reutilizado, sem carregar o arquivo inteiro na memória."""
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_bytes)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+def _file_expiration(file_obj):
+    expiration = getattr(file_obj, "expiration_time", None)
+    try:
+        return expiration.timestamp() if expiration else time.time() + UPLOAD_DEFAULT_TTL_SECONDS
+    except (AttributeError, OverflowError, ValueError):
+        return time.time() + UPLOAD_DEFAULT_TTL_SECONDS
+
+def _remote_sha256_matches(file_obj, hex_digest):
+    """Compara o sha256_hash informado pela File API (bytes crus, hex ou hex em base64) com o digest local."""
+    remote = getattr(file_obj, "sha256_hash", None)
+    if not remote:
+        return False
+    if isinstance(remote, str):
+        remote = remote.encode()
+    candidates = {remote, remote.lower()}
+    try:
+        candidates.add(base64.b64decode(remote, validate=True).lower())
+    except (ValueError, TypeError):
+        pass
+    return bytes.fromhex(hex_digest) in candidates or hex_digest.encode() in candidates
+
+class UploadManifest:
+    """Manifesto local SHA-256 + MIME type -> arquivo remoto (nome e validade), persistido em UPLOADED_FILES_CACHE_DIRECTORY.
+
+    Também guarda tamanho e mtime de cada caminho já calculado, para não recalcular o hash de arquivos intocados.
+    """
+
+    def __init__(self, path=UPLOAD_MANIFEST_FILE, reuse_min_ttl_seconds=UPLOAD_REUSE_MIN_TTL_SECONDS):
+        self.path = path
+        self.reuse_min_ttl_seconds = reuse_min_ttl_seconds
+        self._lock = threading.Lock()
+        self._files = {}   # "sha256:mime" -> {"name", "display_name", "size", "expires_at"}
+        self._paths = {}   # caminho absoluto -> {"size", "mtime_ns", "sha256"}
+        self._dirty = False
+        self.counters = Counter()
+        self._load()
+
+    @staticmethod
+    def _key(sha256, mime_type):
+        return f"{sha256}:{mime_type}"
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            self._files = {k: v for k, v in data.get("files", {}).items() if v.get("expires_at", 0) > now}
+            self._paths = data.get("paths", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            log_message(f"Manifesto de uploads ignorado ({e}).", "Sistema")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            self._files = {k: v for k, v in self._files.items() if v["expires_at"] > now}
+            data = {"files": dict(self._files), "paths": dict(self._paths)}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log_message(f"Falha ao gravar manifesto de uploads: {e}", "Sistema")
+
+    def digest(self, path):
+        """SHA-256 do arquivo, reaproveitando o valor anterior se tamanho e mtime não mudaram."""
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+        with self._lock:
+            known = self._paths.get(abs_path)
+            if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+                self.counters["hash_skipped"] += 1
+                return known["sha256"]
+        sha256 = file_sha256(abs_path)
+        with self._lock:
+            self._paths[abs_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+            self._dirty = True
+            self.counters["hashed"] += 1
+        return sha256
+
+    def lookup(self, sha256, mime_type):
+        """Nome do arquivo remoto com este conteúdo que ainda vale por pelo menos reuse_min_ttl_seconds, ou None."""
+        with self._lock:
+            entry = self._files.get(self._key(sha256, mime_type))
+            if entry and entry["expires_at"] - time.time() >= self.reuse_min_ttl_seconds:
+                return entry["name"]
+            return None
+
+    def record(self, sha256, mime_type, file_obj, size):
+        with self._lock:
+            self._files[self._key(sha256, mime_type)] = {
+                "name": file_obj.name, "display_name": getattr(file_obj, "display_name", None) or file_obj.name,
+                "size": size, "expires_at": _file_expiration(file_obj)}
+            self._dirty = True
+
+    def names(self):
+        with self._lock:
+            return {entry["name"] for entry in self._files.values()}
+
+    def forget(self, name):
+        """Remove do manifesto as entradas que apontam para um arquivo remoto que não existe mais."""
+        with self._lock:
+            stale = [k for k, v in self._files.items() if v["name"] == name]
+            for key in stale:
+                del self._files[key]
+            self._dirty = self._dirty or bool(stale)
+
+UPLOAD_MANIFEST = UploadManifest()
+
+class UploadProgress:
+    """Linha de progresso dos uploads em paralelo (arquivos, MB enviados e vazão)."""
+
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.start = time.perf_counter()
+        self.counts = Counter()
+        self.sent_bytes = 0
+        self._lock = threading.Lock()
+
+    def update(self, event, size=0):
+        with self._lock:
+            self.counts[event] += 1
+            if event == "uploaded":
+                self.sent_bytes += size
+            elapsed = max(time.perf_counter() - self.start, 1e-6)
+            print(f"\r📤 Upload: {self.counts['uploaded']}/{self.total_files} enviados, {self.counts['reused']} reutilizados, "
+                  f"{self.counts['active']} prontos, "
+                  f"{self.counts['failed']} falhas | {self.sent_bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB | "
+                  f"{self.sent_bytes / 1e6 / elapsed:.2f} MB/s", end="", flush=True)
+
+def upload_file_with_retry(path, display_name, progress=None, mime_type=None):
+    """Envia um arquivo, repetindo em falhas transitórias com backoff exponencial."""
+    mime_type = mime_type or get_mime_type_from_extension(path)
+    delay = UPLOAD_RETRY_DELAY_SECONDS
+    for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+        try:
+            file_obj = genai.upload_file(path=path, mime_type=mime_type, display_name=display_name)
+            break
+        except Exception as e:
+            if attempt == UPLOAD_MAX_RETRIES or classify_api_exception(e) == "fatal" or isinstance(e, OSError):
+                raise
+            log_message(f"Upload de '{display_name}' falhou (tentativa {attempt}/{UPLOAD_MAX_RETRIES}): {e}. "
+                        f"Nova tentativa em {delay}s.", "Sistema")
+            time.sleep(delay + random.uniform(0, delay))
+            delay *= 2
+    if progress:
+        progress.update("uploaded", os.path.getsize(path))
+    return file_obj
+
+def _find_remote_file(name, remote_files):
+    if remote_files is not None:
+        return remote_files.get(name)
+    try:
+        return genai.get_file(name)
+    except google_exceptions.NotFound:
+        return None
+
+def upload_or_reuse_file(path, progress=None, remote_files=None, manifest=UPLOAD_MANIFEST):
+    """Reutiliza o arquivo remoto com o mesmo conteúdo (manifesto ou list_files) ou envia o arquivo; retorna (arquivo, reutilizado).
+
+    remote_files é o resultado de genai.list_files() indexado por nome; sem ele, o arquivo do manifesto é conferido com genai.get_file.
+    """
+    display_name = os.path.basename(path)
+    if manifest is None:
+        return upload_file_with_retry(path, display_name, progress), False
+    mime_type = get_mime_type_from_extension(path)
+    sha256, size = manifest.digest(path), os.path.getsize(path)
+    name = manifest.lookup(sha256, mime_type)
+    if name:
+        try:
+            file_obj = _find_remote_file(name, remote_files)
+        except Exception as e:
+            log_message(f"Não foi possível conferir '{name}' na API ({e}); '{display_name}' será reenviado.", "Sistema")
+            file_obj = None
+        if file_obj is not None and file_obj.state.name != "FAILED":
+            if progress:
+                progress.update("reused")
+            return file_obj, True
+        manifest.forget(name)
+    # Arquivos enviados antes do manifesto existir: procura o mesmo conteúdo na listagem da API
+    now = time.time()
+    for file_obj in (remote_files or {}).values():
+        if getattr(file_obj, "mime_type", None) == mime_type and file_obj.state.name != "FAILED" \
+                and _file_expiration(file_obj) - now >= manifest.reuse_min_ttl_seconds \
+                and _remote_sha256_matches(file_obj, sha256):
+            manifest.record(sha256, mime_type, file_obj, size)
+            if progress:
+                progress.update("reused")
+            return file_obj, True
+    file_obj = upload_file_with_retry(path, display_name, progress, mime_type=mime_type)
+    manifest.record(sha256, mime_type, file_obj, size)
+    return file_obj, False
+
+def _refresh_file_state(file_obj):
+    """Estado atual do arquivo; retorna (arquivo, erro). Uma falha na consulta mantém o arquivo como estava (PROCESSING)."""
+    if file_obj.state.name != "PROCESSING":
+        return file_obj, None
+    try:
+        return genai.get_file(file_obj.name), None
+    except Exception as e:
+        log_message(f"Falha ao consultar '{file_obj.name}' ({e}); nova tentativa na próxima consulta.", "Sistema")
+        return file_obj, e
+
+def upload_files(paths, max_workers=UPLOAD_MAX_WORKERS, poll_seconds=FILE_ACTIVE_POLL_SECONDS,
+                 active_timeout=FILE_ACTIVE_TIMEOUT_SECONDS, remote_files=None, manifest=UPLOAD_MANIFEST):
+    """Envia os arquivos em paralelo e consulta, também em paralelo, os que estão em PROCESSING até ficarem ACTIVE.
+
+    Arquivos cujo conteúdo já está na API (manifesto de SHA-256) são reutilizados sem novo upload; manifest=None desativa.
+    Retorna (objetos de arquivo, metadados, relatório), na ordem dos caminhos e sem os que falharam.
+    """
+    if not UPLOAD_DEDUP_ENABLED:
+        manifest = None
+    paths = [p for p in paths if os.path.isfile(p)]
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    progress = UploadProgress(len(paths), total_bytes)
+    results, failures, processing = {}, {}, {}  # processing: caminho -> (arquivo, prazo para ficar ACTIVE)
+    reused = set()
+    upload_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mag-upload")
+    poll_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mag-file-poll")
+    try:
+        futures = {upload_executor.submit(upload_or_reuse_file, p, progress, remote_files, manifest): p for p in paths}
+        pending, next_poll = set(futures), time.monotonic()
+        while pending or processing:
+            timeout = max(0.0, next_poll - time.monotonic()) if processing else None
+            if pending:
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                # Todos os envios terminaram: wait() com um conjunto vazio retornaria na hora
+                time.sleep(timeout)
+                done = set()
+            for future in done:
+                path = futures[future]
+                try:
+                    file_obj, was_reused = future.result()
+                    processing[path] = (file_obj, time.monotonic() + active_timeout)
+                    if was_reused:
+                        reused.add(path)
+                except Exception as e:
+                    failures[path] = str(e)
+                    progress.update("failed")
+            if not processing or time.monotonic() < next_poll:
+                continue
+            # Uploads continuam enquanto os arquivos já enviados são consultados
+            polled = list(processing.items())
+            refreshed = poll_executor.map(lambda item: _refresh_file_state(item[1][0]), polled)
+            for (path, (_, deadline)), (file_obj, error) in zip(polled, refreshed):
+                state = file_obj.state.name
+                if state == "PROCESSING" and time.monotonic() < deadline:
+                    processing[path] = (file_obj, deadline)
+                    continue
+                del processing[path]
+                if state == "PROCESSING" or state == "FAILED":
+                    failures[path] = (f"ainda em processamento após {active_timeout}s"
+                                      + (f" (última consulta falhou: {error})" if error else "")
+                                      if state == "PROCESSING" else "processamento falhou na API")
+                    progress.update("failed")
+                else:
+                    results[path] = file_obj
+                    progress.update("active")
+            next_poll = time.monotonic() + poll_seconds
+    finally:
+        upload_executor.shutdown(wait=False, cancel_futures=True)
+        poll_executor.shutdown(wait=False)
+        if manifest is not None:
+            manifest.save()
+    if paths:
+        print()
+    for path, error in failures.items():
+        log_message(f"Erro no upload de '{os.path.basename(path)}': {error}", "Sistema")
+    elapsed = time.perf_counter() - progress.start
+    report = {"files": len(paths), "uploaded": len(results) - len(reused & results.keys()),
+              "reused": len(reused & results.keys()), "failed": failures, "bytes": total_bytes,
+              "elapsed_s": round(elapsed, 2), "mb_per_s": round(progress.sent_bytes / 1e6 / max(elapsed, 1e-6), 2),
+              "files_per_s": round(len(results) / max(elapsed, 1e-6), 2)}
+    log_message(f"Uploads concluídos: {report}", "Sistema", event="upload", duration=elapsed)
+    file_objects = [results[p] for p in paths if p in results]
+    metadata = [{"file_id": results[p].name, "display_name": os.path.basename(p)} for p in paths if p in results]
+    return file_objects, metadata, report
+
+def _file_age_seconds(file_obj):
+    created = getattr(file_obj, "create_time", None)
+    try:
+        return time.time() - created.timestamp() if created else None
+    except (AttributeError, OverflowError, ValueError):
+        return None
+
+def select_remote_files(files, older_than_hours=None, name_pattern=None, in_manifest=None, manifest=UPLOAD_MANIFEST):
+    """Separa (selecionados, ignorados) por idade, padrão do nome de exibição (fnmatch) e presença no manifesto.
+
+    in_manifest=True mantém só os arquivos do manifesto; False, só os que ele não conhece (sobras de outras sessões).
+    """
+    manifest_names = manifest.names() if in_manifest is not None and manifest is not None else set()
+    selected, skipped = [], []
+    for file_obj in files:
+        age = _file_age_seconds(file_obj)
+        display_name = getattr(file_obj, "display_name", None) or file_obj.name
+        if (older_than_hours is not None and (age is None or age < older_than_hours * 3600)) \
+                or (name_pattern and not fnmatch.fnmatch(display_name, name_pattern)
+                    and not fnmatch.fnmatch(file_obj.name, name_pattern)) \
+                or (in_manifest is not None and (file_obj.name in manifest_names) != in_manifest):
+            skipped.append(file_obj)
+        else:
+            selected.append(file_obj)
+    return selected, skipped
+
+def _delete_file_with_retry(name, limiter):
+    """Remove um arquivo remoto respeitando o limitador; 429 pausa todas as remoções pelo retry hint do servidor."""
+    delay = UPLOAD_RETRY_DELAY_SECONDS
+    for attempt in range(1, DELETE_MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            genai.delete_file(name=name)
+            return "deleted"
+        except google_exceptions.NotFound:
+            return "missing"
+        except Exception as e:
+            if attempt == DELETE_MAX_RETRIES or classify_api_exception(e) == "fatal":
+                raise
+            wait_seconds = server_retry_delay(e) or delay + random.uniform(0, delay)
+            if isinstance(e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+                limiter.pause(wait_seconds)
+            else:
+                time.sleep(wait_seconds)
+            delay *= 2
+
+def cleanup_remote_files(files=None, older_than_hours=None, name_pattern=None, in_manifest=None, dry_run=False,
+                         max_workers=DELETE_MAX_WORKERS, requests_per_minute=FILE_API_REQUESTS_PER_MINUTE,
+                         manifest=UPLOAD_MANIFEST):
+    """Remove em paralelo os arquivos da File API que passam nos filtros; retorna o relatório de removidos/falhas/ignorados.
+
+    files é a listagem de genai.list_files() (obtida aqui se omitida); dry_run só informa o que seria removido.
+    """
+    start = time.perf_counter()
+    files = list(genai.list_files()) if files is None else list(files)
+    selected, skipped = select_remote_files(files, older_than_hours, name_pattern, in_manifest, manifest)
+    report = {"listed": len(files), "selected": len(selected), "deleted": 0, "missing": 0, "failed": {},
+              "skipped": len(skipped), "dry_run": dry_run, "remaining": skipped}
+    if dry_run:
+        report["would_delete"] = [getattr(f, "display_name", None) or f.name for f in selected]
+        report["remaining"] = files
+        selected = []
+    limiter = TokenBucketRateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=1)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mag-file-delete") as executor:
+        futures = {executor.submit(_delete_file_with_retry, f.name, limiter): f for f in selected}
+        for future in as_completed(futures):
+            file_obj = futures[future]
+            try:
+                report[future.result()] += 1
+                if manifest is not None:
+                    manifest.forget(file_obj.name)
+            except Exception as e:
+                report["failed"][file_obj.name] = str(e)
+                report["remaining"].append(file_obj)
+    if manifest is not None:
+        manifest.save()
+    elapsed = time.perf_counter() - start
+    report["elapsed_s"] = round(elapsed, 2)
+    report["files_per_s"] = round((report["deleted"] + report["missing"]) / max(elapsed, 1e-6), 2)
+    log_message(f"Limpeza de arquivos remotos: {len(selected)} selecionados, {report['deleted']} removidos, "
+                f"{report['missing']} já inexistentes, {len(report['failed'])} falhas, {report['skipped']} ignorados "
+                f"em {report['elapsed_s']}s.", "Sistema", event="file_cleanup", duration=elapsed)
+    return report
+
+def format_cleanup_report(report):
+    if report["dry_run"]:
+        return (f"Simulação: {report['selected']} de {report['listed']} arquivo(s) seriam removidos "
+                f"({report['skipped']} ignorados pelos filtros).")
+    return (f"{report['deleted']} removido(s), {report['missing']} já inexistente(s), {len(report['failed'])} falha(s), "
+            f"{report['skipped']} ignorado(s) pelos filtros, em {report['elapsed_s']}s ({report['files_per_s']} arquivos/s).")
+
 def get_uploaded_files_info_from_user():
     uploaded_file_objects, uploaded_files_metadata = [], []
+    api_files_list = None
     try:
         print_agent_message("Sistema", "Verificando arquivos na API...")
         api_files_list = list(genai.list_files())
@@ -685,10 +2685,11 @@ def get_uploaded_files_info_from_user():
             print_agent_message("Sistema", f"Encontrados {len(api_files_list)} arquivos existentes.")
             if input("👤 Deseja limpar TODOS os arquivos da API? (s/n) ➡️ ").lower() == 's':
                 print_agent_message("Sistema", "Limpando arquivos...")
-                for file_obj in api_files_list:
-                    try: genai.delete_file(name=file_obj.name); time.sleep(0.2)
-                    except Exception as e: log_message(f"Falha ao deletar {file_obj.name}: {e}", "Sistema")
-                print_agent_message("Sistema", "Limpeza concluída."); api_files_list = []                                                        
+                report = cleanup_remote_files(files=api_files_list)
+                for name, error in report["failed"].items():
+                    print_agent_message("Sistema", f"❌ Falha ao deletar {name}: {error}")
+                print_agent_message("Sistema", f"Limpeza concluída: {format_cleanup_report(report)}")
+                api_files_list = report["remaining"]
             if api_files_list:
                 print_agent_message("Sistema", "Arquivos restantes na API:")
                 for i, f in enumerate(api_files_list):
@@ -729,357 +2730,1489 @@ def get_uploaded_files_info_from_user():
                 continue
 
             for fp in found_files:
-                dn = os.path.basename(fp)
-                try:
-                    if os.path.isfile(fp): # Adicional checagem caso o glob retorne algo que não é um arquivo direto
-                        print_agent_message("Sistema", f"Enviando '{dn}'...")
-                        mime_type = get_mime_type_from_extension(fp)
-                        file_obj = genai.upload_file(path=fp, mime_type=mime_type)
-                        uploaded_file_objects.append(file_obj)
-                        uploaded_files_metadata.append({"file_id": file_obj.name, "display_name": dn})
-                        print_agent_message("Sistema", f"✅ '{dn}' enviado."); time.sleep(0.5) # Pequena pausa para evitar sobrecarga da API
-                    else:
-                        print_agent_message("Sistema", f"ℹ️ '{fp}' não é um arquivo válido e será ignorado.")
-                except Exception as e:
-                    print_agent_message("Sistema", f"❌ Erro no upload de '{dn}': {e}")
-                    log_message(f"Erro no upload de '{dn}': {e}", "Sistema")
+                if not os.path.isfile(fp): # Adicional checagem caso o glob retorne algo que não é um arquivo direto
+                    print_agent_message("Sistema", f"ℹ️ '{fp}' não é um arquivo válido e será ignorado.")
+            remote_files = {f.name: f for f in api_files_list} if api_files_list is not None else None
+            file_objects, files_metadata, report = upload_files(found_files, remote_files=remote_files)
+            selected_names = {f.name for f in uploaded_file_objects}
+            for file_obj, meta in zip(file_objects, files_metadata):
+                if file_obj.name not in selected_names:  # o mesmo conteúdo pode já ter sido selecionado acima
+                    selected_names.add(file_obj.name)
+                    uploaded_file_objects.append(file_obj)
+                    uploaded_files_metadata.append(meta)
+            for fp, error in report["failed"].items():
+                print_agent_message("Sistema", f"❌ Erro no upload de '{os.path.basename(fp)}': {error}")
+            print_agent_message("Sistema", f"✅ {report['uploaded']} arquivo(s) enviados e {report['reused']} reutilizados "
+                                           f"(conteúdo inalterado) de {report['files']}, prontos em {report['elapsed_s']}s "
+                                           f"({report['mb_per_s']} MB/s, {report['files_per_s']} arquivos/s).")
             print_agent_message("Sistema", f"Concluído o processamento do padrão '{file_pattern}'.")
     return uploaded_file_objects, uploaded_files_metadata
 
-def call_gemini_api_with_retry(prompt_parts, agent_name="Sistema", gen_config_dict=None):
-    log_message(f"Chamando API para {agent_name}...", "Sistema")
-    
-    if gen_config_dict is None:
-        gen_config_dict = {}
-    
-    # Adiciona as safety_settings ao dicionário gen_config_dict se não estiver presente
-    if 'safety_settings' not in gen_config_dict:
-        gen_config_dict['safety_settings'] = safety_settings_gemini
-
-    # Create the model instance
-    model = genai.GenerativeModel(
-        model_name=GEMINI_TEXT_MODEL_NAME,
-        safety_settings=gen_config_dict.pop('safety_settings', safety_settings_gemini)
-    )
-    
-    # Remove safety_settings from gen_config_dict since it's passed to model
-    generation_config = genai.GenerationConfig(**{k: v for k, v in gen_config_dict.items() if k != 'tools'})
-    tools = gen_config_dict.get('tools', None)
-    
-    log_message(f"Usando config: {generation_config}", "Sistema")
-    
-    current_retry_delay = INITIAL_RETRY_DELAY_SECONDS
-    for attempt in range(MAX_API_RETRIES):
-        log_message(f"Tentativa {attempt + 1}/{MAX_API_RETRIES}...", "Sistema")
-        try:
-            if tools:
-                response = model.generate_content(
-                    contents=prompt_parts,
-                    generation_config=generation_config,
-                    tools=tools
-                )
-            else:
-                response = model.generate_content(
-                    contents=prompt_parts,
-                    generation_config=generation_config
-                )
-            return response
-        except Exception as e:
-            log_message(f"Exceção: {type(e).__name__} - {e}\\n{traceback.format_exc()}", "Sistema")
-            if attempt < MAX_API_RETRIES - 1:
-                time.sleep(current_retry_delay)
-                current_retry_delay *= RETRY_BACKOFF_FACTOR
-            else: return None
-    return None
-
-def extract_and_print_thoughts(response):
-    """Extrai e exibe pensamentos/raciocínio do modelo Gemini."""
-    if not response or not response.candidates:
-        return
-        
-    for candidate in response.candidates:
-        if hasattr(candidate, 'content') and candidate.content and hasattr(candidate.content, 'parts'):
-            for part in candidate.content.parts:
-                # Look for thinking/thought content in different possible formats
-                if hasattr(part, 'thought') and part.thought:
-                    if hasattr(part.thought, 'content'):
-                        print_thought_message(part.thought.content)
-                    elif hasattr(part, 'text') and part.text:
-                        print_thought_message(part.text)
-                elif hasattr(part, 'text') and part.text and 'pensamento:' in part.text.lower():
-                    # Extract thinking content from text
-                    lines = part.text.split('\n')
-                    thought_lines = []
-                    in_thought = False
-                    for line in lines:
-                        if 'pensamento:' in line.lower() or 'thinking:' in line.lower():
-                            in_thought = True
-                            thought_lines.append(line)
-                        elif in_thought and (line.strip() == '' or line.startswith('---')):
-                            break
-                        elif in_thought:
-                            thought_lines.append(line)
-                    
-                    if thought_lines:
-                        print_thought_message('\n'.join(thought_lines))
-
-# --- Classes dos Agentes ---
+class ModelRegistry:
+    """Registro thread-safe de instâncias GenerativeModel pré-configuradas e reutilizáveis."""
 
-class RouterAgent:
-    """Router agent que decide qual agente especializado usar para cada tarefa."""
-    
     def __init__(self):
-        self.routing_instruction = (
-            "Você é um Router Agent especialista. Analise a tarefa fornecida e determine qual tipo de agente "
-            "é mais adequado para executá-la. Responda com um JSON contendo 'agent_type' e 'reasoning'. "
-            "Tipos disponíveis: 'text_worker' (tarefas de texto/código simples), 'image_worker' (geração de imagens), "
-            "'video_worker' (geração de vídeos), 'analysis_worker' (análise de dados), "
-            "'thinking_worker' (raciocínio complexo, problemas difíceis, planejamento estratégico), "
-            "'browser_worker' (busca no Google, navegação web, extração de conteúdo de sites, automação de browser). "
-            "Exemplo: {'agent_type': 'browser_worker', 'reasoning': 'Tarefa requer busca web ou navegação'}"
+        self._models = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name, safety_settings, tools, generation_params):
+        """Monta a chave (modelo, segurança, ferramentas, parâmetros de geração) do registro."""
+        tool_names = tuple(getattr(t, 'name', repr(t)) for t in tools) if tools else ()
+        return (
+            model_name,
+            json.dumps(safety_settings, sort_keys=True, default=repr),
+            tool_names,
+            json.dumps(generation_params, sort_keys=True, default=repr),
         )
-        log_message("RouterAgent criado.", "RouterAgent")
-    
-    def route_task(self, task_description, context=""):
-        """Decide qual agente deve executar a tarefa."""
-        print_agent_message("RouterAgent", f"Analisando roteamento para: '{task_description}'")
-        
-        prompt_parts = [
-            f"{self.routing_instruction}\n\n"
-            f"Contexto: {context}\n"
-            f"Tarefa a ser roteada: '{task_description}'\n\n"
-            f"Determine o melhor agente para esta tarefa."
-        ]
-        
-        gen_config = {
-            "temperature": 0.3,
-            "response_mime_type": "application/json"
-        }
-        
-        response = call_gemini_api_with_retry(prompt_parts, "RouterAgent", gen_config_dict=gen_config)
-        
-        if not response or not response.text:
-            log_message("Router falhou, usando text_worker como padrão", "RouterAgent")
-            return "text_worker", "Fallback para texto devido a falha no roteamento"
-        
-        try:
-            text_response = response.text.strip()
-            if text_response.startswith("```json"): 
-                text_response = text_response[7:-3].strip()
-            route_dict = json.loads(text_response)
-            
-            agent_type = route_dict.get("agent_type", "text_worker")
-            reasoning = route_dict.get("reasoning", "Sem justificativa fornecida")
-            
-            print_agent_message("RouterAgent", f"Roteado para: {agent_type} - {reasoning}")
-            return agent_type, reasoning
-            
-        except (json.JSONDecodeError, TypeError) as e:
-            log_message(f"Erro no parsing do router: {e}. Resposta: '{response.text}'", "RouterAgent")
-            return "text_worker", "Fallback para texto devido a erro de parsing"
 
-class Worker:
-    def __init__(self, task_manager):
-        self.task_manager = task_manager
-        log_message("Worker (v11.26 - Gemini 2.5) criado.", "Worker")
+    def get(self, model_name, safety_settings=None, tools=None, generation_params=None):
+        """Retorna um modelo com config e ferramentas já convertidas, criando-o apenas na primeira vez."""
+        generation_params = generation_params or {}
+        key = self.make_key(model_name, safety_settings, tools, generation_params)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+            # A conversão de tools/GenerationConfig acontece uma única vez, na construção
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                safety_settings=safety_settings,
+                generation_config=genai.GenerationConfig(**generation_params),
+                tools=tools or None
+            )
+            self._models[key] = model
+            log_message(f"Novo modelo registrado: {model_name} (total: {len(self._models)})", "ModelRegistry")
+            return model
 
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "Worker"
-        print_agent_message(agent_name, f"Executando: '{task_description}'")
+    def stats(self):
+        with self._lock:
+            return {"models": len(self._models), "hits": self.hits, "misses": self.misses}
 
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
-        
-        conversation_history.append(f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
-                                    f"Objetivo Geral: {original_goal}\n\n"
-                                    f"Sua tarefa agora: \\'{task_description}\\'. ")
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS
-        }
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = self.misses = 0
 
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
+MODEL_REGISTRY = ModelRegistry()
 
-        if not response: return {"text_content": "Falha na API."}, []
+def split_gen_config(gen_config_dict, model_name=GEMINI_TEXT_MODEL_NAME):
+    """Separa gen_config_dict em (modelo, safety_settings, tools, parâmetros de geração) sem alterar o original."""
+    config = dict(gen_config_dict or {})
+    safety_settings = config.pop('safety_settings', safety_settings_gemini)
+    tools = config.pop('tools', None)
+    model_name = config.pop('model_name', model_name)
+    return model_name, safety_settings, tools, config
 
-        extract_and_print_thoughts(response)
-        
-        # Handle function calls if any
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", "Worker")
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", "Worker")
-        
-        return {"text_content": response.text.strip() if response.text else "Ação concluída."}, []
+def _cache_key_part(part):
+    """Converte uma parte do prompt em uma representação estável para o hash do cache."""
+    if isinstance(part, str):
+        return part
+    if isinstance(part, (dict, list, tuple)):
+        return json.dumps(part, sort_keys=True, default=_cache_key_part)
+    if isinstance(part, Image.Image):
+        return "image:" + hashlib.sha256(part.tobytes()).hexdigest()
+    # Arquivos enviados: o ID remoto e o hash do conteúdo identificam o arquivo
+    if hasattr(part, 'uri') and hasattr(part, 'name'):
+        return f"file:{part.name}:{getattr(part, 'sha256_hash', '')}"
+    return repr(part)
 
-class ImageWorker(Worker):
-    """Agente especializado em tarefas relacionadas a imagens."""
-    
-    def __init__(self, task_manager):
-        super().__init__(task_manager)
-        log_message("ImageWorker (v11.26) criado.", "ImageWorker")
-    
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "ImageWorker"
-        print_agent_message(agent_name, f"Executando (imagem): '{task_description}'")
+class ResponseCache:
+    """Cache persistente, endereçado por conteúdo, para respostas da API Gemini (TTL + LRU por tamanho)."""
 
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
-        
-        conversation_history.append(
-            f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
-            f"Objetivo Geral: {original_goal}\n\n"
-            f"TAREFA DE IMAGEM: {task_description}\n"
-            f"Foque especificamente em gerar, editar ou analisar imagens. "
-            f"Use a função generate_image quando apropriado."
-        )
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS,
-            "temperature": 0.7  # Mais criatividade para imagens
-        }
+    def __init__(self, directory=RESPONSE_CACHE_DIRECTORY, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_bytes=RESPONSE_CACHE_MAX_BYTES, enabled_agents=None):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled_agents = set(RESPONSE_CACHE_DEFAULT_AGENTS if enabled_agents is None else enabled_agents)
+        self._lock = threading.Lock()
+        self.counters = {}
+        # Índice LRU em memória (chave -> bytes, do menos para o mais recente), montado uma vez a partir do disco
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        self._writing = Counter()  # chaves sendo gravadas agora: a remoção LRU não apaga seus arquivos
+        self._load_index()
 
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
+    def enable_agent(self, agent_name): self.enabled_agents.add(agent_name)
+    def disable_agent(self, agent_name): self.enabled_agents.discard(agent_name)
+    def is_enabled_for(self, agent_name): return agent_name in self.enabled_agents
 
-        if not response: return {"text_content": "Falha na API."}, []
+    def make_key(self, prompt_parts, model_name, safety_settings, tools, generation_params):
+        parts = prompt_parts if isinstance(prompt_parts, (list, tuple)) else [prompt_parts]
+        payload = json.dumps({
+            "model": model_name,
+            "parts": [_cache_key_part(p) for p in parts],
+            "registry_key": ModelRegistry.make_key(model_name, safety_settings, tools, generation_params),
+        }, sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-        extract_and_print_thoughts(response)
-        
-        # Handle function calls if any
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", agent_name)
-        
-        return {"text_content": response.text.strip() if response.text else "Imagem processada."}, []
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
 
-class AnalysisWorker(Worker):
-    """Agente especializado em análise e pensamento complexo."""
-    
-    def __init__(self, task_manager):
-        super().__init__(task_manager)
-        log_message("AnalysisWorker (v11.26) criado.", "AnalysisWorker")
-    
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "AnalysisWorker"
-        print_agent_message(agent_name, f"Executando (análise): '{task_description}'")
+    def _load_index(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*", "*.json")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, os.path.basename(path)[:-len(".json")], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
 
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
+    def _forget(self, key):
+        """Remove a entrada do índice e do disco; chamar com self._lock."""
+        self._total_bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _count(self, agent_name, event):
+        with self._lock:
+            self._count_locked(agent_name, event)
+
+    def _count_locked(self, agent_name, event):
+        agent_counters = self.counters.setdefault(agent_name, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        agent_counters[event] += 1
+
+    def get(self, key, agent_name="Sistema"):
+        """Retorna a resposta armazenada ou None (expirada/ausente/corrompida)."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry["created"] > self.ttl_seconds:
+                with self._lock:
+                    if key not in self._writing:
+                        self._forget(key)
+                raise FileNotFoundError(path)
+            response = genai.types.GenerateContentResponse.from_response(
+                genai.protos.GenerateContentResponse(entry["response"])
+            )
+            os.utime(path)  # Preserva a ordem LRU para a próxima execução
+        except (OSError, ValueError, KeyError, TypeError):
+            self._count(agent_name, "misses")
+            return None
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        self._count(agent_name, "hits")
+        log_message(f"Cache de resposta: HIT {key[:12]} para {agent_name}", "ResponseCache")
+        return response
+
+    def put(self, key, response, agent_name="Sistema"):
+        with self._lock:
+            self._writing[key] += 1
+        try:
+            entry = {"created": time.time(), "agent": agent_name, "response": response.to_dict()}
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._total_bytes += len(data) - self._index.get(key, 0)
+                self._index[key] = len(data)
+                self._index.move_to_end(key)
+            self._count(agent_name, "stores")
+        except Exception as e:
+            log_message(f"Falha ao gravar cache de resposta: {e}", "ResponseCache")
+        finally:
+            with self._lock:
+                self._writing[key] -= 1
+                if not self._writing[key]:
+                    del self._writing[key]
+                self._evict_if_needed(agent_name)
+
+    def _evict_if_needed(self, agent_name):
+        """Remove as entradas acessadas há mais tempo até o cache caber em max_bytes; chamar com self._lock."""
+        for key in list(self._index):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key in self._writing:
+                continue
+            self._forget(key)
+            self._count_locked(agent_name, "evictions")
+
+    def clear(self):
+        with self._lock:
+            for path in glob.glob(os.path.join(self.directory, "*", "*.json")):
+                try: os.remove(path)
+                except OSError: pass
+            self._index.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {agent: dict(c) for agent, c in self.counters.items()}
+
+RESPONSE_CACHE = ResponseCache()
+
+# --- Cache de Contexto (prefixo de arquivos compartilhado) ---
+
+def _is_uploaded_file(part):
+    return isinstance(getattr(part, "name", None), str) and part.name.startswith("files/") and hasattr(part, "uri")
+
+def _estimate_file_tokens(files):
+    """Estimativa (~4 bytes por token) dos tokens de entrada de um conjunto de arquivos enviados."""
+    return sum((getattr(f, "size_bytes", 0) or 0) // 4 for f in files)
+
+def split_file_prefix(prompt_parts, file_names):
+    """Remove da requisição o prefixo com exatamente os arquivos file_names; retorna None se ela não começar por eles.
+
+    Aceita os dois formatos usados aqui: lista de partes (planejador) e lista de mensagens {"role", "parts"} (workers).
+    """
+    count = len(file_names)
+    if not count or not isinstance(prompt_parts, list) or not prompt_parts:
+        return None
+    first = prompt_parts[0]
+    if isinstance(first, dict):
+        parts = first.get("parts", [])
+        if first.get("role") != "user" or tuple(getattr(p, "name", None) for p in parts[:count]) != file_names:
+            return None
+        rest = parts[count:]
+        return ([{**first, "parts": rest}] if rest else []) + prompt_parts[1:]
+    if tuple(getattr(p, "name", None) for p in prompt_parts[:count]) != file_names:
+        return None
+    return prompt_parts[count:]
+
+def _prepend_file_prefix(contents, prefix):
+    """Inverso de split_file_prefix: devolve o prefixo à primeira mensagem do usuário."""
+    if contents and isinstance(contents[0], dict):
+        return [{**contents[0], "parts": list(prefix) + list(contents[0].get("parts", []))}] + contents[1:]
+    return list(prefix) + list(contents)
+
+class GeminiContextCacheBackend:
+    """CachedContent da API Gemini: arquivos, instrução de sistema e ferramentas ficam no servidor durante o TTL."""
+    name = "gemini"
+
+    def create(self, model_name, files, tools, system_instruction, ttl_seconds):
+        cached = genai.caching.CachedContent.create(
+            model=model_name, display_name="mag-context", system_instruction=system_instruction,
+            contents=[{"role": "user", "parts": list(files)}], tools=tools or None,
+            ttl=datetime.timedelta(seconds=ttl_seconds))
+        return cached, getattr(cached.usage_metadata, "total_token_count", 0) or _estimate_file_tokens(files)
+
+    def refresh(self, handle, ttl_seconds):
+        handle.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def model_for(self, handle, safety_settings, generation_params):
+        return genai.GenerativeModel.from_cached_content(
+            handle, generation_config=genai.GenerationConfig(**generation_params), safety_settings=safety_settings)
+
+class _LocalCachedModel:
+    """Modelo do backend local: recoloca o prefixo antes de delegar, como o servidor faria com o CachedContent."""
+
+    def __init__(self, model, prefix):
+        self.model = model
+        self.prefix = prefix
+
+    def generate_content(self, contents, **kwargs):
+        return self.model.generate_content(contents=_prepend_file_prefix(contents, self.prefix), **kwargs)
+
+    async def generate_content_async(self, contents, **kwargs):
+        return await self.model.generate_content_async(contents=_prepend_file_prefix(contents, self.prefix), **kwargs)
+
+class LocalContextCacheBackend:
+    """Substituto offline do CachedContent: guarda o prefixo em memória e conta criações, renovações e remoções."""
+    name = "local"
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, event):
+        with self._lock:
+            self.calls[event] += 1
+
+    def create(self, model_name, files, tools, system_instruction, ttl_seconds):
+        self._count("create")
+        prefix = ([system_instruction] if system_instruction else []) + list(files)
+        return {"model": model_name, "tools": tools, "prefix": prefix}, _estimate_file_tokens(files)
+
+    def refresh(self, handle, ttl_seconds):
+        self._count("refresh")
+
+    def delete(self, handle):
+        self._count("delete")
+
+    def model_for(self, handle, safety_settings, generation_params):
+        model = MODEL_REGISTRY.get(handle["model"], safety_settings, handle["tools"], generation_params)
+        return _LocalCachedModel(model, handle["prefix"])
+
+CONTEXT_CACHE_BACKENDS = {"gemini": GeminiContextCacheBackend, "local": LocalContextCacheBackend}
+
+class ContextCache:
+    """Registra o prefixo de arquivos de cada fluxo e o serve de um cache por (prefixo, modelo, ferramentas).
+
+    As chamadas cujo início coincide com um prefixo registrado enviam só o restante e referenciam o cache;
+    se o backend não suportar o modelo/prefixo ou o cache sumir, a chamada volta a enviar tudo inline.
+    """
+
+    def __init__(self, backend=None, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+                 refresh_margin_seconds=CONTEXT_CACHE_REFRESH_MARGIN_SECONDS, min_tokens=CONTEXT_CACHE_MIN_TOKENS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.min_tokens = min_tokens
+        self._prefixes = {}   # nomes dos arquivos -> {"files", "system_instruction", "refs"}
+        self._entries = {}    # (nomes, modelo, ferramentas) -> entrada do backend ou {"unsupported": motivo}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self._prefix_counters = {}
+
+    def register(self, files, system_instruction=None):
+        """Registra o prefixo de um fluxo (uma vez por execução); retorna a chave a liberar com release()."""
+        files = [f for f in files or [] if _is_uploaded_file(f)]
+        if self.backend is None or not files:
+            return None
+        key = tuple(f.name for f in files)
+        with self._lock:
+            prefix = self._prefixes.setdefault(key, {"files": files, "system_instruction": system_instruction, "refs": 0})
+            prefix["refs"] += 1
+            self._prefix_counters.setdefault(key, Counter())
+        return key
+
+    def release(self, key):
+        """Libera o prefixo; quando nenhum fluxo o usa mais, os caches do backend são removidos."""
+        if key is None:
+            return
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is None:
+                return
+            prefix["refs"] -= 1
+            if prefix["refs"] > 0:
+                return
+            del self._prefixes[key]
+            stale = [entry_key for entry_key in self._entries if entry_key[0] == key]
+            handles = [self._entries.pop(entry_key).get("handle") for entry_key in stale]
+        for handle in handles:
+            if handle is None:
+                continue
+            try:
+                self.backend.delete(handle)
+            except Exception as e:
+                log_message(f"Falha ao remover cache de contexto: {e}", "ContextCache")
+
+    def _count(self, prefix_key, event, amount=1):
+        self.counters[event] += amount
+        self._prefix_counters.setdefault(prefix_key, Counter())[event] += amount
+
+    def _create(self, entry_key, prefix, model_name, tools):
+        if _estimate_file_tokens(prefix["files"]) < self.min_tokens:
+            return {"unsupported": f"prefixo abaixo de {self.min_tokens} tokens"}
+        try:
+            handle, tokens = self.backend.create(model_name, prefix["files"], tools, prefix["system_instruction"],
+                                                 self.ttl_seconds)
+        except Exception as e:
+            log_message(f"Cache de contexto indisponível para {model_name}; prefixo segue inline ({e}).", "ContextCache")
+            return {"unsupported": str(e)}
+        log_message(f"Cache de contexto criado: {len(prefix['files'])} arquivo(s), {tokens} tokens, {model_name}.",
+                    "ContextCache")
+        return {"handle": handle, "tokens": tokens, "expires_at": time.monotonic() + self.ttl_seconds,
+                "models": {}, "key": entry_key}
+
+    def _entry_for(self, entry_key, model_name, tools):
+        while True:
+            with self._lock:
+                entry = self._entries.get(entry_key)
+                if entry is not None:
+                    return entry
+                prefix = self._prefixes.get(entry_key[0])
+                if prefix is None:
+                    return None
+                future = self._inflight.get(entry_key)
+                if future is None:
+                    future = Future()
+                    self._inflight[entry_key] = future
+                    break
+            future.result()  # outra chamada está criando o mesmo cache
+        try:
+            entry = self._create(entry_key, prefix, model_name, tools)
+            with self._lock:
+                registered = entry_key[0] in self._prefixes
+                if registered:
+                    self._entries[entry_key] = entry
+                self._count(entry_key[0], "unsupported" if "unsupported" in entry else "created")
+                self._count(entry_key[0], "tokens_cached", entry.get("tokens", 0))
+        finally:
+            with self._lock:
+                self._inflight.pop(entry_key, None)
+            future.set_result(None)
+        if not registered and "handle" in entry:  # o fluxo terminou enquanto o cache era criado
+            try:
+                self.backend.delete(entry["handle"])
+            except Exception as e:
+                log_message(f"Falha ao remover cache de contexto: {e}", "ContextCache")
+        return entry
+
+    def _refresh_if_needed(self, entry):
+        with self._lock:
+            if entry["expires_at"] - time.monotonic() > self.refresh_margin_seconds:
+                return
+            entry["expires_at"] = time.monotonic() + self.ttl_seconds  # evita renovações simultâneas
+        try:
+            self.backend.refresh(entry["handle"], self.ttl_seconds)
+            with self._lock:
+                self._count(entry["key"][0], "refreshed")
+        except Exception as e:
+            self.invalidate(entry, e)
+
+    def resolve(self, model, prompt_parts, gen_config_dict):
+        """Retorna (modelo, conteúdo, entrada): com cache, o modelo referencia o prefixo e o conteúdo vem sem ele."""
+        if self.backend is None or not self._prefixes:
+            return model, prompt_parts, None
+        with self._lock:
+            matches = [(key, split_file_prefix(prompt_parts, key)) for key in self._prefixes]
+        key, contents = max(((k, c) for k, c in matches if c is not None), key=lambda m: len(m[0]), default=(None, None))
+        if key is None:
+            return model, prompt_parts, None
+        model_name, safety_settings, tools, generation_params = split_gen_config(gen_config_dict)
+        entry_key = (key, model_name, ModelRegistry.make_key(model_name, None, tools, {})[2])
+        entry = self._entry_for(entry_key, model_name, tools)
+        if entry is None or "unsupported" in entry:
+            with self._lock:
+                self._count(key, "inline")
+            return model, prompt_parts, None
+        self._refresh_if_needed(entry)
+        model_key = ModelRegistry.make_key(model_name, safety_settings, None, generation_params)
+        with self._lock:
+            if "handle" not in entry:  # invalidado durante a renovação
+                self._count(key, "inline")
+                return model, prompt_parts, None
+            cached_model = entry["models"].get(model_key)
+        if cached_model is None:
+            cached_model = self.backend.model_for(entry["handle"], safety_settings, generation_params)
+            with self._lock:
+                entry["models"][model_key] = cached_model
+        return cached_model, contents, entry
+
+    def record_usage(self, entry, response):
+        """Contabiliza os tokens de entrada servidos pelo cache (usage_metadata ou o tamanho do prefixo)."""
+        if entry is None:
+            return
+        usage = getattr(response, "usage_metadata", None)
+        tokens = getattr(usage, "cached_content_token_count", 0) or entry["tokens"]
+        with self._lock:
+            self._count(entry["key"][0], "hits")
+            self._count(entry["key"][0], "tokens_from_cache", tokens)
+
+    def invalidate(self, entry, error):
+        """Descarta um cache que falhou: se expirou ou foi removido, a próxima chamada o recria; se foi recusado, o prefixo segue inline."""
+        expired = isinstance(error, google_exceptions.NotFound)
+        with self._lock:
+            if self._entries.get(entry["key"]) is entry:
+                if expired:
+                    del self._entries[entry["key"]]
+                else:
+                    self._entries[entry["key"]] = {"unsupported": str(error)}
+            handle = entry.pop("handle", None)
+            self._count(entry["key"][0], "fallbacks")
+        log_message(f"Cache de contexto descartado ({type(error).__name__}: {error}); reenviando o prefixo inline.",
+                    "ContextCache")
+        if handle is not None and not expired:
+            try:
+                self.backend.delete(handle)
+            except Exception as e:
+                log_message(f"Falha ao remover cache de contexto: {e}", "ContextCache")
+
+    def stats(self, key=None):
+        """Contadores do cache; tokens_saved desconta dos tokens servidos pelo cache os enviados para criá-lo."""
+        with self._lock:
+            stats = dict(self.counters if key is None else self._prefix_counters.get(key, Counter()))
+        stats["tokens_saved"] = max(0, stats.get("tokens_from_cache", 0) - stats.get("tokens_cached", 0))
+        return stats
+
+def create_context_cache(backend_name=CONTEXT_CACHE_BACKEND):
+    backend_class = CONTEXT_CACHE_BACKENDS.get(backend_name)
+    if backend_class is None and backend_name != "off":
+        log_message(f"MAG_CONTEXT_CACHE='{backend_name}' desconhecido; cache de contexto desativado.", "Sistema")
+    return ContextCache(backend_class() if backend_class else None)
+
+CONTEXT_CACHE = create_context_cache()
+
+# --- Limitação de Taxa, Política de Retentativa e Circuit Breaker ---
+
+class TokenBucketRateLimiter:
+    """Token bucket duplo (requisições/min e tokens/min) compartilhado por todas as chamadas do processo."""
+
+    def __init__(self, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, tokens_per_minute=GEMINI_TOKENS_PER_MINUTE):
+        self.capacity = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.levels = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        for bucket, capacity in self.capacity.items():
+            self.levels[bucket] = min(capacity, self.levels[bucket] + elapsed * capacity / 60.0)
+
+    def reserve(self, tokens=0):
+        """Consome a cota se disponível e retorna 0; senão retorna quantos segundos esperar."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._refill(now)
+            needed = {"requests": 1.0, "tokens": float(min(tokens, self.capacity["tokens"]))}
+            wait_seconds = max((needed[b] - self.levels[b]) * 60.0 / self.capacity[b] for b in needed)
+            if wait_seconds <= 0:
+                for bucket, amount in needed.items():
+                    self.levels[bucket] -= amount
+                return 0.0
+            return wait_seconds
+
+    def acquire(self, tokens=0):
+        """Bloqueia até haver cota; retorna o tempo total de espera."""
+        waited = 0.0
+        while (wait_seconds := self.reserve(tokens)) > 0:
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+        return waited
+
+    async def acquire_async(self, tokens=0):
+        waited = 0.0
+        while (wait_seconds := self.reserve(tokens)) > 0:
+            await asyncio.sleep(wait_seconds)
+            waited += wait_seconds
+        return waited
+
+    def pause(self, seconds):
+        """Suspende todas as chamadas (ex.: retry hint do servidor após erro de cota)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Interrompe as chamadas após falhas consecutivas do servidor; libera novas tentativas após o cooldown."""
+
+    def __init__(self, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """No estado half_open só uma chamada (a sonda) passa; as demais são rejeitadas até ela terminar."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self.opened_at < self.reset_seconds:
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                # Uma sonda sem desfecho por reset_seconds (thread interrompida) libera uma nova
+                if self.probe_started is not None and now - self.probe_started < self.reset_seconds:
+                    return False
+                self.probe_started = now
+            return True
+
+    def record_success(self):
+        """Registra uma resposta do servidor (inclusive erros 4xx, que provam que a API está no ar)."""
+        with self._lock:
+            self.state, self.failures, self.probe_started = "closed", 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    log_message(f"Circuit breaker aberto após {self.failures} falhas consecutivas.", "Sistema")
+                self.state, self.opened_at = "open", time.monotonic()
+
+GEMINI_RATE_LIMITER = TokenBucketRateLimiter()
+GEMINI_CIRCUIT_BREAKER = CircuitBreaker()
+
+RETRYABLE_API_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests, google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded, google_exceptions.Aborted, google_exceptions.Unknown,
+    genai.types.IncompleteIterationError, genai.types.BrokenResponseError,
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError, TimeoutError,
+)
+FATAL_API_EXCEPTIONS = (
+    google_exceptions.ClientError,  # 4xx restantes: argumento inválido, permissão, não encontrado...
+    genai.types.BlockedPromptException, genai.types.StopCandidateException,
+    ValueError, TypeError,
+)
+
+def classify_api_exception(error):
+    """'retryable' para falhas transitórias (cota, 5xx, rede); 'fatal' para erros que se repetiriam."""
+    if isinstance(error, RETRYABLE_API_EXCEPTIONS):
+        return "retryable"
+    if isinstance(error, FATAL_API_EXCEPTIONS):
+        return "fatal"
+    return "retryable"
+
+def server_retry_delay(error, max_delay=MAX_RETRY_DELAY_SECONDS):
+    """Extrai o retry hint do servidor (RetryInfo ou texto 'retry in Ns'), se houver, limitado a max_delay."""
+    hint = None
+    for detail in getattr(error, 'details', None) or []:
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None and (retry_delay.seconds or retry_delay.nanos):
+            hint = retry_delay.seconds + retry_delay.nanos / 1e9
+            break
+    if hint is None:
+        match = re.search(r"retry(?:_delay)?\W+(?:in\s+|seconds:\s*)?(\d+(?:\.\d+)?)\s*s?", str(error), re.IGNORECASE)
+        hint = float(match.group(1)) if match else None
+    return min(hint, max_delay) if hint is not None else None
+
+_API_STATS_LOCK = threading.Lock()
+API_CALL_STATS = {}
+
+def _count_api_event(agent_name, event, amount=1):
+    with _API_STATS_LOCK:
+        stats = API_CALL_STATS.setdefault(agent_name, {"calls": 0, "retries": 0, "throttled": 0, "throttle_wait_s": 0.0,
+                                                      "fatal_errors": 0, "circuit_rejections": 0})
+        stats[event] += amount
+
+def api_call_stats():
+    """Chamadas, retentativas, esperas do limitador e erros fatais por agente."""
+    with _API_STATS_LOCK:
+        return {agent: dict(stats) for agent, stats in API_CALL_STATS.items()}
+
+def _estimate_prompt_tokens(prompt_parts):
+    """Estimativa grosseira (~4 caracteres por token) dos tokens de entrada de uma requisição."""
+    if isinstance(prompt_parts, str):
+        return len(prompt_parts) // 4 + 1
+    if isinstance(prompt_parts, dict):
+        return _estimate_prompt_tokens(prompt_parts.get("parts", []))
+    if isinstance(prompt_parts, (list, tuple)):
+        return sum(_estimate_prompt_tokens(p) for p in prompt_parts)
+    if _is_uploaded_file(prompt_parts):
+        # Arquivos enviados dominam as requisições grandes: estimados pelo tamanho
+        return max(1, _estimate_file_tokens([prompt_parts]))
+    parts = getattr(prompt_parts, 'parts', None)
+    if parts is not None:
+        return sum(len(getattr(p, 'text', '') or '') // 4 + 1 for p in parts)
+    return 1
+
+def _before_api_attempt(agent_name, waited):
+    """Contabiliza a tentativa; retorna False se o circuit breaker estiver aberto."""
+    if not GEMINI_CIRCUIT_BREAKER.allow_request():
+        _count_api_event(agent_name, "circuit_rejections")
+        log_message("Circuit breaker aberto: chamada à API rejeitada.", agent_name)
+        return False
+    _count_api_event(agent_name, "calls")
+    if waited > 0:
+        _count_api_event(agent_name, "throttled")
+        _count_api_event(agent_name, "throttle_wait_s", waited)
+    return True
+
+def _next_retry_delay(error, attempt, previous_delay, agent_name):
+    """Decide se a falha merece nova tentativa; retorna a espera em segundos ou None para desistir."""
+    log_message(f"Exceção: {type(error).__name__} - {error}\\n{traceback.format_exc()}", "Sistema")
+    if classify_api_exception(error) == "fatal":
+        GEMINI_CIRCUIT_BREAKER.record_success()  # o servidor respondeu; libera uma eventual sonda do half_open
+        _count_api_event(agent_name, "fatal_errors")
+        log_message(f"Erro não recuperável ({type(error).__name__}); sem novas tentativas.", agent_name)
+        return None
+    GEMINI_CIRCUIT_BREAKER.record_failure()
+    if attempt >= MAX_API_RETRIES - 1:
+        return None
+    _count_api_event(agent_name, "retries")
+    hint = server_retry_delay(error)
+    jittered = min(MAX_RETRY_DELAY_SECONDS, random.uniform(INITIAL_RETRY_DELAY_SECONDS, previous_delay * RETRY_BACKOFF_FACTOR))
+    if hint is not None:
+        # O servidor sabe quando a cota volta: todas as chamadas do processo aguardam
+        GEMINI_RATE_LIMITER.pause(hint)
+        return hint
+    return jittered
+
+def _prepare_api_call(prompt_parts, agent_name, gen_config_dict, use_cache):
+    """Resolve modelo e chave de cache de uma chamada; retorna (model, cache_key, resposta_em_cache)."""
+    log_message(f"Chamando API para {agent_name}...", "Sistema")
+
+    model_name, safety_settings, tools, generation_params = split_gen_config(gen_config_dict)
+    model = MODEL_REGISTRY.get(model_name, safety_settings, tools, generation_params)
+
+    log_message(f"Usando config: {generation_params}", "Sistema")
+
+    # use_cache=None segue a política por agente do RESPONSE_CACHE
+    if use_cache is None:
+        use_cache = RESPONSE_CACHE.is_enabled_for(agent_name)
+    if not use_cache:
+        return model, None, None
+    cache_key = RESPONSE_CACHE.make_key(prompt_parts, model_name, safety_settings, tools, generation_params)
+    return model, cache_key, RESPONSE_CACHE.get(cache_key, agent_name)
+
+# Com tarefas em paralelo só um stream por vez escreve ao vivo no console; os demais acumulam o texto e assumem o
+# console, na ordem em que começaram, quando o atual termina
+_CONSOLE_LOCK = threading.Lock()
+_STREAM_FOCUS = None
+_STREAM_WAITING = []
+
+class StreamPrinter:
+    """Exibe e registra os chunks de uma resposta em streaming, medindo TTFT e tokens/s."""
+
+    def __init__(self, agent_name):
+        self.agent_name = agent_name
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.chars = 0
+        self.live = False
+        self.done = False
+        self._buffer = []
+
+    def on_chunk(self, chunk):
+        parts = chunk.candidates[0].content.parts if chunk.candidates and chunk.candidates[0].content else []
+        for part in parts:
+            if getattr(part, 'function_call', None):
+                log_message(f"Chamada de função detectada durante o stream: {part.function_call.name}", self.agent_name)
+            text = getattr(part, 'text', None)
+            if not text:
+                continue
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self._write(text)
+            log_message(text, f"{self.agent_name}:stream")
+            self.chars += len(text)
+
+    def _write(self, text):
+        global _STREAM_FOCUS
+        with _CONSOLE_LOCK:
+            if _STREAM_FOCUS is None:
+                _STREAM_FOCUS = self
+            if _STREAM_FOCUS is not self:
+                if not self._buffer:
+                    _STREAM_WAITING.append(self)
+                self._buffer.append(text)
+                return
+            if not self.live:
+                self.live = True
+                print(f"\n🤖 [{self.agent_name}] (stream): ", end="", flush=True)
+            print(text, end="", flush=True)
+
+    def _release(self, interrupted=None):
+        """Libera o console: fecha a linha ao vivo e passa a vez ao próximo stream que acumulou texto."""
+        global _STREAM_FOCUS
+        with _CONSOLE_LOCK:
+            if _STREAM_FOCUS is self:
+                _STREAM_FOCUS = None
+                print(flush=True)
+                if interrupted is not None:
+                    print(f"⚠️ [{self.agent_name}]: stream interrompido ({type(interrupted).__name__}), "
+                          f"tentando novamente...", flush=True)
+            elif interrupted is not None:
+                # O texto acumulado será refeito pela nova tentativa
+                if self in _STREAM_WAITING:
+                    _STREAM_WAITING.remove(self)
+                self._buffer = []
+            self.done = True
+            while _STREAM_FOCUS is None and _STREAM_WAITING:
+                waiting = _STREAM_WAITING.pop(0)
+                print(f"\n🤖 [{waiting.agent_name}] (stream): {''.join(waiting._buffer)}", end="", flush=True)
+                waiting._buffer = []
+                if waiting.done:
+                    print(flush=True)
+                else:
+                    waiting.live = True
+                    _STREAM_FOCUS = waiting
+
+    def on_interrupted(self, error):
+        self._release(interrupted=error)
+
+    def finish(self, response):
+        self._release()
+        end = time.perf_counter()
+        usage = getattr(response, 'usage_metadata', None)
+        tokens = getattr(usage, 'candidates_token_count', 0) or self.chars // 4
+        ttft = (self.first_token_at or end) - self.start
+        generation_time = end - (self.first_token_at or self.start)
+        record_stream_metrics(self.agent_name, ttft, tokens, generation_time)
+
+_STREAM_STATS_LOCK = threading.Lock()
+STREAM_STATS = {}
+
+def record_stream_metrics(agent_name, ttft, tokens, generation_seconds):
+    with _STREAM_STATS_LOCK:
+        stats = STREAM_STATS.setdefault(agent_name, {"streams": 0, "ttft_total_s": 0.0, "ttft_max_s": 0.0, "tokens": 0, "generation_s": 0.0})
+        stats["streams"] += 1
+        stats["ttft_total_s"] += ttft
+        stats["ttft_max_s"] = max(stats["ttft_max_s"], ttft)
+        stats["tokens"] += tokens
+        stats["generation_s"] += generation_seconds
+    log_message(f"Stream concluído: TTFT {ttft:.2f}s, {tokens} tokens em {generation_seconds:.2f}s", agent_name,
+                event="stream_done", duration=ttft + generation_seconds)
+
+def stream_stats():
+    """TTFT médio/máximo e tokens por segundo de cada agente que usou streaming."""
+    with _STREAM_STATS_LOCK:
+        return {
+            agent: {
+                "streams": s["streams"],
+                "ttft_mean_s": s["ttft_total_s"] / s["streams"],
+                "ttft_max_s": s["ttft_max_s"],
+                "tokens_per_s": s["tokens"] / s["generation_s"] if s["generation_s"] > 0 else 0.0,
+            }
+            for agent, s in STREAM_STATS.items()
+        }
+
+def call_gemini_api_with_retry(prompt_parts, agent_name="Sistema", gen_config_dict=None, use_cache=None, stream=False):
+    model, cache_key, cached_response = _prepare_api_call(prompt_parts, agent_name, gen_config_dict, use_cache)
+    if cached_response is not None:
+        return cached_response
+    inline_model = model
+    model, contents, context_entry = CONTEXT_CACHE.resolve(model, prompt_parts, gen_config_dict)
+
+    estimated_tokens = _estimate_prompt_tokens(prompt_parts)
+    current_retry_delay = INITIAL_RETRY_DELAY_SECONDS
+    for attempt in range(MAX_API_RETRIES):
+        log_message(f"Tentativa {attempt + 1}/{MAX_API_RETRIES}...", "Sistema")
+        waited = GEMINI_RATE_LIMITER.acquire(estimated_tokens)
+        if not _before_api_attempt(agent_name, waited):
+            return None
+        printer = StreamPrinter(agent_name) if stream else None
+        attempt_start = time.perf_counter()
+        try:
+            if stream:
+                # Uma falha no meio do stream cai no except abaixo e a requisição inteira é refeita
+                response = model.generate_content(contents=contents, stream=True)
+                for chunk in response:
+                    printer.on_chunk(chunk)
+                printer.finish(response)
+            else:
+                response = model.generate_content(contents=contents)
+            GEMINI_CIRCUIT_BREAKER.record_success()
+            log_message("Resposta recebida da API.", agent_name, event="api_call", duration=time.perf_counter() - attempt_start)
+            CONTEXT_CACHE.record_usage(context_entry, response)
+            if cache_key and response.candidates:
+                RESPONSE_CACHE.put(cache_key, response, agent_name)
+            return response
+        except Exception as e:
+            if printer: printer.on_interrupted(e)
+            if context_entry is not None and isinstance(e, google_exceptions.ClientError):
+                # Cache expirado, removido ou recusado pelo modelo: repete com o prefixo inline
+                GEMINI_CIRCUIT_BREAKER.record_success()
+                CONTEXT_CACHE.invalidate(context_entry, e)
+                model, contents, context_entry = inline_model, prompt_parts, None
+                continue
+            current_retry_delay = _next_retry_delay(e, attempt, current_retry_delay, agent_name)
+            if current_retry_delay is None:
+                return None
+            time.sleep(current_retry_delay)
+    return None
+
+# Um semáforo por event loop: asyncio.Semaphore não pode ser compartilhado entre loops
+_API_SEMAPHORES = weakref.WeakKeyDictionary()
+
+def set_max_concurrent_api_requests(limit):
+    """Altera o limite de requisições simultâneas do caminho assíncrono."""
+    global MAX_CONCURRENT_API_REQUESTS
+    MAX_CONCURRENT_API_REQUESTS = max(1, int(limit))
+    _API_SEMAPHORES.clear()
+
+def _get_api_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _API_SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_API_REQUESTS)
+        _API_SEMAPHORES[loop] = semaphore
+    return semaphore
+
+async def call_gemini_api_with_retry_async(prompt_parts, agent_name="Sistema", gen_config_dict=None, use_cache=None, stream=False):
+    """Versão assíncrona de call_gemini_api_with_retry (generate_content_async + semáforo global)."""
+    model, cache_key, cached_response = _prepare_api_call(prompt_parts, agent_name, gen_config_dict, use_cache)
+    if cached_response is not None:
+        return cached_response
+    inline_model = model
+    # A criação do cache de contexto é uma chamada de rede: fora do event loop
+    model, contents, context_entry = await asyncio.to_thread(CONTEXT_CACHE.resolve, model, prompt_parts, gen_config_dict)
+
+    estimated_tokens = _estimate_prompt_tokens(prompt_parts)
+    current_retry_delay = INITIAL_RETRY_DELAY_SECONDS
+    for attempt in range(MAX_API_RETRIES):
+        log_message(f"Tentativa assíncrona {attempt + 1}/{MAX_API_RETRIES}...", "Sistema")
+        waited = await GEMINI_RATE_LIMITER.acquire_async(estimated_tokens)
+        if not _before_api_attempt(agent_name, waited):
+            return None
+        printer = StreamPrinter(agent_name) if stream else None
+        attempt_start = time.perf_counter()
+        try:
+            async with _get_api_semaphore():
+                if stream:
+                    response = await model.generate_content_async(contents=contents, stream=True)
+                    async for chunk in response:
+                        printer.on_chunk(chunk)
+                    printer.finish(response)
+                else:
+                    response = await model.generate_content_async(contents=contents)
+            GEMINI_CIRCUIT_BREAKER.record_success()
+            log_message("Resposta recebida da API.", agent_name, event="api_call", duration=time.perf_counter() - attempt_start)
+            CONTEXT_CACHE.record_usage(context_entry, response)
+            if cache_key and response.candidates:
+                RESPONSE_CACHE.put(cache_key, response, agent_name)
+            return response
+        except Exception as e:
+            if printer: printer.on_interrupted(e)
+            if context_entry is not None and isinstance(e, google_exceptions.ClientError):
+                # Cache expirado, removido ou recusado pelo modelo: repete com o prefixo inline
+                GEMINI_CIRCUIT_BREAKER.record_success()
+                CONTEXT_CACHE.invalidate(context_entry, e)
+                model, contents, context_entry = inline_model, prompt_parts, None
+                continue
+            current_retry_delay = _next_retry_delay(e, attempt, current_retry_delay, agent_name)
+            if current_retry_delay is None:
+                return None
+            await asyncio.sleep(current_retry_delay)
+    return None
+
+def extract_and_print_thoughts(response):
+    """Extrai e exibe pensamentos/raciocínio do modelo Gemini."""
+    if not response or not response.candidates:
+        return
         
-        conversation_history.append(
-            f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
-            f"Objetivo Geral: {original_goal}\n\n"
-            f"TAREFA DE ANÁLISE: {task_description}\n"
-            f"Pense profundamente sobre esta tarefa. Considere múltiplas perspectivas, "
-            f"analise dados e forneça insights detalhados. Use raciocínio estruturado."
+    for candidate in response.candidates:
+        if hasattr(candidate, 'content') and candidate.content and hasattr(candidate.content, 'parts'):
+            for part in candidate.content.parts:
+                # Look for thinking/thought content in different possible formats
+                if hasattr(part, 'thought') and part.thought:
+                    if hasattr(part.thought, 'content'):
+                        print_thought_message(part.thought.content)
+                    elif hasattr(part, 'text') and part.text:
+                        print_thought_message(part.text)
+                elif hasattr(part, 'text') and part.text and 'pensamento:' in part.text.lower():
+                    # Extract thinking content from text
+                    lines = part.text.split('\n')
+                    thought_lines = []
+                    in_thought = False
+                    for line in lines:
+                        if 'pensamento:' in line.lower() or 'thinking:' in line.lower():
+                            in_thought = True
+                            thought_lines.append(line)
+                        elif in_thought and (line.strip() == '' or line.startswith('---')):
+                            break
+                        elif in_thought:
+                            thought_lines.append(line)
+                    
+                    if thought_lines:
+                        print_thought_message('\n'.join(thought_lines))
+
+# --- Contexto de Tarefas ---
+
+def _prompt_text_bytes(prompt_parts):
+    """Tamanho em bytes (UTF-8) das partes textuais de um prompt."""
+    parts = prompt_parts if isinstance(prompt_parts, (list, tuple)) else [prompt_parts]
+    return sum(len(p.encode("utf-8")) for p in parts if isinstance(p, str))
+
+def _summarize_result(result, max_chars):
+    """Resumo extrativo local (sem chamada à API): início do texto, cortado em fim de frase."""
+    text = result.get("text_content", "") if isinstance(result, dict) else str(result)
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if sentence_end > max_chars // 2:
+        cut = cut[:sentence_end + 1]
+    return cut + " [...]"
+
+class TaskContext:
+    """Contexto de resultados anteriores com orçamento de tokens, serializado incrementalmente.
+
+    Cada resultado é serializado uma única vez ao ser adicionado. Quando o orçamento é excedido,
+    os resultados mais antigos são trocados por resumos e, por fim, condensados em um digest.
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, summary_chars=CONTEXT_SUMMARY_CHARS):
+        self.max_chars = token_budget * CONTEXT_CHARS_PER_TOKEN
+        self.summary_chars = summary_chars
+        self._fragments = []      # [task, resultado, json serializado, já_resumido]
+        self._digest = []         # "tarefa: resumo" dos resultados mais antigos, já condensados
+        self._chars = 0
+        self._rendered = None
+        self.step_prompt_bytes = 0
+        self.compressions = 0
+
+    def __len__(self):
+        return len(self._fragments) + len(self._digest)
+
+    def add_result(self, task, result):
+        """Adiciona o resultado de uma tarefa (serializado uma única vez)."""
+        fragment = json.dumps({task: result}, ensure_ascii=False)
+        self._fragments.append([task, result, fragment, False])
+        self._chars += len(fragment)
+        self._rendered = None
+        self._enforce_budget()
+
+    def copy(self):
+        """Cópia rasa para derivar o contexto de outra tarefa sem reserializar os resultados."""
+        clone = TaskContext.__new__(TaskContext)
+        clone.__dict__.update(self.__dict__)
+        clone._fragments = [list(f) for f in self._fragments]
+        clone._digest = list(self._digest)
+        clone.step_prompt_bytes = 0
+        return clone
+
+    def _digest_text(self):
+        digest = "; ".join(self._digest)
+        if len(digest) > self.summary_chars * 2:
+            digest = "[...] " + digest[-self.summary_chars * 2:]
+        return digest
+
+    def _available_chars(self):
+        # O digest tem tamanho limitado e ocupa parte do orçamento assim que existir
+        return self.max_chars - (self.summary_chars * 2 if self._digest else 0)
+
+    def _enforce_budget(self):
+        # 1) troca os resultados completos mais antigos (exceto o último) por resumos
+        for entry in self._fragments[:-1]:
+            if self._chars <= self._available_chars():
+                return
+            if entry[3]:
+                continue
+            task, result, fragment, _ = entry
+            summary = json.dumps({task: {"resumo": _summarize_result(result, self.summary_chars)}}, ensure_ascii=False)
+            self._chars += len(summary) - len(fragment)
+            entry[2], entry[3] = summary, True
+            self.compressions += 1
+        # 2) condensa os resumos mais antigos em um digest de tamanho limitado
+        while self._chars > self._available_chars() and len(self._fragments) > 1:
+            task, result, fragment, _ = self._fragments.pop(0)
+            self._chars -= len(fragment)
+            self._digest.append(f"{task}: {_summarize_result(result, self.summary_chars // 3)}")
+            self.compressions += 1
+
+    def render(self):
+        """Texto JSON do contexto; reaproveitado enquanto nenhum resultado novo for adicionado."""
+        if self._rendered is None:
+            fragments = [f[2] for f in self._fragments]
+            if self._digest:
+                fragments.insert(0, json.dumps({"tarefas_anteriores_resumidas": self._digest_text()}, ensure_ascii=False))
+            self._rendered = f"[{', '.join(fragments)}]" if fragments else ""
+        return self._rendered
+
+    def record_prompt(self, prompt_parts):
+        """Acumula os bytes de prompt enviados com este contexto (Router + Worker)."""
+        self.step_prompt_bytes += _prompt_text_bytes(prompt_parts)
+
+def context_to_text(context, empty_text=""):
+    """Aceita TaskContext, lista de resultados (formato antigo) ou texto pronto."""
+    if isinstance(context, TaskContext):
+        return context.render() or empty_text
+    if isinstance(context, (list, dict)):
+        return json.dumps(context) if context else empty_text
+    return context or empty_text
+
+# --- Roteamento Local ---
+
+VALID_AGENT_TYPES = ("text_worker", "image_worker", "video_worker", "analysis_worker", "thinking_worker", "browser_worker")
+
+def normalize_task_text(text):
+    """Minúsculas, sem acentos e pontuação, com espaços colapsados (chave de memoização e tokens)."""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+# Regras aplicadas ao texto normalizado: servem de prior para o modelo local ("imagens de satélite" num artigo não é image_worker)
+ROUTING_RULES = [
+    ("image_worker", re.compile(r"\b(imagem|imagens|image|images|ilustracao|ilustracoes|illustration|logotipo|logo|desenho|drawing|foto|fotos|picture|icone|icon|wallpaper)\b")),
+    ("video_worker", re.compile(r"\b(video|videos|animacao|animation|veo|veo3|clipe|clip)\b")),
+    ("browser_worker", re.compile(r"\b(google|pesquise|pesquisar|busque|buscar|search|navegue|navegar|browse|site|sites|website|url|urls|web|internet|online|links?)\b|\bhttps?\b")),
+    ("analysis_worker", re.compile(r"\b(analise|analisar|analyze|analyse|analysis|estatistica|estatisticas|statistics|csv|planilha|spreadsheet|metricas|metrics|dataset)\b")),
+    ("thinking_worker", re.compile(r"\b(raciocinio|reasoning|estrategia|estrategico|strategy|strategic|demonstre|prove|deduza|dilema|trade offs?)\b")),
+]
+
+class LocalRoutingModel:
+    """Naive Bayes multinomial (bag-of-words) treinável offline a partir das decisões registradas do Router."""
+
+    def __init__(self):
+        self.class_counts = Counter()
+        self.token_counts = {}
+        self.token_totals = Counter()
+        self.vocabulary = set()
+
+    @property
+    def num_samples(self):
+        return sum(self.class_counts.values())
+
+    def partial_fit(self, text, agent_type):
+        tokens = normalize_task_text(text).split()
+        self.class_counts[agent_type] += 1
+        counts = self.token_counts.setdefault(agent_type, Counter())
+        counts.update(tokens)
+        self.token_totals[agent_type] += len(tokens)
+        self.vocabulary.update(tokens)
+
+    def fit(self, samples):
+        for text, agent_type in samples:
+            self.partial_fit(text, agent_type)
+        return self
+
+    def predict(self, text, favored=(), favored_weight=ROUTER_RULE_PRIOR_WEIGHT):
+        """Retorna (agent_type, probabilidade) ou (None, 0.0) se não houver dados suficientes.
+
+        favored: agentes cujo prior é multiplicado por favored_weight (ex.: os que casaram com ROUTING_RULES).
+        """
+        tokens = [t for t in normalize_task_text(text).split() if t in self.vocabulary]
+        if not tokens or len(self.class_counts) < 2:
+            return None, 0.0
+        total, vocab_size = self.num_samples, len(self.vocabulary)
+        log_probs = {}
+        for agent_type, class_count in self.class_counts.items():
+            counts, denominator = self.token_counts[agent_type], self.token_totals[agent_type] + vocab_size
+            log_prob = math.log(class_count / total) + (math.log(favored_weight) if agent_type in favored else 0.0)
+            for token in tokens:
+                log_prob += math.log((counts[token] + 1) / denominator)
+            log_probs[agent_type] = log_prob
+        best = max(log_probs, key=log_probs.get)
+        norm = sum(math.exp(lp - log_probs[best]) for lp in log_probs.values())
+        return best, 1.0 / norm
+
+    @classmethod
+    def from_log(cls, path=ROUTING_LOG_FILE):
+        model = cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("agent_type") in VALID_AGENT_TYPES and record.get("task"):
+                        model.partial_fit(record["task"], record["agent_type"])
+        except OSError:
+            pass
+        return model
+
+# --- Classes dos Agentes ---
+
+class RouterAgent:
+    """Router agent que decide qual agente especializado usar para cada tarefa."""
+    
+    def __init__(self):
+        self.routing_instruction = (
+            "Você é um Router Agent especialista. Analise a tarefa fornecida e determine qual tipo de agente "
+            "é mais adequado para executá-la. Responda com um JSON contendo 'agent_type' e 'reasoning'. "
+            "Tipos disponíveis: 'text_worker' (tarefas de texto/código simples), 'image_worker' (geração de imagens), "
+            "'video_worker' (geração de vídeos), 'analysis_worker' (análise de dados), "
+            "'thinking_worker' (raciocínio complexo, problemas difíceis, planejamento estratégico), "
+            "'browser_worker' (busca no Google, navegação web, extração de conteúdo de sites, automação de browser). "
+            "Exemplo: {'agent_type': 'browser_worker', 'reasoning': 'Tarefa requer busca web ou navegação'}"
         )
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS,
-            "temperature": 0.3  # Mais precisão para análise
+        self.gen_config = {
+            "temperature": 0.3,
+            "response_mime_type": "application/json"
         }
+        # Fast-path local: memo de decisões, regras e modelo treinado com as decisões registradas
+        self.confidence_threshold = ROUTER_FAST_PATH_CONFIDENCE
+        self.decision_memo = OrderedDict()
+        self.local_model = LocalRoutingModel.from_log()
+        self.route_stats = Counter()
+        self._lock = threading.Lock()
+        log_message(f"RouterAgent criado (modelo local com {self.local_model.num_samples} amostras).", "RouterAgent")
 
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
+    def _route_locally(self, task_description):
+        """Tenta rotear sem chamar a API; retorna (agent_type, reasoning) ou None."""
+        key = normalize_task_text(task_description)
+        with self._lock:
+            if key in self.decision_memo:
+                self.decision_memo.move_to_end(key)
+                self.route_stats["memo"] += 1
+                return self.decision_memo[key]
 
-        if not response: return {"text_content": "Falha na API."}, []
+        matched = {agent_type for agent_type, pattern in ROUTING_RULES if pattern.search(key)}
+        with self._lock:
+            if self.local_model.num_samples < ROUTER_MIN_TRAINING_SAMPLES:
+                return None
+            agent_type, confidence = self.local_model.predict(key, favored=matched)
+            if not agent_type or confidence < self.confidence_threshold:
+                return None
+            by_rule = agent_type in matched
+            self.route_stats["rules" if by_rule else "model"] += 1
+        if by_rule:
+            return agent_type, f"Regra por palavras-chave e modelo local (confiança {confidence:.2f})"
+        return agent_type, f"Modelo local (confiança {confidence:.2f})"
 
-        extract_and_print_thoughts(response)
+    def stats(self):
+        with self._lock:
+            return dict(self.route_stats)
+
+    def _count_llm_route(self):
+        with self._lock:
+            self.route_stats["llm"] += 1
+
+    def _remember(self, task_description, agent_type, reasoning):
+        """Memoiza a decisão do LLM, registra-a para treino offline e atualiza o modelo local."""
+        key = normalize_task_text(task_description)
+        with self._lock:
+            self.decision_memo[key] = (agent_type, reasoning)
+            if len(self.decision_memo) > ROUTER_MEMO_MAX_ENTRIES:
+                self.decision_memo.popitem(last=False)
+            self.local_model.partial_fit(task_description, agent_type)
+            try:
+                with open(ROUTING_LOG_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"task": task_description, "agent_type": agent_type,
+                                        "reasoning": reasoning, "timestamp": time.time()}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                log_message(f"Falha ao registrar decisão de roteamento: {e}", "RouterAgent")
+
+    def _build_prompt(self, task_description, context):
+        prompt_parts = [
+            f"{self.routing_instruction}\n\n"
+            f"Contexto: {context_to_text(context)}\n"
+            f"Tarefa a ser roteada: '{task_description}'\n\n"
+            f"Determine o melhor agente para esta tarefa."
+        ]
+        if isinstance(context, TaskContext):
+            context.record_prompt(prompt_parts)
+        return prompt_parts
+
+    def _parse_response(self, task_description, response):
+        if not response or not response.text:
+            log_message("Router falhou, usando text_worker como padrão", "RouterAgent")
+            return "text_worker", "Fallback para texto devido a falha no roteamento"
         
-        # Handle function calls if any
+        try:
+            text_response = response.text.strip()
+            if text_response.startswith("```json"): 
+                text_response = text_response[7:-3].strip()
+            route_dict = json.loads(text_response)
+            
+            agent_type = route_dict.get("agent_type", "text_worker")
+            reasoning = route_dict.get("reasoning", "Sem justificativa fornecida")
+            
+            print_agent_message("RouterAgent", f"Roteado para: {agent_type} - {reasoning}")
+            if agent_type in VALID_AGENT_TYPES:
+                self._remember(task_description, agent_type, reasoning)
+            return agent_type, reasoning
+            
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+            log_message(f"Erro no parsing do router: {e}. Resposta: '{response.text}'", "RouterAgent")
+            return "text_worker", "Fallback para texto devido a erro de parsing"
+
+    def _local_decision(self, task_description):
+        start = time.perf_counter()
+        decision = self._route_locally(task_description)
+        if decision:
+            agent_type, reasoning = decision
+            elapsed_us = (time.perf_counter() - start) * 1_000_000
+            print_agent_message("RouterAgent", f"Roteado localmente para: {agent_type} - {reasoning} ({elapsed_us:.0f} µs)")
+        return decision
+    
+    def route_task(self, task_description, context=""):
+        """Decide qual agente deve executar a tarefa."""
+        print_agent_message("RouterAgent", f"Analisando roteamento para: '{task_description}'")
+        decision = self._local_decision(task_description)
+        if decision:
+            return decision
+        self._count_llm_route()
+        prompt_parts = self._build_prompt(task_description, context)
+        response = call_gemini_api_with_retry(prompt_parts, "RouterAgent", gen_config_dict=self.gen_config)
+        return self._parse_response(task_description, response)
+
+    async def route_task_async(self, task_description, context=""):
+        """Versão assíncrona de route_task."""
+        print_agent_message("RouterAgent", f"Analisando roteamento para: '{task_description}'")
+        decision = self._local_decision(task_description)
+        if decision:
+            return decision
+        self._count_llm_route()
+        prompt_parts = self._build_prompt(task_description, context)
+        response = await call_gemini_api_with_retry_async(prompt_parts, "RouterAgent", gen_config_dict=self.gen_config)
+        return self._parse_response(task_description, response)
+
+class Worker:
+    # Subclasses especializam o agente sobrescrevendo estes atributos e build_task_prompt/gen_config
+    agent_name = "Worker"
+    task_label = ""
+    default_result_message = "Ação concluída."
+    # Respostas longas são exibidas conforme chegam (streaming)
+    stream_output = False
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS
+    }
+
+    def __init__(self, task_manager):
+        self.task_manager = task_manager
+        log_message("Worker (v11.26 - Gemini 2.5) criado.", "Worker")
+
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (f"Contexto: {context_text}\n"
+                f"Objetivo Geral: {original_goal}\n\n"
+                f"Sua tarefa agora: \\'{task_description}\\'. ")
+
+    def _build_conversation(self, task_description, previous_results, original_goal):
+        print_agent_message(self.agent_name, f"Executando{self.task_label}: '{task_description}'")
+
+        conversation_history = []
+        if self.task_manager.uploaded_file_objects:
+             conversation_history.extend(self.task_manager.uploaded_file_objects)
+
+        context_text = context_to_text(previous_results, 'Nenhum.')
+        conversation_history.append(self.build_task_prompt(task_description, context_text, original_goal))
+        if isinstance(previous_results, TaskContext):
+            previous_results.record_prompt(conversation_history)
+        return conversation_history
+
+    def _function_calls(self, response):
         if response.candidates and response.candidates[0].content.parts:
             for part in response.candidates[0].content.parts:
                 if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", agent_name)
-        
-        return {"text_content": response.text.strip() if response.text else "Análise concluída."}, []
+                    yield part.function_call.name, dict(part.function_call.args)
+
+    def _final_result(self, response):
+        parts = response.candidates[0].content.parts if response.candidates else []
+        text = "".join(part.text for part in parts if getattr(part, 'text', None))
+        return {"text_content": text.strip() if text else self.default_result_message}, []
+
+    def _next_turn(self, contents, response, calls, results):
+        """Acrescenta a resposta do modelo e os resultados das ferramentas (em uma única mensagem)."""
+        contents.append(response.candidates[0].content)
+        contents.append({"role": "user", "parts": [function_response_part(name, result) for (name, _), result in zip(calls, results)]})
+
+    def execute_task(self, task_description, previous_results, files_info, original_goal):
+        conversation_history = self._build_conversation(task_description, previous_results, original_goal)
+        contents = [{"role": "user", "parts": conversation_history}]
+
+        # Loop de function calling: ferramentas em paralelo, resultados devolvidos ao modelo
+        for iteration in range(MAX_TOOL_ITERATIONS + 1):
+            response = call_gemini_api_with_retry(contents, self.agent_name, gen_config_dict=self.gen_config, stream=self.stream_output)
+            if not response: return {"text_content": "Falha na API."}, []
+
+            extract_and_print_thoughts(response)
+            calls = list(self._function_calls(response))
+            if not calls:
+                break
+            if iteration == MAX_TOOL_ITERATIONS:
+                log_message(f"Limite de {MAX_TOOL_ITERATIONS} rodadas de ferramentas atingido.", self.agent_name)
+                break
+            results = execute_tool_calls(calls, self.agent_name)
+            self._next_turn(contents, response, calls, results)
+
+        return self._final_result(response)
+
+    async def execute_task_async(self, task_description, previous_results, files_info, original_goal):
+        """Versão assíncrona de execute_task: API e ferramentas não bloqueiam o event loop."""
+        conversation_history = self._build_conversation(task_description, previous_results, original_goal)
+        contents = [{"role": "user", "parts": conversation_history}]
+
+        for iteration in range(MAX_TOOL_ITERATIONS + 1):
+            response = await call_gemini_api_with_retry_async(contents, self.agent_name, gen_config_dict=self.gen_config, stream=self.stream_output)
+            if not response: return {"text_content": "Falha na API."}, []
+
+            extract_and_print_thoughts(response)
+            calls = list(self._function_calls(response))
+            if not calls:
+                break
+            if iteration == MAX_TOOL_ITERATIONS:
+                log_message(f"Limite de {MAX_TOOL_ITERATIONS} rodadas de ferramentas atingido.", self.agent_name)
+                break
+            results = await execute_tool_calls_async(calls, self.agent_name)
+            self._next_turn(contents, response, calls, results)
+
+        return self._final_result(response)
+
+class ImageWorker(Worker):
+    """Agente especializado em tarefas relacionadas a imagens."""
+    agent_name = "ImageWorker"
+    task_label = " (imagem)"
+    default_result_message = "Imagem processada."
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS,
+        "temperature": 0.7  # Mais criatividade para imagens
+    }
+    
+    def __init__(self, task_manager):
+        super().__init__(task_manager)
+        log_message("ImageWorker (v11.26) criado.", "ImageWorker")
+    
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (
+            f"Contexto: {context_text}\n"
+            f"Objetivo Geral: {original_goal}\n\n"
+            f"TAREFA DE IMAGEM: {task_description}\n"
+            f"Foque especificamente em gerar, editar ou analisar imagens. "
+            f"Use a função generate_image quando apropriado."
+        )
+
+class AnalysisWorker(Worker):
+    """Agente especializado em análise e pensamento complexo."""
+    agent_name = "AnalysisWorker"
+    task_label = " (análise)"
+    default_result_message = "Análise concluída."
+    stream_output = True
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS,
+        "temperature": 0.3  # Mais precisão para análise
+    }
+    
+    def __init__(self, task_manager):
+        super().__init__(task_manager)
+        log_message("AnalysisWorker (v11.26) criado.", "AnalysisWorker")
+    
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (
+            f"Contexto: {context_text}\n"
+            f"Objetivo Geral: {original_goal}\n\n"
+            f"TAREFA DE ANÁLISE: {task_description}\n"
+            f"Pense profundamente sobre esta tarefa. Considere múltiplas perspectivas, "
+            f"analise dados e forneça insights detalhados. Use raciocínio estruturado."
+        )
 
 class VideoWorker(Worker):
     """Agente especializado em tarefas relacionadas a vídeos (Veo3 quando disponível)."""
+    agent_name = "VideoWorker"
+    task_label = " (vídeo)"
+    default_result_message = "Vídeo processado (planejado)."
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS,
+        "temperature": 0.7
+    }
     
     def __init__(self, task_manager):
         super().__init__(task_manager)
         log_message("VideoWorker (v11.26 - Veo3 ready) criado.", "VideoWorker")
     
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "VideoWorker"
-        print_agent_message(agent_name, f"Executando (vídeo): '{task_description}'")
-
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
-        
-        conversation_history.append(
-            f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (
+            f"Contexto: {context_text}\n"
             f"Objetivo Geral: {original_goal}\n\n"
             f"TAREFA DE VÍDEO: {task_description}\n"
             f"NOTA: Funcionalidade de vídeo (Veo3) ainda não implementada na API. "
             f"Por ora, documente os requisitos e planeje a implementação futura."
         )
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS,
-            "temperature": 0.7
-        }
-
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
-
-        if not response: return {"text_content": "Falha na API."}, []
-
-        extract_and_print_thoughts(response)
-        
-        # Handle function calls if any
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", agent_name)
-        
-        return {"text_content": response.text.strip() if response.text else "Vídeo processado (planejado)."}, []
 
 class ThinkingWorker(Worker):
     """Agente especializado em pensamento complexo e raciocínio estruturado."""
+    agent_name = "ThinkingWorker"
+    task_label = " (pensamento)"
+    default_result_message = "Pensamento estruturado concluído."
+    stream_output = True
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS,
+        "temperature": 0.4,  # Equilibrio entre criatividade e precisão
+        "max_output_tokens": 2048  # Permite respostas mais elaboradas
+    }
     
     def __init__(self, task_manager):
         super().__init__(task_manager)
         log_message("ThinkingWorker (v12.0 - Chain of Thought) criado.", "ThinkingWorker")
     
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "ThinkingWorker"
-        print_agent_message(agent_name, f"Executando (pensamento): '{task_description}'")
-
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
-        
-        conversation_history.append(
-            f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (
+            f"Contexto: {context_text}\n"
             f"Objetivo Geral: {original_goal}\n\n"
             f"TAREFA DE PENSAMENTO COMPLEXO: {task_description}\n\n"
             f"Instruções especiais:\n"
@@ -1093,50 +4226,24 @@ class ThinkingWorker(Worker):
             f"PENSAMENTO: [seu raciocínio detalhado aqui]\n"
             f"RESPOSTA: [sua conclusão/solução aqui]"
         )
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS,
-            "temperature": 0.4,  # Equilibrio entre criatividade e precisão
-            "max_output_tokens": 2048  # Permite respostas mais elaboradas
-        }
-
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
-
-        if not response: return {"text_content": "Falha na API."}, []
-
-        extract_and_print_thoughts(response)
-        
-        # Handle function calls if any
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", agent_name)
-        
-        return {"text_content": response.text.strip() if response.text else "Pensamento estruturado concluído."}, []
 
 class BrowserWorker(Worker):
     """Agente especializado em tarefas relacionadas a navegação web, busca no Google e automação de browser."""
+    agent_name = "BrowserWorker"
+    task_label = " (web/browser)"
+    default_result_message = "Tarefa web concluída."
+    gen_config = {
+        "tools": AVAILABLE_TOOL_DECLARATIONS,
+        "temperature": 0.4  # Equilibrio para pesquisa efetiva
+    }
     
     def __init__(self, task_manager):
         super().__init__(task_manager)
         log_message("BrowserWorker (v12.0 - Google Search + Browser Automation) criado.", "BrowserWorker")
     
-    def execute_task(self, task_description, previous_results, files_info, original_goal):
-        agent_name = "BrowserWorker"
-        print_agent_message(agent_name, f"Executando (web/browser): '{task_description}'")
-
-        conversation_history = []
-        if self.task_manager.uploaded_file_objects:
-             conversation_history.extend(self.task_manager.uploaded_file_objects)
-        
-        conversation_history.append(
-            f"Contexto: {json.dumps(previous_results) if previous_results else 'Nenhum.'}\n"
+    def build_task_prompt(self, task_description, context_text, original_goal):
+        return (
+            f"Contexto: {context_text}\n"
             f"Objetivo Geral: {original_goal}\n\n"
             f"TAREFA DE NAVEGAÇÃO/PESQUISA WEB: {task_description}\n\n"
             f"Ferramentas disponíveis para você:\n"
@@ -1145,31 +4252,155 @@ class BrowserWorker(Worker):
             f"• browser_automation: Para navegar, buscar texto e extrair links\n\n"
             f"Use essas ferramentas conforme necessário para completar a tarefa web."
         )
-        
-        gen_config = {
-            "tools": AVAILABLE_TOOL_DECLARATIONS,
-            "temperature": 0.4  # Equilibrio para pesquisa efetiva
-        }
 
-        response = call_gemini_api_with_retry(conversation_history, agent_name, gen_config_dict=gen_config)
+# --- Plano de Tarefas (DAG) ---
 
-        if not response: return {"text_content": "Falha na API."}, []
+class TaskGraph:
+    """Plano de tarefas com dependências explícitas (grafo acíclico)."""
 
-        extract_and_print_thoughts(response)
-        
-        # Handle function calls if any
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_name = part.function_call.name
-                    function_args = dict(part.function_call.args)
-                    
-                    if function_name in AVAILABLE_TOOLS:
-                        log_message(f"Executando função: {function_name} com args: {function_args}", agent_name)
-                        result = AVAILABLE_TOOLS[function_name](**function_args)
-                        log_message(f"Resultado da função {function_name}: {result}", agent_name)
-        
-        return {"text_content": response.text.strip() if response.text else "Tarefa web concluída."}, []
+    def __init__(self, nodes):
+        # nodes: lista ordenada de {"id", "description", "depends_on"}
+        self.nodes = {node["id"]: node for node in nodes}
+        self.order = [node["id"] for node in nodes]
+        self.children = {task_id: [] for task_id in self.order}
+        for node in nodes:
+            for dep in node["depends_on"]:
+                self.children[dep].append(node["id"])
+        self._ancestors = {}
+
+    @classmethod
+    def from_plan(cls, tasks):
+        """Aceita a lista do planejador: objetos {id, description, depends_on} ou strings (sequenciais)."""
+        nodes = []
+        for index, task in enumerate(tasks):
+            if isinstance(task, dict):
+                description = str(task.get("description") or task.get("task") or "").strip()
+                task_id = task.get("id", index + 1)
+                depends_on = task.get("depends_on") or []
+            else:
+                # Formato antigo (lista de strings): cada passo depende do anterior
+                description, task_id = str(task).strip(), index + 1
+                depends_on = [nodes[-1]["id"]] if nodes else []
+            if description:
+                nodes.append({"id": task_id, "description": description,
+                              "depends_on": depends_on if isinstance(depends_on, list) else [depends_on]})
+
+        # IDs duplicados ou dependências desconhecidas/para frente são descartados
+        seen_ids, valid_nodes = set(), []
+        for node in nodes:
+            if node["id"] in seen_ids:
+                continue
+            node["depends_on"] = [d for d in dict.fromkeys(node["depends_on"]) if d in seen_ids]
+            seen_ids.add(node["id"])
+            valid_nodes.append(node)
+        return cls(valid_nodes)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return (self.nodes[task_id]["description"] for task_id in self.order)
+
+    def ancestors(self, task_id):
+        if task_id not in self._ancestors:
+            result = set()
+            for dep in self.nodes[task_id]["depends_on"]:
+                result.add(dep)
+                result |= self.ancestors(dep)
+            self._ancestors[task_id] = result
+        return self._ancestors[task_id]
+
+    def critical_path(self, durations):
+        """Caminho de maior duração acumulada; retorna (lista de ids, duração total)."""
+        finish, previous = {}, {}
+        for task_id in self.order:  # a ordem do plano já é topológica
+            deps = self.nodes[task_id]["depends_on"]
+            best_dep = max(deps, key=lambda d: finish[d]) if deps else None
+            finish[task_id] = durations.get(task_id, 0.0) + (finish[best_dep] if best_dep is not None else 0.0)
+            previous[task_id] = best_dep
+        if not finish:
+            return [], 0.0
+        task_id = max(finish, key=finish.get)
+        total, path = finish[task_id], []
+        while task_id is not None:
+            path.append(task_id)
+            task_id = previous[task_id]
+        return path[::-1], total
+
+class PlanRun:
+    """Estado de execução de um TaskGraph, compartilhado pelos escalonadores síncrono e assíncrono."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.remaining_deps = {task_id: set(graph.nodes[task_id]["depends_on"]) for task_id in graph.order}
+        self.results = {}
+        self.durations = {}
+        self.prompt_bytes = {}
+        # Contexto de saída de cada tarefa concluída (seu contexto de entrada + o próprio resultado)
+        self._output_contexts = {}
+        # Tarefas que falharam e as descendentes bloqueadas por elas (id -> id da tarefa que falhou)
+        self.failed = set()
+        self.blocked = {}
+        self.started_at = time.perf_counter()
+
+    def initial_ready(self):
+        return [task_id for task_id in self.graph.order if not self.remaining_deps[task_id]]
+
+    def context_for(self, task_id):
+        """Contexto com os resultados apenas dos ancestrais da tarefa, reaproveitando o do maior pai."""
+        ancestors = self.graph.ancestors(task_id)
+        if not ancestors:
+            return TaskContext()
+        parents = self.graph.nodes[task_id]["depends_on"]
+        base_id = max(parents, key=lambda p: len(self.graph.ancestors(p)))
+        context = self._output_contexts[base_id].copy()
+        included = self.graph.ancestors(base_id) | {base_id}
+        for ancestor_id in self.graph.order:
+            if ancestor_id in ancestors and ancestor_id not in included:
+                context.add_result(self.graph.nodes[ancestor_id]["description"], self.results[ancestor_id])
+        return context
+
+    def complete(self, task_id, context, result, duration):
+        """Registra a conclusão de uma tarefa e retorna as tarefas que ficaram prontas."""
+        self.results[task_id] = result
+        self.durations[task_id] = duration
+        self.prompt_bytes[task_id] = context.step_prompt_bytes
+        output_context = context.copy()
+        output_context.add_result(self.graph.nodes[task_id]["description"], result)
+        self._output_contexts[task_id] = output_context
+        ready = []
+        for child in self.graph.children[task_id]:
+            self.remaining_deps[child].discard(task_id)
+            if not self.remaining_deps[child]:
+                ready.append(child)
+        return ready
+
+    def fail(self, task_id, result, duration):
+        """Registra a falha de uma tarefa e bloqueia todas as suas descendentes; retorna as bloqueadas, na ordem do plano."""
+        self.results[task_id] = result
+        self.durations[task_id] = duration
+        self.failed.add(task_id)
+        stack = list(self.graph.children[task_id])
+        while stack:
+            child = stack.pop()
+            if child not in self.blocked:
+                self.blocked[child] = task_id
+                stack.extend(self.graph.children[child])
+        return [child for child in self.graph.order if self.blocked.get(child) == task_id]
+
+    def report(self):
+        wall_time = time.perf_counter() - self.started_at
+        sequential_time = sum(self.durations.values())
+        path, path_time = self.graph.critical_path(self.durations)
+        return {
+            "wall_time": wall_time,
+            "sequential_time": sequential_time,
+            "critical_path": [self.graph.nodes[task_id]["description"] for task_id in path],
+            "critical_path_time": path_time,
+            "speedup": sequential_time / wall_time if wall_time > 0 else 1.0,
+            "failed": [self.graph.nodes[task_id]["description"] for task_id in self.graph.order if task_id in self.failed],
+            "blocked": [self.graph.nodes[task_id]["description"] for task_id in self.graph.order if task_id in self.blocked],
+        }
 
 class TaskManager:
     def __init__(self, initial_goal, uploaded_files, files_meta):
@@ -1177,6 +4408,7 @@ class TaskManager:
         self.uploaded_file_objects = uploaded_files or []
         self.uploaded_files_info = files_meta or []
         self.executed_tasks_results = []
+        self.context_prefix = None
         
         # Initialize router and specialized workers
         self.router = RouterAgent()
@@ -1198,27 +4430,30 @@ class TaskManager:
         }
         
         self.system_instruction = (
-            "Você é um Gerenciador de Tarefas especialista. Decomponha a meta principal em sub-tarefas sequenciais e executáveis. "
-            "Sua resposta DEVE ser um objeto JSON bem formado contendo uma única chave 'tasks', que é uma lista de strings. Exemplo: {\\'tasks\\': [\\'Passo 1\\', \\'Passo 2\\']}"
+            "Você é um Gerenciador de Tarefas especialista. Decomponha a meta principal em sub-tarefas executáveis e indique as dependências entre elas. "
+            "Sua resposta DEVE ser um objeto JSON bem formado contendo uma única chave 'tasks', que é uma lista de objetos com "
+            "'id' (inteiro), 'description' (string) e 'depends_on' (lista de ids de tarefas anteriores cujo resultado é necessário). "
+            "Tarefas independentes entre si NÃO devem depender umas das outras, para que possam ser executadas em paralelo. "
+            "Exemplo: {\\'tasks\\': [{\\'id\\': 1, \\'description\\': \\'Pesquisar X\\', \\'depends_on\\': []}, "
+            "{\\'id\\': 2, \\'description\\': \\'Pesquisar Y\\', \\'depends_on\\': []}, "
+            "{\\'id\\': 3, \\'description\\': \\'Comparar X e Y\\', \\'depends_on\\': [1, 2]}]}"
         )
+        self.max_parallel_tasks = MAX_PARALLEL_TASKS
+        self.planner_gen_config = {
+            "temperature": 0.5, 
+            "response_mime_type": "application/json"
+        }
         log_message("TaskManager (v12.0 - Gemini 2.5 com Router + Google Search + Browser Tools) criado.", "TaskManager")
         
-    def decompose_goal(self):
-        agent_name = "Task Manager"
-        print_agent_message(agent_name, f"Decompondo meta: '{self.goal}'")
-
+    def _build_decompose_prompt(self):
         prompt_text = (f"{self.system_instruction}\n\nMeta a ser decomposta: \\'{self.goal}\\'")
         prompt_parts = []
         if self.uploaded_file_objects: prompt_parts.extend(self.uploaded_file_objects)
         prompt_parts.append(prompt_text)
-        
-        gen_config = {
-            "temperature": 0.5, 
-            "response_mime_type": "application/json"
-        }
-        response = call_gemini_api_with_retry(prompt_parts, agent_name, gen_config_dict=gen_config)
-        
-        if not response or not response.text: return [self.goal]
+        return prompt_parts
+
+    def _parse_plan(self, response):
+        if not response or not response.text: return TaskGraph.from_plan([self.goal])
         
         extract_and_print_thoughts(response)
         try:
@@ -1226,24 +4461,107 @@ class TaskManager:
             if text_response.startswith("```json"): text_response = text_response[7:-3].strip()
             plan_dict = json.loads(text_response)
             tasks = plan_dict.get("tasks", [])
-            return tasks if isinstance(tasks, list) else [self.goal]
-        except (json.JSONDecodeError, TypeError) as e:
+            graph = TaskGraph.from_plan(tasks) if isinstance(tasks, list) else None
+            return graph if graph else TaskGraph.from_plan([self.goal])
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
             log_message(f"Falha ao decodificar JSON do planejador: {e}. Resposta: '{response.text}'", "TaskManager")
-            return [self.goal]
-    
-    def run_workflow(self):
-        print_agent_message("TaskManager", "Iniciando fluxo de trabalho...")
-        task_list = self.decompose_goal()
-        
+            return TaskGraph.from_plan([self.goal])
+
+    def decompose_goal(self):
+        agent_name = "Task Manager"
+        print_agent_message(agent_name, f"Decompondo meta: '{self.goal}'")
+        response = call_gemini_api_with_retry(self._build_decompose_prompt(), agent_name, gen_config_dict=self.planner_gen_config)
+        return self._parse_plan(response)
+
+    async def decompose_goal_async(self):
+        agent_name = "Task Manager"
+        print_agent_message(agent_name, f"Decompondo meta: '{self.goal}'")
+        response = await call_gemini_api_with_retry_async(self._build_decompose_prompt(), agent_name, gen_config_dict=self.planner_gen_config)
+        return self._parse_plan(response)
+
+    def _approve_plan(self, task_graph, auto_approve=False, approval_policy=None):
         print_agent_message("TaskManager", "--- PLANO DE TAREFAS ---")
-        for i, task in enumerate(task_list): print(f"  {i+1}. {task}")
-        
+        for i, task_id in enumerate(task_graph.order):
+            node = task_graph.nodes[task_id]
+            deps = f" (depende de: {', '.join(str(d) for d in node['depends_on'])})" if node["depends_on"] else ""
+            print(f"  {i+1}. [{task_id}] {node['description']}{deps}")
+
+        if approval_policy is not None:
+            approved, reason = approval_policy(task_graph)
+            self.approval_reason = reason
+            log_message(f"Plano {'aprovado' if approved else 'recusado'} pela política: {reason}", "TaskManager")
+            return approved
+        if auto_approve:
+            log_message("Plano aprovado automaticamente.", "TaskManager")
+            return True
         if input("👤 Aprova? (s/n) ➡️ ").strip().lower() != 's':
-            print_agent_message("TaskManager", "Plano não aprovado."); return
-        
-        for task in task_list:
+            print_agent_message("TaskManager", "Plano não aprovado."); return False
+        return True
+
+    def _record_result(self, task, result):
+        self.executed_tasks_results.append({task: result})
+        print_agent_message("TaskManager", f"Resultado da tarefa '{task}': {result.get('text_content')}")
+
+    def _settle_task(self, plan_run, task_id, context, result, duration):
+        """Registra o resultado de uma tarefa; se ela falhou, suas dependentes não rodam. Retorna as tarefas prontas."""
+        task_graph = plan_run.graph
+        self._record_result(task_graph.nodes[task_id]["description"], result)
+        if "error" not in result:
+            return plan_run.complete(task_id, context, result, duration)
+        failed_task = task_graph.nodes[task_id]["description"]
+        for blocked_id in plan_run.fail(task_id, result, duration):
+            self._record_result(task_graph.nodes[blocked_id]["description"],
+                                {"text_content": f"Tarefa não executada: depende de '{failed_task}', que falhou."})
+        return []
+
+    def _finish_workflow(self, plan_run):
+        print_agent_message("TaskManager", "Fluxo de trabalho concluído!")
+        # Caches, ferramentas, API e streaming são contadores do processo: no lote incluem as metas em paralelo
+        log_message(f"Estatísticas do cache de respostas (totais do processo): {RESPONSE_CACHE.stats()}", "TaskManager")
+        log_message(f"Estatísticas do cache HTTP (totais do processo): {HTTP_CACHE.stats()}", "TaskManager")
+        log_message(f"Estatísticas das páginas da sessão (totais do processo): {PAGE_CACHE.stats()}", "TaskManager")
+        log_message(f"Estatísticas do cache de buscas (totais do processo): {SEARCH_CACHE.stats()}", "TaskManager")
+        log_message(f"Estatísticas do cache de contexto (totais do processo): {CONTEXT_CACHE.stats()}", "TaskManager")
+        log_message(f"Estatísticas de roteamento: {self.router.stats()}", "TaskManager")
+        log_message(f"Latência das ferramentas (totais do processo): {tool_latency_stats()}", "TaskManager")
+        log_message(f"Chamadas à API por agente (totais do processo): {api_call_stats()}", "TaskManager")
+        for agent, stats in api_call_stats().items():
+            if stats["retries"] or stats["throttled"] or stats["fatal_errors"]:
+                print_agent_message("TaskManager", f"API {agent} (total do processo): {stats['retries']} retentativas, "
+                                                   f"{stats['throttled']} esperas do limitador "
+                                                   f"({stats['throttle_wait_s']:.1f}s), {stats['fatal_errors']} erros fatais")
+        for agent, stats in stream_stats().items():
+            print_agent_message("TaskManager", f"Streaming {agent} (total do processo): TTFT médio {stats['ttft_mean_s']:.2f}s, "
+                                               f"{stats['tokens_per_s']:.1f} tokens/s ({stats['streams']} respostas)")
+
+        prompt_bytes = [plan_run.prompt_bytes[task_id] for task_id in plan_run.graph.order if task_id in plan_run.prompt_bytes]
+        print_agent_message("TaskManager", f"Bytes de prompt por passo: {prompt_bytes} "
+                                           f"(máx: {max(prompt_bytes, default=0)})")
+
+        report = plan_run.report()
+        if self.context_prefix is not None:
+            # O cache é compartilhado (refcount) pelos fluxos com os mesmos arquivos: os números são do conjunto deles
+            context_stats = CONTEXT_CACHE.stats(self.context_prefix)
+            report["global_totals"] = {"context_cache": context_stats}
+            print_agent_message("TaskManager", f"Cache de contexto (total dos fluxos com estes arquivos): "
+                                               f"{context_stats.get('hits', 0)} chamada(s) referenciaram os arquivos em cache, "
+                                               f"~{context_stats.get('tokens_saved', 0)} tokens de entrada não reenviados "
+                                               f"({context_stats.get('inline', 0)} inline).")
+        self.last_run_report = report
+        log_message(f"Relatório de execução: {report}", "TaskManager")
+        print_agent_message("TaskManager",
+            f"Caminho crítico ({report['critical_path_time']:.1f}s): {' → '.join(report['critical_path'])}\n"
+            f"Tempo total: {report['wall_time']:.1f}s | Sequencial estimado: {report['sequential_time']:.1f}s | "
+            f"Speedup: {report['speedup']:.2f}x")
+        if report["failed"]:
+            print_agent_message("TaskManager", f"Tarefas com falha: {report['failed']} | "
+                                               f"Não executadas (dependiam delas): {report['blocked']}")
+
+    def _run_task(self, task, context):
+        """Roteia e executa uma tarefa com o contexto dos seus ancestrais; retorna (resultado, duração)."""
+        start = time.perf_counter()
+        try:
             # Use router to determine best worker for this task
-            context = json.dumps(self.executed_tasks_results) if self.executed_tasks_results else ""
             agent_type, reasoning = self.router.route_task(task, context)
             
             # Get the appropriate worker
@@ -1252,16 +4570,277 @@ class TaskManager:
             print_agent_message("TaskManager", f"Executando '{task}' com {agent_type}")
             
             result, _ = worker.execute_task(
-                task, self.executed_tasks_results, 
+                task, context, 
                 self.uploaded_files_info, self.goal
             )
-            self.executed_tasks_results.append({task: result})
-            print_agent_message("TaskManager", f"Resultado da tarefa '{task}': {result.get('text_content')}")
+        except Exception as e:
+            log_message(f"Erro ao executar '{task}': {e}\\n{traceback.format_exc()}", "TaskManager")
+            result = {"text_content": f"Erro ao executar a tarefa: {e}", "error": str(e)}
+        duration = time.perf_counter() - start
+        log_message(f"Tarefa concluída: '{task}'", "TaskManager", event="task_done", duration=duration)
+        return result, duration
 
-        print_agent_message("TaskManager", "Fluxo de trabalho concluído!")
+    async def _run_task_async(self, task, context):
+        start = time.perf_counter()
+        try:
+            agent_type, reasoning = await self.router.route_task_async(task, context)
+            worker = self.worker_map.get(agent_type, self.text_worker)
+
+            print_agent_message("TaskManager", f"Executando '{task}' com {agent_type}")
+
+            result, _ = await worker.execute_task_async(
+                task, context,
+                self.uploaded_files_info, self.goal
+            )
+        except Exception as e:
+            log_message(f"Erro ao executar '{task}': {e}\\n{traceback.format_exc()}", "TaskManager")
+            result = {"text_content": f"Erro ao executar a tarefa: {e}", "error": str(e)}
+        duration = time.perf_counter() - start
+        log_message(f"Tarefa concluída: '{task}'", "TaskManager", event="task_done", duration=duration)
+        return result, duration
+
+    def execute_plan(self, task_graph):
+        """Executa as tarefas prontas em paralelo (pool limitado), respeitando as dependências; a falha de uma tarefa bloqueia as dependentes."""
+        plan_run = PlanRun(task_graph)
+        ready = plan_run.initial_ready()
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel_tasks, thread_name_prefix="mag-task") as pool:
+            while ready or pending:
+                for task_id in ready:
+                    context = plan_run.context_for(task_id)
+                    task = task_graph.nodes[task_id]["description"]
+                    pending[pool.submit(self._run_task, task, context)] = (task_id, context)
+                ready = []
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task_id, context = pending.pop(future)
+                    result, duration = future.result()
+                    ready.extend(self._settle_task(plan_run, task_id, context, result, duration))
+        self._finish_workflow(plan_run)
+        return plan_run
+
+    async def execute_plan_async(self, task_graph):
+        """Versão assíncrona de execute_plan (até max_parallel_tasks tarefas simultâneas)."""
+        plan_run = PlanRun(task_graph)
+        ready = plan_run.initial_ready()
+        pending = {}
+        while ready or pending:
+            while ready and len(pending) < self.max_parallel_tasks:
+                task_id = ready.pop(0)
+                context = plan_run.context_for(task_id)
+                task = task_graph.nodes[task_id]["description"]
+                pending[asyncio.ensure_future(self._run_task_async(task, context))] = (task_id, context)
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                task_id, context = pending.pop(future)
+                result, duration = future.result()
+                ready.extend(self._settle_task(plan_run, task_id, context, result, duration))
+        self._finish_workflow(plan_run)
+        return plan_run
+    
+    def run_workflow(self, auto_approve=False, approval_policy=None):
+        print_agent_message("TaskManager", "Iniciando fluxo de trabalho...")
+        # Os arquivos enviados são registrados uma vez; planejador e workers passam a referenciá-los pelo cache
+        self.context_prefix = CONTEXT_CACHE.register(self.uploaded_file_objects)
+        try:
+            task_graph = self.decompose_goal()
+            self.last_task_graph = task_graph
+
+            if not self._approve_plan(task_graph, auto_approve, approval_policy): return
+
+            return self.execute_plan(task_graph)
+        finally:
+            CONTEXT_CACHE.release(self.context_prefix)
+
+    async def run_workflow_async(self, auto_approve=False, approval_policy=None):
+        """Versão assíncrona de run_workflow; permite vários fluxos concorrentes em um único processo."""
+        print_agent_message("TaskManager", "Iniciando fluxo de trabalho (assíncrono)...")
+        self.context_prefix = CONTEXT_CACHE.register(self.uploaded_file_objects)
+        try:
+            task_graph = await self.decompose_goal_async()
+            self.last_task_graph = task_graph
+
+            # input() bloquearia o event loop, então a aprovação interativa roda em uma thread
+            if auto_approve or approval_policy is not None:
+                approved = self._approve_plan(task_graph, auto_approve, approval_policy)
+            else:
+                approved = await asyncio.to_thread(self._approve_plan, task_graph)
+            if not approved: return
+
+            return await self.execute_plan_async(task_graph)
+        finally:
+            await asyncio.to_thread(CONTEXT_CACHE.release, self.context_prefix)
+
+# --- Execução em Lote (sem interação) ---
+def batch_approval_policy(policy):
+    """Converte a política em função task_graph -> (aprovado, motivo): 'auto', 'max-tasks:N' ou 'plan-only'."""
+    policy = (policy or "auto").strip().lower()
+    if policy == "auto":
+        return lambda graph: (True, "auto")
+    if policy == "plan-only":
+        return lambda graph: (False, "plan-only: apenas o plano é registrado")
+    if policy.startswith("max-tasks:") and policy.split(":", 1)[1].isdigit():
+        limit = int(policy.split(":", 1)[1])
+        return lambda graph: (len(graph.order) <= limit, f"{len(graph.order)} tarefa(s), limite {limit}")
+    raise ValueError(f"Política de aprovação desconhecida: '{policy}' (use auto, max-tasks:N ou plan-only)")
+
+def load_batch_goals(source):
+    """Lê as metas de um arquivo JSONL ou de '-' (stdin).
+
+    Cada linha é um objeto {"goal", "id"?, "files"?, "approval"?} ou, por conveniência, o texto da meta.
+    Levanta OSError se o arquivo não puder ser lido.
+    """
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    goals = []
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if isinstance(item, str):
+                item = {"goal": item}
+            if not isinstance(item, dict) or not str(item.get("goal", "")).strip():
+                log_message(f"Linha {line_number} do lote ignorada: meta ausente.", "Lote")
+                continue
+            item.setdefault("id", f"meta_{line_number}")
+            goals.append(item)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return goals
+
+def _batch_result_text(result):
+    return result.get("text_content") if isinstance(result, dict) else str(result)
+
+async def run_batch_goal(item, semaphore, default_policy, manager_factory=TaskManager):
+    """Executa uma meta do lote sob o semáforo global e retorna o registro de resultado."""
+    async with semaphore:
+        start = time.perf_counter()
+        record = {"id": item["id"], "goal": item["goal"], "status": "error", "started_at": datetime.datetime.now().isoformat()}
+        try:
+            policy = batch_approval_policy(item["approval"]) if item.get("approval") else default_policy
+            files, files_meta = [], []
+            paths = [p for pattern in item.get("files") or [] for p in glob.glob(pattern)]
+            if paths:
+                files, files_meta, upload_report = await asyncio.to_thread(upload_files, paths)
+                record["uploads"] = {k: upload_report[k] for k in ("files", "uploaded", "reused", "failed")}
+            manager = manager_factory(item["goal"], files, files_meta)
+            plan_run = await manager.run_workflow_async(approval_policy=policy)
+            graph = getattr(manager, "last_task_graph", None)
+            record["plan"] = [graph.nodes[t]["description"] for t in graph.order] if graph else []
+            record["approval"] = getattr(manager, "approval_reason", None)
+            if plan_run is None:
+                record["status"] = "not_approved"
+            else:
+                record["status"] = "completed"
+                record["results"] = [{"task": task, "text": _batch_result_text(result)}
+                                     for entry in manager.executed_tasks_results for task, result in entry.items()]
+                record["report"] = getattr(manager, "last_run_report", None)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            log_message(f"Erro na meta '{item['id']}' do lote: {e}\n{traceback.format_exc()}", "Lote")
+        record["duration_s"] = round(time.perf_counter() - start, 2)
+        log_message(f"Meta '{item['id']}' do lote: {record['status']}", "Lote", event="batch_goal",
+                    duration=record["duration_s"])
+        return record
+
+async def run_batch_async(goals, output_path, max_concurrent=BATCH_MAX_CONCURRENT_GOALS,
+                          policy=BATCH_APPROVAL_POLICY, manager_factory=TaskManager):
+    """Executa as metas concorrentemente (até max_concurrent por vez), gravando um registro JSONL por meta ao concluir."""
+    default_policy = batch_approval_policy(policy)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    start = time.perf_counter()
+    statuses = Counter()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "a", encoding="utf-8") as output:
+        pending = [asyncio.ensure_future(run_batch_goal(item, semaphore, default_policy, manager_factory))
+                   for item in goals]
+        for future in asyncio.as_completed(pending):
+            record = await future
+            statuses[record["status"]] += 1
+            output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+            print_agent_message("Lote", f"[{sum(statuses.values())}/{len(goals)}] '{record['id']}': {record['status']} "
+                                        f"({record['duration_s']}s)")
+    elapsed = time.perf_counter() - start
+    summary = {"goals": len(goals), "statuses": dict(statuses), "elapsed_s": round(elapsed, 2),
+               "goals_per_hour": round(statuses["completed"] * 3600 / max(elapsed, 1e-6), 1),
+               "max_concurrent": max_concurrent, "output": output_path,
+               # Contadores do processo: somam todas as metas, por isso ficam no resumo e não em cada registro
+               "global_totals": {"api_calls": api_call_stats(), "tool_latency": tool_latency_stats(),
+                                 "response_cache": RESPONSE_CACHE.stats(), "context_cache": CONTEXT_CACHE.stats()}}
+    log_message(f"Lote concluído: {summary}", "Lote", event="batch", duration=elapsed)
+    return summary
+
+def run_batch_cli(args):
+    try:
+        goals = load_batch_goals(args.batch)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"❌ Não foi possível ler o lote '{args.batch}': {e}")
+        log_message(f"Erro ao ler o lote '{args.batch}': {e}", "Lote")
+        return 1
+    if not goals:
+        print("Nenhuma meta encontrada no lote.")
+        return 1
+    output_path = args.batch_output or os.path.join(OUTPUT_DIRECTORY, f"batch_results_{CURRENT_TIMESTAMP_STR}.jsonl")
+    print_agent_message("Lote", f"{len(goals)} meta(s), até {args.batch_concurrency} simultâneas, "
+                                f"política de aprovação '{args.approval_policy}'.")
+    summary = asyncio.run(run_batch_async(goals, output_path, args.batch_concurrency, args.approval_policy))
+    print_agent_message("Lote", f"Concluído em {summary['elapsed_s']}s: {summary['statuses']} | "
+                                f"{summary['goals_per_hour']} metas/hora | resultados em {output_path}")
+    return 1 if summary["statuses"].get("error") else 0
 
 # --- Função Principal ---
+def parse_cli_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sistema Multiagente Gemini")
+    cleanup = parser.add_argument_group("limpeza de arquivos remotos (sem interação)")
+    cleanup.add_argument("--cleanup-remote-files", action="store_true",
+                         help="remove arquivos da File API que passam nos filtros e encerra")
+    cleanup.add_argument("--older-than-hours", type=float, help="só arquivos criados há mais de N horas")
+    cleanup.add_argument("--name-pattern", help="padrão fnmatch do nome de exibição (ex: 'relatorio_*.md')")
+    cleanup.add_argument("--manifest", choices=["only", "exclude"],
+                         help="'only': só arquivos do manifesto de uploads; 'exclude': só os que ele não conhece")
+    cleanup.add_argument("--dry-run", action="store_true", help="apenas lista o que seria removido")
+    batch = parser.add_argument_group("execução em lote (sem interação)")
+    batch.add_argument("--batch", metavar="ARQUIVO", help="arquivo JSONL com uma meta por linha ('-' para stdin)")
+    batch.add_argument("--batch-output", metavar="ARQUIVO",
+                       help="JSONL de resultados (padrão: gemini_final_outputs/batch_results_<timestamp>.jsonl)")
+    batch.add_argument("--batch-concurrency", type=int, default=BATCH_MAX_CONCURRENT_GOALS,
+                       help="metas executadas ao mesmo tempo")
+    batch.add_argument("--approval-policy", default=BATCH_APPROVAL_POLICY,
+                       help="'auto', 'max-tasks:N' ou 'plan-only'")
+    args = parser.parse_args(argv)
+    if args.batch:
+        try:
+            batch_approval_policy(args.approval_policy)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.batch_concurrency < 1:
+            parser.error("--batch-concurrency deve ser pelo menos 1")
+    return args
+
+def run_remote_cleanup_cli(args):
+    in_manifest = {"only": True, "exclude": False}.get(args.manifest)
+    report = cleanup_remote_files(older_than_hours=args.older_than_hours, name_pattern=args.name_pattern,
+                                  in_manifest=in_manifest, dry_run=args.dry_run)
+    for name in report.get("would_delete", []):
+        print(f"  - {name}")
+    for name, error in report["failed"].items():
+        print(f"  ❌ {name}: {error}")
+    print(format_cleanup_report(report))
+    return 1 if report["failed"] else 0
+
 if __name__ == "__main__":
+    args = parse_cli_args()
+    if args.cleanup_remote_files:
+        sys.exit(run_remote_cleanup_cli(args))
+    if args.batch:
+        sys.exit(run_batch_cli(args))
+
     SCRIPT_VERSION = "v12.0 (Gemini 2.5 Preview + RouterAgent)"
     log_message(f"--- Início ({SCRIPT_VERSION}) ---", "Sistema")
     print(f"--- Sistema Multiagente Gemini ({SCRIPT_VERSION}) ---")
@@ -0,0 +1,1021 @@
+"""
+Testes unitários offline do MAG: sem rede e sem chave real da API (o SDK é substituído por stubs).
+
+Execute com: python -m pytest -q test_mag.py
+"""
+
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "teste-offline")
+
+import mag
+
+
+# --- Índice de Páginas ---
+
+def test_index_finds_words_at_line_start():
+    index = mag.PageIndex()
+    index.add("https://exemplo.com/a", "T", mag._clean_page_text("T\n  Alpha beta\nGamma delta\n\nPython rocks"))
+    for term in ("alpha", "gamma", "python"):
+        results = index.search(term)
+        assert [r["url"] for r in results] == ["https://exemplo.com/a"], term
+        assert results[0]["hits"][0]["match"].lower() == term
+
+
+def test_extracted_page_text_uses_real_line_breaks():
+    html = b"<html><head><title>Doc</title></head><body><p>Primeiro bloco</p><div>Python no inicio</div></body></html>"
+    title, text = mag.extract_page_text(html, "utf-8", backend="html.parser")
+    assert title == "Doc"
+    assert "\\n" not in text and "Python no inicio" in text.splitlines()
+    index = mag.PageIndex()
+    index.add("https://exemplo.com/b", title, text)
+    assert index.search("python") and index.search('"python no inicio"')
+
+
+def test_extract_page_text_skips_noise_and_separates_blocks():
+    html = (b"<html><head><title>Doc</title><style>p{}</style></head><body><nav>Menu</nav>"
+            b"<!-- comentario --><p>Um <b>texto</b> inline</p><div>Outro bloco</div>depois"
+            + b"<span>" * 3000 + b"fundo" + b"</span>" * 3000 + b"<script>x()</script></body></html>")
+    title, text = mag.extract_page_text(html, "utf-8", backend="html.parser")
+    assert title == "Doc"
+    assert text.splitlines() == ["Doc", "Um texto inline", "Outro bloco", "depoisfundo"]
+
+
+def test_cached_page_is_indexed_by_full_text(tmp_path, monkeypatch):
+    filler = "".join(f"<p>Parágrafo comum número {i}.</p>" for i in range(600))
+    body = f"<html><title>Longa</title><body>{filler}<p>Zephyrantes aparece só no fim.</p></body></html>".encode()
+    site = _LocalSite({"/longa": (200, {"Cache-Control": "max-age=3600"}, body)})
+    try:
+        for _ in range(2):  # a segunda "execução" recebe o texto derivado gravado no cache em disco
+            monkeypatch.setattr(mag, "HTTP_CACHE", mag.HttpCache(str(tmp_path)))
+            monkeypatch.setattr(mag, "PAGE_INDEX", mag.PageIndex())
+            page = mag.PageCache().get(site.url + "/longa")
+            title, shown = page.text()
+            assert "Zephyrantes" not in shown and "TRUNCADO" in shown
+            assert [r["url"] for r in mag.PAGE_INDEX.search("zephyrantes")] == [site.url + "/longa"]
+            assert not mag.PAGE_INDEX.search("truncado")
+        assert page.entry.cache_status == "hit" and site.requests["/longa"] == 1
+    finally:
+        site.close()
+
+
+# --- Seleção de Trechos ---
+
+def test_select_relevant_chunks_matches_terms_at_line_start():
+    filler = "\n".join(f"Parágrafo de enchimento número {i} sem o termo." for i in range(60))
+    text = mag._clean_page_text(f"Introdução\n{filler}\nPython aparece no início desta linha.\n{filler}")
+    selected, info = mag.select_relevant_chunks(text, "python", token_budget=100, chunk_chars=200)
+    assert info["matched"]
+    assert "Python aparece no início desta linha." in selected.splitlines()
+    assert info["chunks_selected"] < info["chunks_total"]
+    # Os trechos respeitam as linhas do texto limpo em vez de cortá-las no meio
+    original_lines = set(text.splitlines())
+    assert all(line in original_lines for chunk in mag.split_text_chunks(text, 200) for line in chunk.splitlines())
+
+
+# --- Uploads (File API simulada) ---
+
+class _StubFile:
+    def __init__(self, name, ready_at, display_name=None, mime_type="text/plain", sha256_hash=None):
+        self.name = name
+        self.uri = f"https://stub/{name}"
+        self.display_name = display_name
+        self.mime_type = mime_type
+        self.sha256_hash = sha256_hash
+        self.ready_at = ready_at
+        self.size_bytes = 0
+        self.expiration_time = None
+        self.create_time = None
+
+    @property
+    def state(self):
+        return type("State", (), {"name": "ACTIVE" if time.monotonic() >= self.ready_at else "PROCESSING"})
+
+
+class _StubFileApi:
+    """genai.upload_file/get_file/delete_file em memória; os arquivos ficam em PROCESSING por processing_seconds."""
+
+    def __init__(self, monkeypatch, processing_seconds=0.0):
+        self.files, self.uploads, self.deletes = {}, 0, []
+        self.processing_seconds = processing_seconds
+        monkeypatch.setattr(mag.genai, "upload_file", self.upload_file)
+        monkeypatch.setattr(mag.genai, "get_file", self.get_file)
+        monkeypatch.setattr(mag.genai, "delete_file", self.delete_file)
+
+    def upload_file(self, path, mime_type=None, display_name=None):
+        self.uploads += 1
+        name = f"files/{self.uploads}"
+        self.files[name] = _StubFile(name, time.monotonic() + self.processing_seconds, display_name, mime_type)
+        return self.files[name]
+
+    def get_file(self, name):
+        if name not in self.files:
+            raise mag.google_exceptions.NotFound(name)
+        return self.files[name]
+
+    def delete_file(self, name):
+        self.deletes.append(name)
+        if self.files.pop(name, None) is None:
+            raise mag.google_exceptions.NotFound(name)
+
+
+def _write_files(tmp_path, count, size=1024):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"doc_{i}.txt"
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+
+def test_upload_files_sleeps_while_waiting_for_active(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch, processing_seconds=0.6)
+    paths = _write_files(tmp_path, 3)
+    wall, cpu = time.perf_counter(), time.process_time()
+    files, metadata, report = mag.upload_files(paths, poll_seconds=0.05, manifest=None)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    assert [f.state.name for f in files] == ["ACTIVE"] * 3 and report["failed"] == {}
+    assert wall >= 0.6
+    assert cpu < wall * 0.5, f"laço de espera ocupado: {cpu:.2f}s de CPU em {wall:.2f}s"
+
+
+def test_upload_files_survives_transient_get_file_errors(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch, processing_seconds=0.1)
+    paths = _write_files(tmp_path, 3)
+    original_get_file, failed = api.get_file, []
+
+    def flaky_get_file(name):
+        if not failed:
+            failed.append(name)
+            raise mag.google_exceptions.ServiceUnavailable("instável")
+        return original_get_file(name)
+
+    monkeypatch.setattr(mag.genai, "get_file", flaky_get_file)
+    files, _, report = mag.upload_files(paths, poll_seconds=0.02, manifest=None)
+    assert failed and report["failed"] == {} and [f.state.name for f in files] == ["ACTIVE"] * 3
+
+
+def test_upload_files_fails_only_the_file_that_cannot_be_polled(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch, processing_seconds=60)
+    paths = _write_files(tmp_path, 3)
+
+    def broken_get_file(name):
+        if api.files[name].display_name == "doc_1.txt":
+            raise mag.google_exceptions.ServiceUnavailable("fora do ar")
+        api.files[name].ready_at = 0  # a API concluiu o processamento dos demais
+        return api.files[name]
+
+    monkeypatch.setattr(mag.genai, "get_file", broken_get_file)
+    files, _, report = mag.upload_files(paths, poll_seconds=0.02, active_timeout=0.5, manifest=None)
+    assert [f.display_name for f in files] == ["doc_0.txt", "doc_2.txt"]
+    assert list(report["failed"]) == [paths[1]] and "fora do ar" in report["failed"][paths[1]]
+
+
+def test_upload_files_reuses_unchanged_content_via_manifest(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch)
+    paths = _write_files(tmp_path, 2)
+    manifest_path = str(tmp_path / "cache" / "manifest.json")
+    manifest = mag.UploadManifest(manifest_path)
+    first, _, report = mag.upload_files(paths, poll_seconds=0.01, manifest=manifest)
+    assert api.uploads == 2 and report["uploaded"] == 2 and report["reused"] == 0
+
+    # Nova sessão: o manifesto gravado em disco evita reenvio e recálculo do hash
+    reopened = mag.UploadManifest(manifest_path)
+    again, _, report = mag.upload_files(paths, poll_seconds=0.01, manifest=reopened)
+    assert api.uploads == 2 and report["reused"] == 2
+    assert [f.name for f in again] == [f.name for f in first]
+    assert reopened.counters == {"hash_skipped": 2}
+
+
+def test_upload_reuse_reuploads_when_remote_file_is_gone(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch)
+    (path,) = _write_files(tmp_path, 1)
+    manifest = mag.UploadManifest(str(tmp_path / "manifest.json"))
+    file_obj, reused = mag.upload_or_reuse_file(path, manifest=manifest)
+    assert not reused
+    api.files.clear()  # expirou ou foi removido na API
+    new_obj, reused = mag.upload_or_reuse_file(path, manifest=manifest)
+    assert not reused and api.uploads == 2 and file_obj.name not in manifest.names() and new_obj.name in manifest.names()
+
+
+def test_upload_reuse_matches_listed_files_by_sha256(tmp_path, monkeypatch):
+    import hashlib
+
+    api = _StubFileApi(monkeypatch)
+    (path,) = _write_files(tmp_path, 1)
+    digest = hashlib.sha256(open(path, "rb").read()).hexdigest()
+    listed = _StubFile("files/antigo", 0, mime_type=mag.get_mime_type_from_extension(path),
+                       sha256_hash=mag.base64.b64encode(digest.encode()).decode())
+    manifest = mag.UploadManifest(str(tmp_path / "manifest.json"))
+    file_obj, reused = mag.upload_or_reuse_file(path, remote_files={listed.name: listed}, manifest=manifest)
+    assert reused and file_obj is listed and api.uploads == 0 and manifest.names() == {"files/antigo"}
+
+
+def _remote_listing(manifest):
+    import datetime
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    files = []
+    for name, display_name, hours in (("files/a", "relatorio_1.md", 48), ("files/b", "relatorio_2.md", 1),
+                                      ("files/c", "dados.csv", 72), ("files/d", "sem_data.txt", None)):
+        file_obj = _StubFile(name, 0, display_name=display_name)
+        file_obj.create_time = now - datetime.timedelta(hours=hours) if hours is not None else None
+        files.append(file_obj)
+    manifest.record("abc", "text/markdown", files[0], 10)
+    return files
+
+
+def test_select_remote_files_filters(tmp_path):
+    manifest = mag.UploadManifest(str(tmp_path / "manifest.json"))
+    files = _remote_listing(manifest)
+    names = lambda selected: sorted(f.name for f in selected[0])
+    assert names(mag.select_remote_files(files, manifest=manifest)) == ["files/a", "files/b", "files/c", "files/d"]
+    assert names(mag.select_remote_files(files, older_than_hours=24, manifest=manifest)) == ["files/a", "files/c"]
+    assert names(mag.select_remote_files(files, name_pattern="relatorio_*.md", manifest=manifest)) == ["files/a", "files/b"]
+    assert names(mag.select_remote_files(files, name_pattern="files/c", manifest=manifest)) == ["files/c"]
+    assert names(mag.select_remote_files(files, in_manifest=True, manifest=manifest)) == ["files/a"]
+    assert names(mag.select_remote_files(files, older_than_hours=24, in_manifest=False, manifest=manifest)) == ["files/c"]
+
+
+def test_cleanup_remote_files_deletes_selected_and_updates_manifest(tmp_path, monkeypatch):
+    api = _StubFileApi(monkeypatch)
+    manifest = mag.UploadManifest(str(tmp_path / "manifest.json"))
+    files = _remote_listing(manifest)
+    api.files.update({f.name: f for f in files if f.name != "files/c"})  # files/c já não existe
+    dry = mag.cleanup_remote_files(files, older_than_hours=24, dry_run=True, manifest=manifest)
+    assert dry["would_delete"] == ["relatorio_1.md", "dados.csv"] and not api.deletes
+    report = mag.cleanup_remote_files(files, older_than_hours=24, manifest=manifest)
+    assert (report["deleted"], report["missing"], report["failed"]) == (1, 1, {})
+    assert sorted(api.deletes) == ["files/a", "files/c"] and manifest.names() == set()
+    assert sorted(f.name for f in report["remaining"]) == ["files/b", "files/d"]
+
+
+# --- Cache de Contexto (backend local) ---
+
+def _context_files(count=2):
+    files = [_StubFile(f"files/ctx{i}", 0) for i in range(count)]
+    for f in files:
+        f.size_bytes = 40000
+    return files
+
+
+def test_context_cache_is_opt_in():
+    assert mag.create_context_cache("off").backend is None
+    assert mag.create_context_cache("off").register(_context_files()) is None
+    assert os.getenv("MAG_CONTEXT_CACHE") or mag.CONTEXT_CACHE_BACKEND == "off"
+
+
+def test_split_file_prefix_handles_both_request_shapes():
+    files = _context_files()
+    names = tuple(f.name for f in files)
+    assert mag.split_file_prefix([*files, "tarefa"], names) == ["tarefa"]
+    messages = [{"role": "user", "parts": [*files, "tarefa"]}, {"role": "model", "parts": ["resposta"]}]
+    assert mag.split_file_prefix(messages, names) == [{"role": "user", "parts": ["tarefa"]}, messages[1]]
+    assert mag.split_file_prefix([files[0], "tarefa"], names) is None
+    assert mag.split_file_prefix([files[1], files[0], "tarefa"], names) is None
+    assert mag.split_file_prefix(["tarefa"], names) is None
+    assert mag._prepend_file_prefix(mag.split_file_prefix(messages, names), files) == messages
+
+
+def test_context_cache_refcount_release_deletes_after_last_workflow():
+    backend = mag.LocalContextCacheBackend()
+    cache = mag.ContextCache(backend, min_tokens=0)
+    files = _context_files()
+    first, second = cache.register(files), cache.register(files)
+    assert first == second
+    model, contents, entry = cache.resolve("modelo-inline", [*files, "tarefa"], None)
+    assert entry is not None and contents == ["tarefa"] and model != "modelo-inline"
+    cache.release(first)
+    assert backend.calls["delete"] == 0
+    assert cache.resolve("modelo-inline", [*files, "outra"], None)[2] is entry
+    cache.release(second)
+    assert backend.calls["delete"] == 1
+    assert cache.resolve("modelo-inline", [*files, "tarefa"], None) == ("modelo-inline", [*files, "tarefa"], None)
+
+
+def test_context_cache_small_prefix_stays_inline():
+    cache = mag.ContextCache(mag.LocalContextCacheBackend(), min_tokens=10 ** 9)
+    files = _context_files()
+    key = cache.register(files)
+    assert cache.resolve("m", [*files, "x"], None) == ("m", [*files, "x"], None)
+    assert cache.stats(key)["unsupported"] == 1 and cache.backend.calls["create"] == 0
+
+
+def test_context_cache_refreshes_ttl_near_expiry():
+    backend = mag.LocalContextCacheBackend()
+    cache = mag.ContextCache(backend, ttl_seconds=100, refresh_margin_seconds=50, min_tokens=0)
+    files = _context_files()
+    key = cache.register(files)
+    entry = cache.resolve("m", [*files, "x"], None)[2]
+    cache.resolve("m", [*files, "x"], None)
+    assert backend.calls["refresh"] == 0
+    entry["expires_at"] = time.monotonic() + 10
+    cache.resolve("m", [*files, "x"], None)
+    assert backend.calls["refresh"] == 1 and entry["expires_at"] > time.monotonic() + 90
+    assert cache.stats(key)["refreshed"] == 1
+
+
+def test_context_cache_invalidate_recreates_only_expired_caches():
+    backend = mag.LocalContextCacheBackend()
+    cache = mag.ContextCache(backend, min_tokens=0)
+    files = _context_files()
+    key = cache.register(files)
+    entry = cache.resolve("m", [*files, "x"], None)[2]
+    cache.invalidate(entry, mag.google_exceptions.NotFound("expirou"))
+    entry = cache.resolve("m", [*files, "x"], None)[2]
+    assert entry is not None and backend.calls["create"] == 2
+    cache.invalidate(entry, mag.google_exceptions.InvalidArgument("modelo sem suporte"))
+    assert backend.calls["delete"] == 1
+    assert cache.resolve("m", [*files, "x"], None)[2] is None
+    assert backend.calls["create"] == 2 and cache.stats(key)["fallbacks"] == 2
+
+
+def test_context_cache_deletes_cache_created_after_workflow_ended():
+    import threading
+
+    started, finish = threading.Event(), threading.Event()
+
+    class SlowBackend(mag.LocalContextCacheBackend):
+        def create(self, *args):
+            started.set()
+            finish.wait(5)
+            return super().create(*args)
+
+    backend = SlowBackend()
+    cache = mag.ContextCache(backend, min_tokens=0)
+    files = _context_files()
+    key = cache.register(files)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(cache.resolve("m", [*files, "x"], None)))
+    worker.start()
+    assert started.wait(5)
+    cache.release(key)  # o fluxo termina enquanto o cache ainda está sendo criado
+    finish.set()
+    worker.join(5)
+    assert backend.calls["create"] == 1 and backend.calls["delete"] == 1
+    assert not cache._entries
+
+
+def test_context_cache_records_tokens_saved():
+    cache = mag.ContextCache(mag.LocalContextCacheBackend(), min_tokens=0)
+    files = _context_files()
+    key = cache.register(files)
+    for _ in range(3):
+        entry = cache.resolve("m", [*files, "x"], None)[2]
+        cache.record_usage(entry, None)
+    stats = cache.stats(key)
+    assert stats["hits"] == 3 and stats["tokens_saved"] == 2 * stats["tokens_cached"]
+
+
+# --- Limitador de Taxa e Circuit Breaker ---
+
+def test_prompt_token_estimate_counts_uploaded_files_by_size():
+    big = _StubFile("files/grande", 0)
+    big.size_bytes = 4_000_000
+    tokens = mag._estimate_prompt_tokens([{"role": "user", "parts": [big, "resuma o arquivo"]}])
+    assert tokens >= 1_000_000
+
+
+def test_token_bucket_waits_when_tokens_exhausted():
+    limiter = mag.TokenBucketRateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    assert limiter.reserve(6000) == 0
+    wait = limiter.reserve(3000)
+    assert 25 < wait <= 30  # 3000 tokens a 100 tokens/s
+    limiter.pause(5)
+    assert limiter.reserve(0) > 4
+
+
+def test_circuit_breaker_half_open_allows_single_probe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mag.time, "monotonic", lambda: now[0])
+    breaker = mag.CircuitBreaker(failure_threshold=2, reset_seconds=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow_request()
+    now[0] += 11
+    assert breaker.allow_request()                       # sonda
+    assert not any(breaker.allow_request() for _ in range(5))
+    breaker.record_failure()                             # a sonda falhou: volta a abrir
+    assert breaker.state == "open" and not breaker.allow_request()
+    now[0] += 11
+    assert breaker.allow_request() and not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and all(breaker.allow_request() for _ in range(5))
+
+
+def test_circuit_breaker_stale_probe_is_replaced(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(mag.time, "monotonic", lambda: now[0])
+    breaker = mag.CircuitBreaker(failure_threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    now[0] += 11
+    assert breaker.allow_request() and not breaker.allow_request()
+    now[0] += 11  # a sonda nunca registrou o resultado
+    assert breaker.allow_request()
+
+
+def test_server_retry_delay_is_clamped():
+    assert mag.server_retry_delay(Exception("Quota exceeded, retry in 3600s")) == mag.MAX_RETRY_DELAY_SECONDS
+    assert mag.server_retry_delay(Exception("retry in 2.5s")) == 2.5
+    assert mag.server_retry_delay(Exception("sem dica")) is None
+
+
+# --- Plano de Tarefas (DAG) ---
+
+def test_task_graph_drops_cycles_duplicates_and_unknown_dependencies():
+    graph = mag.TaskGraph.from_plan([
+        {"id": 1, "description": "A", "depends_on": [2]},      # dependência para frente fecharia o ciclo 1 -> 2 -> 1
+        {"id": 2, "description": "B", "depends_on": [1, 1]},
+        {"id": 3, "description": "C", "depends_on": [99, 2]},  # 99 não existe
+        {"id": 2, "description": "B duplicada", "depends_on": []},
+        {"id": 4, "description": "D", "depends_on": 3},
+    ])
+    assert graph.order == [1, 2, 3, 4]
+    assert {task_id: graph.nodes[task_id]["depends_on"] for task_id in graph.order} == {1: [], 2: [1], 3: [2], 4: [3]}
+    assert graph.ancestors(4) == {1, 2, 3}
+    sequential = mag.TaskGraph.from_plan(["passo 1", "passo 2"])
+    assert [sequential.nodes[task_id]["depends_on"] for task_id in sequential.order] == [[], [1]]
+
+
+class _StubPlanWorker:
+    """Worker simulado: registra início/fim e o contexto recebido; falha nas tarefas indicadas."""
+
+    def __init__(self, fail=(), seconds=0.1):
+        self.fail, self.seconds = set(fail), seconds
+        self.events, self.contexts = [], {}
+        self._lock = mag.threading.Lock()
+
+    def _log(self, event, task, context=None):
+        with self._lock:
+            self.events.append((event, task))
+            if context is not None:
+                self.contexts[task] = [fragment[0] for fragment in context._fragments]
+
+    def execute_task(self, task, context, files_info, goal):
+        self._log("start", task, context)
+        time.sleep(self.seconds)
+        self._log("end", task)
+        if task in self.fail:
+            raise RuntimeError(f"falha simulada em {task}")
+        return {"text_content": f"ok: {task}"}, None
+
+    async def execute_task_async(self, task, context, files_info, goal):
+        import asyncio
+        self._log("start", task, context)
+        await asyncio.sleep(self.seconds)
+        self._log("end", task)
+        if task in self.fail:
+            raise RuntimeError(f"falha simulada em {task}")
+        return {"text_content": f"ok: {task}"}, None
+
+
+def _stub_plan_manager(monkeypatch, worker):
+    manager = mag.TaskManager("meta", [], [])
+    monkeypatch.setattr(manager.router, "route_task", lambda task, context: ("text_worker", "stub"))
+
+    async def route_task_async(task, context):
+        return "text_worker", "stub"
+
+    monkeypatch.setattr(manager.router, "route_task_async", route_task_async)
+    manager.worker_map = {"text_worker": worker}
+    return manager
+
+
+_FAN_PLAN = [
+    {"id": 1, "description": "raiz", "depends_on": []},
+    {"id": 2, "description": "ramo a", "depends_on": [1]},
+    {"id": 3, "description": "ramo b", "depends_on": [1]},
+    {"id": 4, "description": "ramo c", "depends_on": [1]},
+    {"id": 5, "description": "junção", "depends_on": [2, 3, 4]},
+]
+
+
+def _run_plan(manager, plan, use_async):
+    import asyncio
+    graph = mag.TaskGraph.from_plan(plan)
+    return asyncio.run(manager.execute_plan_async(graph)) if use_async else manager.execute_plan(graph)
+
+
+def test_execute_plan_fans_out_in_parallel_and_fans_in_after_all_branches(monkeypatch):
+    for use_async in (False, True):
+        worker = _StubPlanWorker()
+        plan_run = _run_plan(_stub_plan_manager(monkeypatch, worker), _FAN_PLAN, use_async)
+        position = {event: index for index, event in enumerate(worker.events)}
+        branches = ["ramo a", "ramo b", "ramo c"]
+        assert all(position[("start", branch)] > position[("end", "raiz")] for branch in branches)
+        # Os ramos independentes rodam juntos: todos começam antes de qualquer um terminar
+        assert max(position[("start", branch)] for branch in branches) < min(position[("end", branch)] for branch in branches)
+        assert position[("start", "junção")] > max(position[("end", branch)] for branch in branches)
+        assert worker.contexts["junção"] == ["raiz", "ramo a", "ramo b", "ramo c"]
+        assert worker.contexts["ramo b"] == ["raiz"]
+        assert plan_run.report()["failed"] == [] and len(plan_run.results) == 5
+
+
+def test_failed_prerequisite_blocks_its_dependents(monkeypatch):
+    plan = _FAN_PLAN + [{"id": 6, "description": "depois da junção", "depends_on": [5]},
+                        {"id": 7, "description": "independente", "depends_on": []}]
+    for use_async in (False, True):
+        worker = _StubPlanWorker(fail={"ramo b"}, seconds=0.01)
+        manager = _stub_plan_manager(monkeypatch, worker)
+        plan_run = _run_plan(manager, plan, use_async)
+        started = {task for event, task in worker.events if event == "start"}
+        assert started == {"raiz", "ramo a", "ramo b", "ramo c", "independente"}
+        report = plan_run.report()
+        assert report["failed"] == ["ramo b"] and report["blocked"] == ["junção", "depois da junção"]
+        assert plan_run.results[3]["error"] == "falha simulada em ramo b"
+        recorded = {task: result["text_content"] for entry in manager.executed_tasks_results for task, result in entry.items()}
+        assert recorded["junção"] == "Tarefa não executada: depende de 'ramo b', que falhou."
+        assert recorded["independente"] == "ok: independente"
+
+
+# --- Execução em Lote ---
+
+def test_load_batch_goals_parses_objects_text_and_skips_invalid(tmp_path):
+    batch = tmp_path / "lote.jsonl"
+    batch.write_text('# comentário\n{"goal": "Resumir", "id": "a", "approval": "plan-only"}\n'
+                     'Meta em texto puro\n\n{"id": "sem_meta"}\n["lista"]\n', encoding="utf-8")
+    goals = mag.load_batch_goals(str(batch))
+    assert goals == [{"goal": "Resumir", "id": "a", "approval": "plan-only"},
+                     {"goal": "Meta em texto puro", "id": "meta_3"}]
+
+
+def test_batch_approval_policy():
+    graph = type("Graph", (), {"order": ["t1", "t2", "t3"]})()
+    assert mag.batch_approval_policy("auto")(graph)[0]
+    assert not mag.batch_approval_policy("plan-only")(graph)[0]
+    assert mag.batch_approval_policy("MAX-TASKS:3")(graph)[0]
+    assert not mag.batch_approval_policy("max-tasks:2")(graph)[0]
+    for invalid in ("max-tasks:x", "sempre"):
+        try:
+            mag.batch_approval_policy(invalid)
+        except ValueError:
+            continue
+        raise AssertionError(invalid)
+
+
+def test_run_batch_cli_reports_unreadable_file(tmp_path, capsys):
+    args = mag.parse_cli_args(["--batch", str(tmp_path / "nao_existe.jsonl")])
+    assert mag.run_batch_cli(args) == 1
+    assert "nao_existe.jsonl" in capsys.readouterr().out
+
+
+def test_run_batch_keeps_process_totals_out_of_goal_records(tmp_path):
+    import asyncio
+    import json
+
+    class FakeManager:
+        def __init__(self, goal, files, files_meta):
+            self.goal, self.executed_tasks_results = goal, [{"tarefa": {"text_content": goal.upper()}}]
+            self.last_run_report = {"wall_time": 0.1}
+
+        async def run_workflow_async(self, approval_policy):
+            return object() if approval_policy(type("Graph", (), {"order": ["t"]})())[0] else None
+
+    output = tmp_path / "resultados.jsonl"
+    goals = [{"id": "a", "goal": "um"}, {"id": "b", "goal": "dois", "approval": "plan-only"}]
+    summary = asyncio.run(mag.run_batch_async(goals, str(output), 2, "auto", manager_factory=FakeManager))
+    assert summary["statuses"] == {"completed": 1, "not_approved": 1} and "api_calls" in summary["global_totals"]
+    records = {r["id"]: r for r in map(json.loads, output.read_text(encoding="utf-8").splitlines())}
+    assert records["a"]["results"] == [{"task": "tarefa", "text": "UM"}] and records["a"]["report"] == {"wall_time": 0.1}
+    assert records["b"]["status"] == "not_approved"
+
+
+# --- Cache de Buscas ---
+
+def _ok_results(n):
+    return [{"title": f"T{i}", "url": f"https://exemplo.com/{i}", "snippet": "s"} for i in range(n)]
+
+
+def test_search_cache_reuses_normalized_queries(tmp_path):
+    cache = mag.SearchCache(directory=str(tmp_path))
+    calls = []
+    search = lambda n: calls.append(n) or _ok_results(n)
+    assert cache.get_or_search("Python  GIL?", 5, search)[1] == "search"
+    assert cache.get_or_search("python gil", 3, search) == (_ok_results(3), "cache")
+    assert cache.get_or_search("python gil", 8, search)[1] == "search"
+    assert calls == [5, 8]
+
+
+def test_search_cache_keeps_failures_briefly_and_off_disk(tmp_path, monkeypatch):
+    cache = mag.SearchCache(directory=str(tmp_path), persistent=True)
+    failed = _ok_results(2)
+    failed[1]["error"] = "TimeoutError"
+    for query, results in (("vazia", []), ("parcial", failed)):
+        assert cache.get_or_search(query, 2, lambda n: results)[1] == "search"
+        assert cache.get_or_search(query, 2, lambda n: results)[1] == "cache"
+    assert not list(tmp_path.iterdir())
+    later = time.time() + mag.SEARCH_CACHE_NEGATIVE_TTL_SECONDS + 1
+    monkeypatch.setattr(mag.time, "time", lambda: later)
+    assert cache.get_or_search("parcial", 2, lambda n: _ok_results(n))[1] == "search"
+    assert cache.get_or_search("parcial", 2, lambda n: []) == (_ok_results(2), "cache")
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_search_cache_reads_persisted_results(tmp_path):
+    mag.SearchCache(directory=str(tmp_path), persistent=True).get_or_search("consulta", 3, _ok_results)
+    cache = mag.SearchCache(directory=str(tmp_path), persistent=True)
+    assert cache.get_or_search("Consulta", 2, lambda n: []) == (_ok_results(2), "cache")
+    assert cache.stats() == {"disk_hits": 1}
+
+
+def test_search_cache_coalesces_concurrent_queries():
+    import threading
+
+    cache = mag.SearchCache()
+    release, calls = threading.Event(), []
+
+    def slow_search(n):
+        calls.append(n)
+        release.wait(5)
+        return _ok_results(n)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_search("mesma", 3, slow_search)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [3] and sorted(origin for _, origin in results) == ["coalesced"] * 3 + ["search"]
+
+
+# --- Log em Segundo Plano ---
+
+def _log_record(i):
+    return {"ts": time.time(), "agent": "Teste", "message": f"mensagem {i}", "level": "INFO"}
+
+
+def _stalled_log_writer(tmp_path, monkeypatch):
+    """Writer com a gravação travada e a fila (tamanho 1) cheia; retorna (writer, evento que libera a gravação)."""
+    import threading
+
+    release, writing = threading.Event(), threading.Event()
+    writer = mag.BackgroundLogWriter(str(tmp_path / "log.txt"), str(tmp_path / "log.jsonl"), queue_size=1)
+    original_write = writer._write
+    monkeypatch.setattr(writer, "_write", lambda records: (writing.set(), release.wait(5), original_write(records)))
+    writer.submit(_log_record(0))
+    assert writing.wait(5)
+    writer.submit(_log_record(1))
+    return writer, release
+
+
+def test_log_writer_counts_drops_from_many_threads(tmp_path, monkeypatch):
+    import threading
+
+    writer, release = _stalled_log_writer(tmp_path, monkeypatch)
+    threads = [threading.Thread(target=lambda: [writer.submit(_log_record(i)) for i in range(2000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.dropped == 8 * 2000
+    release.set()
+    assert writer.close()
+
+
+def test_log_writer_close_does_not_block_on_full_queue(tmp_path, monkeypatch):
+    writer, release = _stalled_log_writer(tmp_path, monkeypatch)
+    start = time.monotonic()
+    assert writer.close(timeout=0.2) is False
+    assert time.monotonic() - start < 2
+    release.set()
+    assert writer.close() and "mensagem 1" in (tmp_path / "log.txt").read_text(encoding="utf-8")
+
+
+# --- Roteamento ---
+
+_ROUTER_SAMPLES = [
+    ("escreva um artigo sobre historia", "text_worker"),
+    ("escreva um artigo sobre o clima", "text_worker"),
+    ("redija um artigo sobre economia", "text_worker"),
+    ("gere uma imagem de um gato", "image_worker"),
+    ("crie uma ilustracao de um robo", "image_worker"),
+]
+
+
+def _router(monkeypatch, tmp_path, samples=()):
+    monkeypatch.setattr(mag, "ROUTING_LOG_FILE", str(tmp_path / "routing.jsonl"))
+    router = mag.RouterAgent()
+    router.local_model = mag.LocalRoutingModel().fit(samples)
+    return router
+
+
+def _fake_router_llm(monkeypatch, agent_type):
+    calls = []
+    response = type("Response", (), {"text": f'{{"agent_type": "{agent_type}", "reasoning": "llm"}}'})()
+    monkeypatch.setattr(mag, "call_gemini_api_with_retry", lambda *args, **kwargs: calls.append(args) or response)
+    return calls
+
+
+def test_router_rules_alone_do_not_route(monkeypatch, tmp_path):
+    router = _router(monkeypatch, tmp_path)
+    calls = _fake_router_llm(monkeypatch, "text_worker")
+    assert router.route_task("Artigo sobre imagens de satélite") == ("text_worker", "llm")
+    assert len(calls) == 1 and router.stats() == {"llm": 1}
+    assert router.route_task("artigo sobre imagens de satelite!") == ("text_worker", "llm")
+    assert len(calls) == 1 and router.stats() == {"llm": 1, "memo": 1}
+
+
+def test_router_rule_is_a_prior_for_the_local_model(monkeypatch, tmp_path):
+    router = _router(monkeypatch, tmp_path, _ROUTER_SAMPLES * 5)
+    calls = _fake_router_llm(monkeypatch, "text_worker")
+    assert router.route_task("Gere uma imagem de um cachorro")[0] == "image_worker"
+    assert router.route_task("Escreva um artigo sobre imagens de satélite")[0] == "text_worker"
+    assert router.route_task("Escreva um artigo sobre o oceano")[0] == "text_worker"
+    assert not calls and router.stats() == {"rules": 1, "model": 2}
+
+
+def test_router_low_confidence_falls_back_to_llm(monkeypatch, tmp_path):
+    router = _router(monkeypatch, tmp_path, _ROUTER_SAMPLES * 5)
+    router.confidence_threshold = 1.01
+    calls = _fake_router_llm(monkeypatch, "image_worker")
+    assert router.route_task("Gere uma imagem de um cachorro") == ("image_worker", "llm")
+    assert len(calls) == 1 and router.stats() == {"llm": 1}
+
+
+# --- Cache HTTP (servidor local) ---
+
+class _LocalSite:
+    """Servidor HTTP em thread; pages: caminho -> (status, cabeçalhos, corpo). Conta as requisições por caminho."""
+
+    def __init__(self, pages):
+        import http.server
+        import threading
+
+        self.pages, self.requests = pages, mag.Counter()
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests[self.path] += 1
+                status, headers, body = site.pages.get(self.path, (404, {}, b"nada"))
+                if headers.get("ETag") and self.headers.get("If-None-Match") == headers["ETag"]:
+                    status, body = 304, b""
+                self.send_response(status)
+                for name, value in {"Content-Type": "text/html; charset=utf-8", **headers}.items():
+                    self.send_header(name, value)
+                if callable(body):  # corpo gerado aos poucos pelo teste, até o cliente desistir
+                    self.close_connection = True
+                    self.end_headers()
+                    try:
+                        body(self.wfile)
+                    except OSError:
+                        pass
+                    return
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_title_fetch_deadline_frees_shared_workers():
+    def trickle(wfile):
+        for _ in range(100):
+            wfile.write(b"<!-- " + b"x" * 100 + b" -->")
+            wfile.flush()
+            time.sleep(0.1)
+
+    pages = {f"/lento{i}": (200, {}, trickle) for i in range(mag.SEARCH_TITLE_MAX_WORKERS)}
+    pages["/rapido"] = (200, {}, "<html><title>Rápido</title></html>".encode())
+    site = _LocalSite(pages)
+    try:
+        start = time.monotonic()
+        slow = mag.fetch_page_titles([f"{site.url}/lento{i}" for i in range(mag.SEARCH_TITLE_MAX_WORKERS)], deadline=0.5)
+        assert all(isinstance(outcome, Exception) for outcome in slow.values())
+        assert time.monotonic() - start < 1.5
+        # Os workers compartilhados liberam-se no prazo da busca anterior em vez de seguirem lendo os servidores lentos
+        fast = mag.fetch_page_titles([f"{site.url}/rapido"], deadline=2.0)
+        assert fast[f"{site.url}/rapido"] == (200, "Rápido")
+    finally:
+        site.close()
+
+
+def _cached_page(size, max_age=3600):
+    return 200, {"Cache-Control": f"max-age={max_age}"}, b"x" * size
+
+
+def test_http_cache_hits_and_revalidates(tmp_path):
+    site = _LocalSite({"/fresh": _cached_page(100), "/etag": (200, {"Cache-Control": "no-cache", "ETag": '"v1"'}, b"corpo")})
+    try:
+        cache = mag.HttpCache(str(tmp_path))
+        assert cache.fetch(site.url + "/fresh").cache_status == "miss"
+        assert cache.fetch(site.url + "/fresh").cache_status == "hit"
+        assert cache.fetch(site.url + "/etag").cache_status == "miss"
+        revalidated = cache.fetch(site.url + "/etag")
+        assert revalidated.cache_status == "revalidated" and revalidated.content == b"corpo"
+        assert site.requests == {"/fresh": 1, "/etag": 2}
+    finally:
+        site.close()
+
+
+def test_http_cache_evicts_least_recently_used_from_memory_index(tmp_path, monkeypatch):
+    site = _LocalSite({f"/p{i}": _cached_page(1000) for i in range(4)})
+    try:
+        cache = mag.HttpCache(str(tmp_path))
+        for i in range(3):
+            cache.fetch(f"{site.url}/p{i}")
+        cache.max_bytes = cache._total_bytes + 500  # cabem três entradas (corpo + metadados), não quatro
+        cache.fetch(f"{site.url}/p0")  # hit: p0 passa a ser a mais recente
+        monkeypatch.setattr(mag.glob, "glob", lambda *args: (_ for _ in ()).throw(AssertionError("varredura do disco")))
+        cache.fetch(f"{site.url}/p3")
+        assert cache.stats()["evictions"] == 1
+        assert [cache.fetch(f"{site.url}/p{i}").cache_status for i in (0, 3)] == ["hit", "hit"]
+        assert cache._load(cache.make_key(f"{site.url}/p1")) is None
+        monkeypatch.undo()
+        on_disk = sum(p.stat().st_size for p in tmp_path.rglob("*") if p.is_file())
+        assert on_disk == cache._total_bytes <= cache.max_bytes
+
+        # Nova instância: o índice é montado uma vez a partir do disco, na ordem LRU dos mtimes
+        reopened = mag.HttpCache(str(tmp_path), max_bytes=cache.max_bytes)
+        reopened.store_derived(reopened.fetch(f"{site.url}/p0"), "page_text", "y" * 1500)
+        assert reopened._total_bytes <= reopened.max_bytes
+        assert reopened._load(reopened.make_key(f"{site.url}/p0")).derived["page_text"] == "y" * 1500
+    finally:
+        site.close()
+
+
+# --- Streaming no Console ---
+
+def _stream_chunk(text):
+    part = type("Part", (), {"text": text, "function_call": None})()
+    content = type("Content", (), {"parts": [part]})()
+    return type("Chunk", (), {"candidates": [type("Candidate", (), {"content": content})()]})()
+
+
+def test_parallel_streams_do_not_interleave_on_console(capsys):
+    import threading
+
+    barrier = threading.Barrier(3)
+
+    def stream(agent):
+        printer = mag.StreamPrinter(agent)
+        for i in range(50):
+            barrier.wait(5)
+            printer.on_chunk(_stream_chunk(f"<{agent}:{i}>"))
+        printer.finish(None)
+
+    threads = [threading.Thread(target=stream, args=(agent,)) for agent in ("A", "B", "C")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    lines = [line for line in capsys.readouterr().out.splitlines() if "(stream)" in line]
+    assert sorted(line.split("]")[0] for line in lines) == ["🤖 [A", "🤖 [B", "🤖 [C"]
+    for line in lines:
+        agent = line.split("[")[1].split("]")[0]
+        assert line.endswith("".join(f"<{agent}:{i}>" for i in range(50)))
+    assert mag._STREAM_FOCUS is None
+
+
+def test_interrupted_stream_releases_console_and_drops_partial_text(capsys):
+    live, waiting = mag.StreamPrinter("Vivo"), mag.StreamPrinter("Espera")
+    live.on_chunk(_stream_chunk("parcial"))
+    waiting.on_chunk(_stream_chunk("descartado"))
+    waiting.on_interrupted(TimeoutError())
+    live.on_interrupted(TimeoutError())
+    retry = mag.StreamPrinter("Espera")
+    retry.on_chunk(_stream_chunk("completo"))
+    retry.finish(None)
+    out = capsys.readouterr().out
+    assert "descartado" not in out and "🤖 [Espera] (stream): completo" in out
+    assert "⚠️ [Vivo]: stream interrompido" in out and "Espera]: stream interrompido" not in out
+
+
+# --- Crawl ---
+
+def test_crawl_coalesces_robots_and_records_page_failures(tmp_path, monkeypatch):
+    links = "".join(f'<a href="/p{i}">p{i}</a>' for i in range(6))
+    pages = {"/": (200, {}, f"<html><title>Início</title><body>{links}</body></html>".encode())}
+    pages.update({f"/p{i}": (200, {}, f"<html><title>P{i}</title><body>texto {i}</body></html>".encode()) for i in range(6)})
+    pages["/p3"] = (200, {}, b"<html><title>quebrada</title></html>")
+    pages["/robots.txt"] = (200, {"Content-Type": "text/plain"}, b"User-agent: *\nDisallow: /p5\n")
+    site = _LocalSite(pages)
+    original_extract = mag.extract_page_text
+
+    def extract(content, *args, **kwargs):
+        if b"quebrada" in content:
+            raise ValueError("HTML inesperado")
+        return original_extract(content, *args, **kwargs)
+
+    try:
+        monkeypatch.setattr(mag, "extract_page_text", extract)
+        monkeypatch.setattr(mag, "ROBOTS_CACHE", mag.RobotsCache())
+        monkeypatch.setattr(mag, "PAGE_CACHE", mag.PageCache())
+        monkeypatch.setattr(mag, "HTTP_CACHE", mag.HttpCache(str(tmp_path), enabled=False))
+        visited, stats = mag.crawl_site(site.url + "/", max_depth=1, max_pages=20, host_delay=0)
+        assert sorted(p["url"].rsplit("/", 1)[1] for p in visited) == ["", "p0", "p1", "p2", "p4"]
+        assert stats["errors"] == 1 and list(stats["failures"]) == [site.url + "/p3"]
+        assert "ValueError" in stats["failures"][site.url + "/p3"] and stats["robots"] == 1
+        assert site.requests["/robots.txt"] == 1 and mag.ROBOTS_CACHE.counters["fetches"] == 1
+    finally:
+        site.close()
+
+
+def test_robots_cache_downloads_once_for_concurrent_callers(monkeypatch):
+    import threading
+
+    release, downloads = threading.Event(), []
+
+    def slow_download(origin):
+        downloads.append(origin)
+        release.wait(5)
+        parser = mag.urllib.robotparser.RobotFileParser()
+        parser.allow_all = True
+        return parser
+
+    cache = mag.RobotsCache()
+    monkeypatch.setattr(cache, "_download", slow_download)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.allowed("https://exemplo.com/x"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True] * 8 and downloads == ["https://exemplo.com"]
+
+
+# --- Cache de Respostas ---
+
+def _api_response(text):
+    proto = mag.genai.protos.GenerateContentResponse({"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]})
+    return mag.genai.types.GenerateContentResponse.from_response(proto)
+
+
+def test_response_cache_roundtrip_ttl_and_lru(tmp_path, monkeypatch):
+    cache = mag.ResponseCache(str(tmp_path), ttl_seconds=60)
+    key = cache.make_key(["olá"], "modelo-a", None, None, {"temperature": 0.3})
+    assert key != cache.make_key(["olá"], "modelo-b", None, None, {"temperature": 0.3})
+    assert key != cache.make_key(["olá"], "modelo-a", None, None, {"temperature": 0.9})
+    assert cache.get(key) is None
+    cache.put(key, _api_response("resposta"))
+    assert cache.get(key).text == "resposta"
+
+    later = time.time() + 61
+    monkeypatch.setattr(mag.time, "time", lambda: later)
+    assert cache.get(key) is None and not list(tmp_path.rglob("*.json"))
+    monkeypatch.undo()
+
+    keys = [cache.make_key([f"p{i}"], "m", None, None, {}) for i in range(3)]
+    cache.put(keys[0], _api_response("x" * 200))
+    cache.max_bytes = 2 * next(tmp_path.rglob("*.json")).stat().st_size + 10
+    cache.put(keys[1], _api_response("x" * 200))
+    assert cache.get(keys[0])  # p0 acessado por último
+    monkeypatch.setattr(mag.glob, "glob", lambda *args: (_ for _ in ()).throw(AssertionError("varredura do disco")))
+    cache.put(keys[2], _api_response("x" * 200))
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) and cache.get(keys[2])
+    assert cache.stats()["Sistema"]["evictions"] == 1
+    monkeypatch.undo()
+    on_disk = sum(p.stat().st_size for p in tmp_path.rglob("*.json"))
+    assert on_disk == cache._total_bytes <= cache.max_bytes
+    reopened = mag.ResponseCache(str(tmp_path))
+    assert reopened._total_bytes == on_disk and set(reopened._index) == {keys[0], keys[2]}
+
+
+def test_response_cache_concurrent_puts_keep_index_consistent(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = mag.ResponseCache(str(tmp_path))
+    cache.put("00" * 32, _api_response("x" * 200))
+    cache.max_bytes = 5 * cache._total_bytes
+    keys = [f"{i:064x}" for i in range(60)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda key: (cache.put(key, _api_response("x" * 200)), cache.get(key)), keys * 2))
+    on_disk = {p.name[:-len(".json")]: p.stat().st_size for p in tmp_path.rglob("*.json")}
+    assert on_disk == dict(cache._index) and sum(on_disk.values()) == cache._total_bytes <= cache.max_bytes
+
+
+# --- Páginas da Sessão ---
+
+def test_page_cache_reuses_normalized_urls_and_evicts_by_memory(tmp_path, monkeypatch):
+    body = lambda i: f"<html><title>P{i}</title><body><p>{'texto ' * 300}</p></body></html>".encode()
+    site = _LocalSite({f"/p{i}": (200, {}, body(i)) for i in range(3)})
+    try:
+        monkeypatch.setattr(mag, "HTTP_CACHE", mag.HttpCache(str(tmp_path), enabled=False))
+        cache = mag.PageCache()
+        page = cache.get(site.url + "/p0")
+        assert cache.get(site.url.upper().replace("HTTP://", "http://") + "/p0#topo") is page
+        assert page.text()[0] == "P0" and site.requests["/p0"] == 1
+        cache.update_size(site.url + "/p0")
+        cache.max_bytes = 2 * len(body(1)) + 100  # o texto extraído de p0 conta na memória
+        cache.get(site.url + "/p1")
+        cache.get(site.url + "/p2")
+        assert cache.stats()["evictions"] >= 1 and [p.url for p in cache.pages()][-1] == site.url + "/p2"
+        assert site.url + "/p0" not in [p.url for p in cache.pages()]
+        assert cache.stats()["hits"] == 1
+    finally:
+        site.close()